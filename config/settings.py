@@ -59,8 +59,10 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'produtividade.middleware.IdentidadeMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'produtividade.middleware.AuditoriaMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -168,6 +170,14 @@ PASSWORD_CHANGE_DONE_URL = '/accounts/login/'
 # Segurança da API
 DJANGO_API_KEY = os.getenv('DJANGO_API_KEY')
 
+# APIs externas de feriados e localidades (sobrescrevíveis para testes offline)
+FERIADOS_API_URL = os.getenv('FERIADOS_API_URL', 'https://www.feriadosapi.com/api/v1')
+IBGE_API_URL = os.getenv('IBGE_API_URL', 'https://servicodados.ibge.gov.br/api/v1')
+
+# Retenção da auditoria: meses mantidos no banco e pasta do arquivo morto (gzip JSONL)
+AUDITORIA_RETENCAO_MESES = int(os.getenv('AUDITORIA_RETENCAO_MESES', '12'))
+AUDITORIA_ARQUIVO_DIR = os.getenv('AUDITORIA_ARQUIVO_DIR', str(BASE_DIR / 'arquivo_auditoria'))
+
 # Configurações CORS
 CORS_ALLOWED_ORIGINS = [
     "http://127.0.0.1:8081",  # Local do Dashboard PHP
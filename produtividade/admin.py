@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import Projeto, Colaborador, Veiculo, Apontamento, Setor, CodigoCliente, CentroCusto, Feriado, LogAuditoria
+from .models import Projeto, Colaborador, Veiculo, Apontamento, Setor, CodigoCliente, CentroCusto, Feriado, LogAuditoria, TarefaAgendada, Municipio, InconsistenciaApontamento, ContadorSetor
 
 # ==============================================================================
 # CADASTROS AUXILIARES
@@ -63,6 +63,13 @@ class FeriadoAdmin(admin.ModelAdmin):
     search_fields = ('cidade', 'descricao')
     list_filter = ('uf', 'cidade', 'data')
 
+@admin.register(Municipio)
+class MunicipioAdmin(admin.ModelAdmin):
+    """Tabela de códigos IBGE usada pela importação de feriados."""
+    list_display = ('nome', 'uf', 'codigo_ibge')
+    search_fields = ('nome', 'codigo_ibge')
+    list_filter = ('uf',)
+
 # ==============================================================================
 # REGISTRO PRINCIPAL (CORE)
 # ==============================================================================
@@ -199,4 +206,46 @@ class LogAuditoriaAdmin(admin.ModelAdmin):
         return False
 
     def has_delete_permission(self, request, obj=None):
-        return False
\ No newline at end of file
+        return False
+
+
+# ==============================================================================
+# AUDITORIA DE CONSISTÊNCIA
+# ==============================================================================
+
+@admin.register(InconsistenciaApontamento)
+class InconsistenciaApontamentoAdmin(admin.ModelAdmin):
+    """Achados do comando `auditar_consistencia`."""
+    list_display = ('data_referencia', 'tipo', 'colaborador', 'apontamento', 'apontamento_relacionado', 'minutos', 'corrigido')
+    list_filter = ('tipo', 'corrigido', 'data_referencia')
+    search_fields = ('colaborador__nome_completo', 'detalhes', 'id_agrupamento')
+    raw_id_fields = ('apontamento', 'apontamento_relacionado')
+    readonly_fields = [field.name for field in InconsistenciaApontamento._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ContadorSetor)
+class ContadorSetorAdmin(admin.ModelAdmin):
+    """Contadores desnormalizados; correções via comando `reconciliar_contadores`."""
+    list_display = ('setor', 'pendentes', 'ajustes_pendentes', 'alertas_clt', 'atualizado_em')
+    readonly_fields = [field.name for field in ContadorSetor._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+
+# ==============================================================================
+# AGENDADOR DE ROTINAS
+# ==============================================================================
+
+@admin.register(TarefaAgendada)
+class TarefaAgendadaAdmin(admin.ModelAdmin):
+    """Estado das rotinas executadas pelo comando `agendador`."""
+    list_display = ('nome', 'ultima_execucao', 'ultima_duracao_segundos', 'ultimo_status', 'total_execucoes')
+    list_filter = ('ultimo_status',)
+    readonly_fields = [field.name for field in TarefaAgendada._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
@@ -1,21 +1,25 @@
 from django.shortcuts import get_object_or_404
-from django.http import JsonResponse
-from django.db import connection
-from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse, StreamingHttpResponse
+from django.db import connection, transaction, IntegrityError
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_POST, require_GET, etag
+from django.views.decorators.cache import cache_control
 from django.conf import settings
 from django.core.cache import cache
 from django.utils import timezone
 from datetime import datetime, date, timedelta
+from asgiref.sync import sync_to_async
 import calendar
 import os
 import requests
 
-from .services import ControlePontoService, FeriadoService
-from .models import Projeto, Colaborador, Veiculo, CentroCusto, Apontamento, Notificacao
-from .utils import is_owner, registrar_log, calcular_regras_clt, get_data_contabil
-from .forms import ApontamentoForm
+from .services import ControlePontoService, FeriadoService, TrilhaAuditoriaService, CatalogoService, TimersAtivosService, EncerramentoTimersService, VersaoApontamentoService, ConflitoVersao
+from .models import Projeto, Colaborador, CentroCusto, Apontamento, Notificacao
+from .utils import is_owner, registrar_log, calcular_regras_clt
+from .forms import InicioCronometroForm
+from .identidade import obter_identidade
+from .eventos import fluxo_eventos
 
 # ==============================================================================
 # APIS DE CONSULTA
@@ -35,8 +39,15 @@ def get_projeto_info_ajax(request, projeto_id):
 
 @login_required
 def get_colaborador_info_ajax(request, colaborador_id):
-    colaborador = get_object_or_404(Colaborador, pk=colaborador_id)
-    return JsonResponse({'cargo': colaborador.cargo})
+    cache_key = f'colaborador_info_{colaborador_id}'
+    cargo = cache.get(cache_key)
+
+    if cargo is None:
+        colaborador = get_object_or_404(Colaborador, pk=colaborador_id)
+        cargo = colaborador.cargo
+        cache.set(cache_key, cargo, 43200)
+
+    return JsonResponse({'cargo': cargo})
 
 @login_required
 def get_auxiliares_ajax(request):
@@ -45,13 +56,59 @@ def get_auxiliares_ajax(request):
     
     if not auxs:
         auxs = list(Colaborador.objects.filter(
-            cargo__in=['AUXILIAR TECNICO', 'OFICIAL DE SISTEMAS']
+            cargo__in=CatalogoService.CARGOS_AUXILIARES
         ).values('id', 'nome_completo'))
         
         cache.set(cache_key, auxs, 43200)
         
     return JsonResponse({'auxiliares': auxs})
 
+@login_required
+@user_passes_test(is_owner)
+def buscar_usuarios_ajax(request):
+    """Autocomplete de usuários do filtro da auditoria (?q=prefixo)."""
+    return JsonResponse({'usuarios': TrilhaAuditoriaService.buscar_usuarios(request.GET.get('q', ''))})
+
+@login_required
+def buscar_catalogo_ajax(request, catalogo):
+    """
+    Autocomplete dos selects do apontamento (formato Select2).
+    ?q=prefixo&page=N para buscar; ?ids=1,2 para obter o texto de opções já escolhidas.
+    """
+    if catalogo not in CatalogoService.CATALOGOS:
+        return JsonResponse({'error': 'Catálogo inválido.'}, status=404)
+
+    # Colaboradores: cada perfil só enxerga quem já poderia escolher no formulário
+    escopo_ids = None
+    if catalogo == 'colaboradores' and not request.identidade.is_owner:
+        identidade = request.identidade
+        if identidade.is_administrativo:
+            escopo_ids = identidade.colaboradores_visiveis_ids
+        else:
+            escopo_ids = [identidade.colaborador_id] if identidade.colaborador_id else []
+
+    ids = request.GET.get('ids')
+    if ids:
+        return JsonResponse(CatalogoService.rotulos(catalogo, ids.split(','), escopo_ids))
+
+    try:
+        pagina = int(request.GET.get('page', 1))
+    except ValueError:
+        pagina = 1
+    return JsonResponse(CatalogoService.buscar(catalogo, request.GET.get('q', ''), pagina, escopo_ids))
+
+@login_required
+@require_GET
+@cache_control(private=True, no_cache=True)
+@etag(lambda request: CatalogoService.versao_snapshot())
+def api_catalogo(request):
+    """
+    Snapshot dos catálogos do formulário (projetos, clientes, centros de custo, veículos, auxiliares).
+    O ETag é o hash das versões dos catálogos: o navegador revalida a cada uso
+    (no-cache) e recebe 304 sem corpo enquanto nenhum sinal invalidar os cadastros.
+    """
+    return JsonResponse(CatalogoService.snapshot())
+
 @login_required
 def get_centro_custo_info_ajax(request, cc_id):
     cache_key = f'cc_info_{cc_id}'
@@ -75,77 +132,43 @@ def api_iniciar_cronometro(request):
     Inicia o timer (Check-in)
     """
     try:
-        colaborador = Colaborador.objects.get(user_account=request.user)
+        colaborador = request.identidade.obter_colaborador()
     except Colaborador.DoesNotExist:
         return JsonResponse({'success': False, 'error': 'Usuário sem perfil de colaborador vinculado.'})
 
-    if Apontamento.objects.filter(colaborador=colaborador, hora_termino__isnull=True).exists():
-        return JsonResponse({'success': False, 'error': 'Você já possui uma atividade em andamento.'})
-
     dados = request.POST.copy()
-    dados['tipo_acao'] = 'START'
-    
-    agora = timezone.localtime(timezone.now())
-    dados['hora_inicio'] = agora.strftime('%H:%M')
-    
-    form = ApontamentoForm(dados, user=request.user)
-
-    if form.is_valid():
-        apontamento = form.save(commit=False)
-        apontamento.registrado_por = request.user
-        apontamento.hora_inicio = agora.time()
-        apontamento.hora_termino = None
-        apontamento.status_aprovacao = 'EM_ANALISE'
-
-        if form.cleaned_data.get('registrar_veiculo'):
-            selection = form.cleaned_data.get('veiculo_selecao')         
-            if str(selection) == 'OUTRO' or request.POST.get('veiculo_selecao') == 'OUTRO':
-                apontamento.veiculo = None
-                apontamento.veiculo_manual_modelo = form.cleaned_data.get('veiculo_manual_modelo')
-                apontamento.veiculo_manual_placa = form.cleaned_data.get('veiculo_manual_placa')
-            else:
-                if hasattr(selection, 'id'):
-                    apontamento.veiculo = selection
-                elif selection:
-                     try:
-                        apontamento.veiculo = Veiculo.objects.get(pk=selection)
-                     except (Veiculo.DoesNotExist, ValueError):
-                        apontamento.veiculo = None
-                apontamento.veiculo_manual_modelo = None
-                apontamento.veiculo_manual_placa = None
-        else:
-            apontamento.veiculo = None
-            apontamento.veiculo_manual_modelo = None
-            apontamento.veiculo_manual_placa = None
-
-        if form.cleaned_data.get('registrar_auxiliar'):
-            aux_principal = form.cleaned_data.get('auxiliar_selecao')
-            if aux_principal:
-                apontamento.auxiliar = aux_principal 
-            else:
-                 apontamento.auxiliar = None
-        else:
-            apontamento.auxiliar = None
-
-        apontamento.save()
+    if not dados.get('colaborador'):
+        dados['colaborador'] = colaborador.pk
 
-        if form.cleaned_data.get('registrar_auxiliar'):
-            ids_string = form.cleaned_data.get('auxiliares_extras_list')
-            if ids_string:
-                ids_list = [int(x) for x in ids_string.split(',') if x.strip().isdigit()]
-                apontamento.auxiliares_extras.set(ids_list)
+    agora = timezone.localtime(timezone.now())
 
-        return JsonResponse({
-            'success': True, 
-            'message': 'Atividade iniciada!', 
-            'inicio': agora.strftime('%H:%M'),
-            'id': apontamento.id
-        })
-    else:
-        print("Erro Form API Start:", form.errors)
+    # Caminho rápido: sem o __init__ completo do ApontamentoForm. A checagem de timer aberto
+    # não é feita antes do INSERT: o índice único filtrado decide, sem janela de corrida.
+    form = InicioCronometroForm(dados, identidade=request.identidade)
+    if not form.is_valid():
         primeiro_erro = list(form.errors.values())[0][0] if form.errors else "Erro desconhecido"
         return JsonResponse({'success': False, 'error': primeiro_erro})
 
+    apontamento = form.save(commit=False)
+    apontamento.registrado_por = request.user
+    apontamento.hora_inicio = agora.time()
+
+    try:
+        with transaction.atomic():
+            apontamento.save()
+            form.save_auxiliares(apontamento)
+    except IntegrityError:
+        if Apontamento.objects.filter(colaborador_id=apontamento.colaborador_id, hora_termino__isnull=True).exists():
+            return JsonResponse({'success': False, 'error': 'Você já possui uma atividade em andamento.'})
+        raise
+
+    return JsonResponse({
+        'success': True, 
+        'message': 'Atividade iniciada!', 
+        'inicio': agora.strftime('%H:%M'),
+        'id': apontamento.id
+    })
+
 def api_parar_cronometro(request):
     """
     Para o timer (Check-out)
@@ -156,7 +179,7 @@ def api_parar_cronometro(request):
         if request.user.is_superuser and target_id:
             colaborador = Colaborador.objects.get(id=target_id)
         else:
-            colaborador = Colaborador.objects.get(user_account=request.user)
+            colaborador = request.identidade.obter_colaborador()
 
     except Colaborador.DoesNotExist:
         return JsonResponse({'success': False, 'error': 'Colaborador não encontrado.'})
@@ -173,12 +196,22 @@ def api_parar_cronometro(request):
         return JsonResponse({'success': False, 'error': f'Nenhuma atividade em andamento encontrada para {nome}.'})
 
     agora = timezone.localtime(timezone.now())
-    apontamento.hora_termino = agora.time()
-    apontamento.save()
+
+    def parar(apt):
+        if apt.hora_termino is not None:
+            return None
+        apt.hora_termino = agora.time()
+        return ['hora_termino']
+
+    try:
+        apontamento = VersaoApontamentoService.transicionar(apontamento.pk, parar)
+    except ConflitoVersao:
+        return JsonResponse({'success': False, 'error': ConflitoVersao.MENSAGEM})
+    if apontamento is None:
+        return JsonResponse({'success': False, 'error': 'Esta atividade já foi finalizada.'})
 
     try:
-        dt_contabil = get_data_contabil(timezone.make_aware(datetime.combine(apontamento.data_apontamento, apontamento.hora_inicio)))
-        calcular_regras_clt(colaborador, dt_contabil)
+        calcular_regras_clt(colaborador, apontamento.data_contabil)
     except Exception as e:
         print(f"Erro ao calcular regras CLT no stop timer: {e}")
 
@@ -189,50 +222,86 @@ def api_parar_cronometro(request):
         'duracao': getattr(apontamento, 'duracao_total_str', 'Calculando...')
     })
 
+@login_required
+@user_passes_test(is_owner)
+@require_POST
+def api_encerrar_timers_lote(request):
+    """
+    Owner: encerra de uma vez os timers abertos por setor, por obra e/ou abertos há mais de X horas.
+    Sem nenhum filtro, exige todos=1 (encerra todos os timers abertos).
+    """
+    try:
+        setor_id = int(request.POST['setor_id']) if request.POST.get('setor_id') else None
+        projeto_id = int(request.POST['projeto_id']) if request.POST.get('projeto_id') else None
+        horas = EncerramentoTimersService.validar_horas(request.POST['horas']) if request.POST.get('horas') else None
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Filtros inválidos.'})
+
+    if not (setor_id or projeto_id or horas) and request.POST.get('todos') != '1':
+        return JsonResponse({'success': False, 'error': 'Informe setor, obra, horas ou confirme o encerramento de todos.'})
+
+    with transaction.atomic():
+        abertos = EncerramentoTimersService.selecionar(setor_id=setor_id, projeto_id=projeto_id, horas=horas)
+        encerrados, recalculos = EncerramentoTimersService.encerrar(abertos, request=request, origem='painel do Owner')
+
+    return JsonResponse({
+        'success': True,
+        'message': f'{encerrados} atividade(s) finalizada(s).',
+        'encerrados': encerrados,
+        'recalculos_clt': recalculos,
+    })
+
 @login_required
 def api_status_cronometro(request):
     """
-     status ao carregar a página.
+     status ao carregar a página (leitura do registro de timers abertos, sem consulta).
     """
     try:
-        colaborador = Colaborador.objects.get(user_account=request.user)
-        apontamento = Apontamento.objects.filter(
-            colaborador=colaborador,
-            hora_termino__isnull=True
-        ).order_by('-id').first()
-
-        if apontamento:
-            dt_inicio = datetime.combine(apontamento.data_apontamento, apontamento.hora_inicio)
-            dt_inicio_aware = timezone.make_aware(dt_inicio)
-
-            veiculo_id = None
-            if apontamento.veiculo:
-                veiculo_id = apontamento.veiculo.id
-            elif apontamento.veiculo_manual_modelo or apontamento.veiculo_manual_placa:
-                veiculo_id = 'OUTRO'
-            
-            return JsonResponse({
-                'ativo': True,
-                'inicio_timestamp': dt_inicio_aware.timestamp(),
-                'inicio_str': apontamento.hora_inicio.strftime('%H:%M'),
-                'data_registro': apontamento.data_apontamento.strftime('%d/%m/%Y'),
-                'colaborador_id': apontamento.colaborador.id,
-                'colaborador_nome': str(apontamento.colaborador),
-                'veiculo_id': veiculo_id,
-                'veiculo_nome': str(apontamento.veiculo) if apontamento.veiculo else 'Veículo Manual',
-                'projeto_nome': str(apontamento.projeto) if apontamento.projeto else None,
-                'projeto_id': apontamento.projeto_id,
-                'cliente_nome': str(apontamento.codigo_cliente) if apontamento.codigo_cliente else None,
-                'cliente_id': apontamento.codigo_cliente_id,
-                'cc_nome': str(apontamento.centro_custo) if apontamento.centro_custo else None,
-                'cc_id': apontamento.centro_custo_id,
-                'local': apontamento.local_execucao
-            })
+        colaborador = request.identidade.obter_colaborador()
+        timer = TimersAtivosService.do_colaborador(colaborador.pk)
+
+        if timer:
+            return JsonResponse({'ativo': True, **timer})
         
         return JsonResponse({'ativo': False})
 
     except Exception as e:
         return JsonResponse({'ativo': False, 'error': str(e)})
+
+@login_required
+@require_GET
+async def api_eventos_cronometro(request):
+    """
+    Canal SSE (text/event-stream) do cronômetro: início/parada do timer do usuário em todas
+    as abas e, com ?painel=1 para Owner/gestores, o agregado ao vivo de quem está em campo.
+    Servido pelo config/asgi.py; cada conexão só lê a versão do registro no cache.
+    """
+    user = await request.auser()
+    identidade = await sync_to_async(obter_identidade)(user)
+    painel = request.GET.get('painel') == '1' and (identidade.is_owner or bool(identidade.setores_gerenciados_ids))
+
+    resposta = StreamingHttpResponse(
+        fluxo_eventos(identidade.colaborador_id, painel=painel, escopo_ids=identidade.colaboradores_visiveis_ids),
+        content_type='text/event-stream',
+    )
+    resposta['Cache-Control'] = 'no-cache'
+    resposta['X-Accel-Buffering'] = 'no'  # Nginx: não segurar os eventos em buffer
+    return resposta
+
+@login_required
+@require_GET
+def api_timers_ativos(request):
+    """
+    Quem está com o cronômetro rodando agora: empresa inteira para o Owner,
+    setores gerenciados (+ o próprio) para os demais.
+    """
+    visiveis = request.identidade.colaboradores_visiveis_ids
+    timers = [
+        timer for colaborador_id, timer in TimersAtivosService.todos().items()
+        if visiveis is None or colaborador_id in visiveis
+    ]
+    timers.sort(key=lambda t: t['inicio_timestamp'])
+    return JsonResponse({'total': len(timers), 'timers': timers})
     
 # ==============================================================================
 # DASHBOARDS E CALENDÁRIOS
@@ -332,7 +401,7 @@ def get_calendar_status_ajax(request):
     # 2. LÓGICA PESSOAL (Colaborador)
     # ==============================================================================
     try:
-        colaborador = Colaborador.objects.get(user_account=user)
+        colaborador = request.identidade.obter_colaborador()
     except Colaborador.DoesNotExist:
         return JsonResponse({'error': 'Colaborador não encontrado'}, status=400)
 
@@ -1,48 +1,34 @@
-from .models import Colaborador, Notificacao
+from django.utils.functional import SimpleLazyObject
+from .identidade import obter_identidade
+from .services import NotificacaoService
 
 def notificacoes_globais(request):
     """
     Disponibiliza notificações.
     - Se for Colaborador: Vê os alertas recebidos.
     - Se for Owner (Superuser): Vê as RESPOSTAS dos colaboradores.
+
+    Os valores são preguiçosos: o banco/cache só é consultado se o template usar o sino.
     """
     if not request.user.is_authenticated:
         return {}
 
-    # --- LÓGICA DO OWNER (Ver Respostas) ---
-    if request.user.is_superuser:
-        respostas = Notificacao.objects.filter(
-            comentario_colaborador__isnull=False
-        ).exclude(
-            comentario_colaborador=''
-        ).select_related(
-            'colaborador').order_by('-data_criacao')[:15]
-        
-        return {
-            'notificacoes_usuario': respostas,
-            'notificacoes_nao_lidas_count': len(respostas), 
-            'is_owner_view': True
-        }
+    def carregar():
+        # --- LÓGICA DO OWNER (Ver Respostas) ---
+        if request.user.is_superuser:
+            respostas = NotificacaoService.respostas_owner()
+            return {'ultimas': respostas, 'nao_lidas': len(respostas)}
+
+        # --- LÓGICA DO COLABORADOR (Ver Alertas) ---
+        colaborador_id = obter_identidade(request.user).colaborador_id
+        if colaborador_id is None:
+            return {'ultimas': [], 'nao_lidas': 0}
+        return NotificacaoService.resumo_colaborador(colaborador_id)
 
-    # --- LÓGICA DO COLABORADOR (Ver Alertas) ---
-    try:
-        if hasattr(request.user, 'colaborador'):
-            colaborador = request.user.colaborador
-        else:
-            colaborador = Colaborador.objects.get(user_account=request.user)
-            
-        ultimas = Notificacao.objects.filter(colaborador=colaborador).order_by('-data_criacao')[:10]
-        
-        count = Notificacao.objects.filter(colaborador=colaborador, lida=False).count()
+    dados = SimpleLazyObject(carregar)
 
-        return {
-            'notificacoes_usuario': ultimas,
-            'notificacoes_nao_lidas_count': count,
-            'is_owner_view': False
-        }
-    except Colaborador.DoesNotExist:
-        return {
-            'notificacoes_usuario': [], 
-            'notificacoes_nao_lidas_count': 0,
-            'is_owner_view': False
-        }
\ No newline at end of file
+    return {
+        'notificacoes_usuario': SimpleLazyObject(lambda: dados['ultimas']),
+        'notificacoes_nao_lidas_count': SimpleLazyObject(lambda: dados['nao_lidas']),
+        'is_owner_view': request.user.is_superuser
+    }
@@ -0,0 +1,76 @@
+import asyncio
+import json
+import time
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from .services import TimersAtivosService
+
+# ==============================================================================
+# CANAL SSE DO CRONÔMETRO (servido pelo config/asgi.py)
+# ==============================================================================
+# Cada conexão observa a versão do registro de timers abertos (uma leitura de
+# cache por ciclo, nenhuma consulta ao banco) e só emite quando algo mudou:
+#   event: timer  -> estado do timer do próprio colaborador (todas as abas)
+#   event: painel -> total em campo e pessoas por obra (Owner/gestores)
+# A conexão é encerrada após DURACAO_CONEXAO; o EventSource reconecta sozinho.
+# A leitura da versão roda no pool de threads (thread_sensitive=False): cache.aget cairia na
+# thread única que atende as views síncronas, e cada aba aberta disputaria essa thread.
+
+INTERVALO_SEGUNDOS = 5
+HEARTBEAT_SEGUNDOS = 15
+DURACAO_CONEXAO = 300
+RETRY_MS = 3000
+
+
+def _versao_registro():
+    return cache.get(TimersAtivosService.CHAVE_VERSAO)
+
+
+ler_versao_registro = sync_to_async(_versao_registro, thread_sensitive=False)
+
+
+def formatar_evento(nome, dados):
+    return f"event: {nome}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+
+async def fluxo_eventos(colaborador_id, painel=False, escopo_ids=None, duracao=None):
+    """
+    Gerador assíncrono do text/event-stream. `colaborador_id`: timer acompanhado (None = nenhum).
+    `painel`: também emite o agregado, restrito a `escopo_ids` (None = empresa inteira).
+    """
+    yield f"retry: {RETRY_MS}\n\n"
+
+    limite = time.monotonic() + (duracao if duracao is not None else DURACAO_CONEXAO)
+    ultima_saida = time.monotonic()
+    versao_vista = object()
+    ultimo_timer = object()
+    ultimo_painel = None
+
+    while True:
+        versao = await ler_versao_registro()
+        if versao is None or versao != versao_vista:
+            versao_vista = versao
+            registro = await sync_to_async(TimersAtivosService.todos)()
+
+            # Sem colaborador vinculado o estado inicial ({'ativo': False}) ainda é enviado: a tela espera por ele
+            timer = registro.get(colaborador_id) if colaborador_id is not None else None
+            if timer != ultimo_timer:
+                ultimo_timer = timer
+                ultima_saida = time.monotonic()
+                yield formatar_evento('timer', {'ativo': True, **timer} if timer else {'ativo': False})
+
+            if painel:
+                agregado = TimersAtivosService.painel(registro, escopo_ids)
+                if agregado != ultimo_painel:
+                    ultimo_painel = agregado
+                    ultima_saida = time.monotonic()
+                    yield formatar_evento('painel', agregado)
+
+        agora = time.monotonic()
+        if agora >= limite:
+            return
+        if agora - ultima_saida >= HEARTBEAT_SEGUNDOS:
+            ultima_saida = agora
+            yield ": ping\n\n"
+
+        await asyncio.sleep(min(INTERVALO_SEGUNDOS, max(0, limite - agora)))
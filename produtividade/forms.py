@@ -2,9 +2,49 @@ from django import forms
 from django.core.exceptions import ValidationError
 from django.utils.safestring import mark_safe
 from django.utils import timezone
-from django.db.models import Q, F
-from datetime import datetime, timedelta, time
+from django.urls import reverse_lazy
+from datetime import datetime, timedelta
 from .models import Apontamento, Colaborador, Veiculo, Projeto, Setor, CodigoCliente, CentroCusto
+from .identidade import obter_identidade
+from .services import ConflitoHorarioService, CatalogoService
+
+
+# ==============================================================================
+# WIDGET DE SELECT COM BUSCA AJAX
+# ==============================================================================
+
+class SelectBusca(forms.Select):
+    """
+    Select2 alimentado pelo endpoint de busca (api/busca/<catalogo>/).
+    Renderiza só a opção vazia e a selecionada: o catálogo inteiro nunca vai para o HTML
+    e a validação do campo consulta apenas o id enviado.
+    """
+
+    def __init__(self, catalogo=None, attrs=None):
+        attrs = dict(attrs or {})
+        if catalogo:
+            attrs['data-url-busca'] = reverse_lazy('produtividade:buscar_catalogo', args=[catalogo])
+        super().__init__(attrs)
+
+    def optgroups(self, name, value, attrs=None):
+        escolhas = self.choices
+        if not hasattr(escolhas, 'queryset'):
+            return super().optgroups(name, value, attrs)
+
+        opcoes = [('', escolhas.field.empty_label)] if escolhas.field.empty_label is not None else []
+        selecionados = [v for v in value if v not in (None, '')]
+        if selecionados:
+            try:
+                opcoes += [escolhas.choice(obj) for obj in escolhas.queryset.filter(pk__in=selecionados)]
+            except (ValueError, TypeError, ValidationError):
+                pass
+
+        self.choices = opcoes
+        try:
+            return super().optgroups(name, value, attrs)
+        finally:
+            self.choices = escolhas
+
 
 class ApontamentoForm(forms.ModelForm):
     """
@@ -21,7 +61,7 @@ class ApontamentoForm(forms.ModelForm):
         queryset=CodigoCliente.objects.filter(ativo=True),
         required=False,
         label="Código do Cliente",
-        widget=forms.Select(attrs={'class': 'form-control'})
+        widget=SelectBusca('clientes', attrs={'class': 'form-control'})
     )
 
     cargo_colaborador = forms.CharField(
@@ -40,7 +80,7 @@ class ApontamentoForm(forms.ModelForm):
     veiculo_selecao = forms.ChoiceField(
         required=False, 
         label="Selecione o Veículo",
-        widget=forms.Select(attrs={'class': 'form-control'})
+        widget=SelectBusca('veiculos', attrs={'class': 'form-control'})
     )
     
     veiculo_manual_modelo = forms.CharField(
@@ -71,7 +111,8 @@ class ApontamentoForm(forms.ModelForm):
             cargo__in=['AUXILIAR TECNICO', 'OFICIAL DE SISTEMAS']
         ), 
         required=False, 
-        label="Auxiliar Principal"
+        label="Auxiliar Principal",
+        widget=SelectBusca()
     )
     
     auxiliares_extras_list = forms.CharField(
@@ -137,7 +178,9 @@ class ApontamentoForm(forms.ModelForm):
             'hora_termino': forms.TimeInput(attrs={'type': 'time'}),
             'ocorrencias': forms.Textarea(attrs={'rows': 3}),
             'local_execucao': forms.Select(attrs={'class': 'form-select'}),
-            'centro_custo': forms.Select(attrs={'class': 'form-select'}),
+            'colaborador': SelectBusca('colaboradores'),
+            'projeto': SelectBusca('projetos'),
+            'centro_custo': SelectBusca('centros-custo', attrs={'class': 'form-select'}),
         }
         labels = {
             'centro_custo': 'Setor / Justificativa (Custo)'
@@ -163,63 +206,43 @@ class ApontamentoForm(forms.ModelForm):
         self.fields['centro_custo'].queryset = CentroCusto.objects.filter(ativo=True)
         self.fields['codigo_cliente'].queryset = CodigoCliente.objects.filter(ativo=True)
         
-        veiculos_db = Veiculo.objects.all()
+        # Veículo: só o enviado/inicial vira opção (valida o id sem carregar a frota)
+        if self.is_bound:
+            veiculo_atual = self.data.get(self.add_prefix('veiculo_selecao'))
+        else:
+            veiculo_atual = self.initial.get('veiculo_selecao')
         choices = [('', '-- Escolha o Veículo --')]
-        choices += [(v.id, str(v)) for v in veiculos_db]
+        if veiculo_atual and str(veiculo_atual).isdigit():
+            choices += [(v.id, str(v)) for v in Veiculo.objects.filter(pk=veiculo_atual)]
         choices.append(('OUTRO', 'OUTRO (Cadastrar Novo)'))
         self.fields['veiculo_selecao'].choices = choices
 
         if self.user:
-            is_owner = self.user.is_superuser
-            groups = list(self.user.groups.values_list('name', flat=True))
-            is_gestor = 'GESTOR' in groups
-            is_admin = 'ADMINISTRATIVO' in groups
-            is_coord = 'COORDENADOR' in groups
-            
-            pode_ratear = is_owner or is_coord or is_admin
+            identidade = obter_identidade(self.user)
+            colaborador_logado = identidade.colaborador
             
-            if not pode_ratear:
+            if not identidade.pode_ratear:
                 if 'registrar_multiplas_obras' in self.fields:
                     del self.fields['registrar_multiplas_obras']
                 if 'obras_extras_list' in self.fields:
                     del self.fields['obras_extras_list']
 
-            if is_owner:
+            if identidade.is_owner:
                 self.fields['colaborador'].queryset = Colaborador.objects.all()
             
-            elif is_admin:
-                try:
-                    colaborador_logado = Colaborador.objects.get(user_account=self.user)
-                    setores_permitidos = colaborador_logado.setores_gerenciados.all()
-                    
-                    if setores_permitidos.exists():
-                        qs = Colaborador.objects.filter(setor__in=setores_permitidos)
-                        qs = qs | Colaborador.objects.filter(pk=colaborador_logado.pk)
-                        self.fields['colaborador'].queryset = qs.distinct()
-                    else:
-                        self.fields['colaborador'].queryset = Colaborador.objects.filter(pk=colaborador_logado.pk)
-                    
-                    self.initial['cargo_colaborador'] = colaborador_logado.cargo
-                except Colaborador.DoesNotExist:
-                    self.fields['colaborador'].queryset = Colaborador.objects.none()
-            
-            elif is_gestor or is_coord:
-                try:
-                    colaborador_logado = Colaborador.objects.get(user_account=self.user)
-                    self.initial['colaborador'] = colaborador_logado
-                    self.initial['cargo_colaborador'] = colaborador_logado.cargo
-                    self._lock_colaborador_field(colaborador_logado)
-                except Colaborador.DoesNotExist:
-                    self.fields['colaborador'].queryset = Colaborador.objects.none()
+            elif colaborador_logado is None:
+                self.fields['colaborador'].queryset = Colaborador.objects.none()
+
+            elif identidade.is_administrativo:
+                # Setores gerenciados + o próprio (conjunto já resolvido na identidade)
+                self.fields['colaborador'].queryset = Colaborador.objects.filter(pk__in=identidade.colaboradores_visiveis_ids)
+                self.initial['cargo_colaborador'] = colaborador_logado.cargo
             
-            else: 
-                try:
-                    colaborador_logado = Colaborador.objects.get(user_account=self.user)
-                    self.initial['colaborador'] = colaborador_logado
-                    self.initial['cargo_colaborador'] = colaborador_logado.cargo
-                    self._lock_colaborador_field(colaborador_logado)
-                except Colaborador.DoesNotExist:
-                    self.fields['colaborador'].queryset = Colaborador.objects.none()
+            else:
+                # Gestor, Coordenador e Operador: apenas o próprio colaborador
+                self.initial['colaborador'] = colaborador_logado
+                self.initial['cargo_colaborador'] = colaborador_logado.cargo
+                self._lock_colaborador_field(colaborador_logado)
 
         self.fields['colaborador'].required = True
         self.fields['hora_inicio'].required = True
@@ -262,11 +285,7 @@ class ApontamentoForm(forms.ModelForm):
 
         # --- 1. Permissões e Rateio (RBAC) ---
         if self.user:
-            is_owner = self.user.is_superuser
-            groups = list(self.user.groups.values_list('name', flat=True))
-            pode_ratear = is_owner or 'COORDENADOR' in groups or 'ADMINISTRATIVO' in groups
-            
-            if not pode_ratear:
+            if not obter_identidade(self.user).pode_ratear:
                 cleaned_data['registrar_multiplas_obras'] = False
                 cleaned_data['obras_extras_list'] = ''
         
@@ -296,46 +315,15 @@ class ApontamentoForm(forms.ModelForm):
 
         # --- 3. Detecção de Conflitos ---
         if colaborador and data_apontamento and inicio and termino:
-            
-            conflito = None
-            tipo_conflito_msg = "Conflito de horário detectado!"
-
-            base_query = Apontamento.objects.filter(colaborador=colaborador, data_apontamento=data_apontamento)
-            if self.instance and self.instance.pk:
-                base_query = base_query.exclude(pk=self.instance.pk)
-
-            is_overnight = inicio > termino
-
-            if not is_overnight:
-                colisao = base_query.filter(
-                    Q(hora_inicio__lt=termino, hora_termino__gt=inicio) | 
-                    Q(hora_inicio__gt=F('hora_termino'), hora_inicio__lt=termino)
-                )
-            else:
-                q1 = Q(hora_inicio__gte=inicio) | Q(hora_termino__gt=inicio)
-                q2 = Q(hora_inicio__lt=termino) | Q(hora_termino__gt=time(0,0), hora_termino__lt=termino)
-                colisao = base_query.filter(q1 | q2)
-
-            if colisao.exists():
-                conflito = colisao.first()
-                tipo_conflito_msg = "Conflito de horário (Mesmo dia)"
 
-            if not conflito:
-                yesterday = data_apontamento - timedelta(days=1)
-                
-                conflito_ontem = Apontamento.objects.filter(
-                    colaborador=colaborador,
-                    data_apontamento=yesterday,
-                    hora_inicio__gt=F('hora_termino'),
-                    hora_termino__gt=inicio
-                )
-                
-                if self.instance and self.instance.pk:
-                    conflito_ontem = conflito_ontem.exclude(pk=self.instance.pk)
-
-                if conflito_ontem.exists():
-                    conflito = conflito_ontem.first()
-                    tipo_conflito_msg = "Conflito Interjornada (Dia Anterior)"
+            # Uma consulta (D-1..D+1) e todos os conflitos; exibe o mais grave
+            conflitos = ConflitoHorarioService.conflitos(
+                colaborador,
+                [(data_apontamento, inicio, termino)],
+                excluir_ids=[self.instance.pk] if self.instance else [],
+            )
+            conflito = conflitos[0]['apontamento'] if conflitos else None
+            tipo_conflito_msg = ConflitoHorarioService.TITULOS[conflitos[0]['tipo']] if conflitos else ""
 
             if conflito:
                 if conflito.local_execucao == 'INT':
@@ -346,6 +334,7 @@ class ApontamentoForm(forms.ModelForm):
                 inicio_str = conflito.hora_inicio.strftime('%H:%M')
                 termino_str = conflito.hora_termino.strftime('%H:%M') if conflito.hora_termino else "..."
                 data_fmt = conflito.data_apontamento.strftime('%d/%m/%Y')
+                outros_conflitos = f'<p class="text-xs text-red-200 mb-2">+ {len(conflitos) - 1} outro(s) apontamento(s) em conflito.</p>' if len(conflitos) > 1 else ''
                 
                 icon_user = '<svg class="w-4 h-4 text-gray-400 flex-shrink-0" fill="none" viewBox="0 0 24 24" stroke="currentColor" stroke-width="2"><path d="M16 7a4 4 0 11-8 0 4 4 0 018 0zM12 14a7 7 0 00-7 7h14a7 7 0 00-7-7z" /></svg>'
                 icon_place = '<svg class="w-4 h-4 text-gray-400 flex-shrink-0" fill="none" viewBox="0 0 24 24" stroke="currentColor" stroke-width="2"><path d="M19 21V5a2 2 0 00-2-2H7a2 2 0 00-2 2v16m14 0h2m-2 0h-5m-9 0H3m2 0h5M9 7h1m-1 4h1m4-4h1m-1 4h1m-5 10v-5a1 1 0 011-1h2a1 1 0 011 1v5m-4 0h4" /></svg>'
@@ -373,11 +362,36 @@ class ApontamentoForm(forms.ModelForm):
                                 <span class="font-mono text-white font-bold bg-red-900/40 px-2 rounded border border-red-900/50">{inicio_str} - {termino_str}</span>
                             </div>
                         </div>
+                        {outros_conflitos}
                         <p class="text-xs text-red-300 italic">Ajuste os horários. Não é permitido sobrepor apontamentos.</p>
                     </div>
                 """)
                 raise ValidationError(error_message)
 
+            # --- 3.1 Participação simultânea (auxiliares em outras equipes) ---
+            pessoas_ids = {colaborador.pk}
+            if cleaned_data.get('registrar_auxiliar'):
+                if cleaned_data.get('auxiliar_selecao'):
+                    pessoas_ids.add(cleaned_data['auxiliar_selecao'].pk)
+                extras = cleaned_data.get('auxiliares_extras_list') or ''
+                pessoas_ids.update(int(x) for x in extras.split(',') if x.strip().isdigit())
+
+            ocupados = ConflitoHorarioService.conflitos_participacao(
+                data_apontamento, inicio, termino, pessoas_ids,
+                colaborador_id=colaborador.pk,
+                excluir_ids=[self.instance.pk] if self.instance else [],
+            )
+            if ocupados:
+                nomes = Colaborador.objects.in_bulk({o['pessoa_id'] for o in ocupados})
+                for o in ocupados:
+                    pessoa = nomes.get(o['pessoa_id'])
+                    self.add_error(None, (
+                        f"{pessoa.nome_completo.upper() if pessoa else 'Colaborador'} já está no apontamento #{o['apontamento_id']} "
+                        f"como {ConflitoHorarioService.PAPEIS[o['papel']].lower()} "
+                        f"({o['inicio'].strftime('%d/%m %H:%M')} - {o['fim'].strftime('%H:%M')})."
+                    ))
+                return cleaned_data
+
         # --- 4. Regras de Local e Contexto ---
         local = cleaned_data.get('local_execucao')
         projeto = cleaned_data.get('projeto')
@@ -458,4 +472,86 @@ class ApontamentoForm(forms.ModelForm):
             if not extras or len(str(extras).strip()) == 0:
                 self.add_error('registrar_multiplas_obras', "Erro de processamento: Nenhuma obra adicional foi detectada para o rateio.")
 
-        return cleaned_data
\ No newline at end of file
+        return cleaned_data
+
+# ==============================================================================
+# CHECK-IN DO CRONÔMETRO (CAMINHO RÁPIDO)
+# ==============================================================================
+
+class InicioCronometroForm(forms.ModelForm):
+    """
+    START do cronômetro: só os campos que o check-in grava, sem selects, rótulos ou
+    widgets de tela. Término e conflitos ficam para o STOP (mesmo comportamento do
+    tipo_acao START no ApontamentoForm). A unicidade do timer aberto é do banco.
+    """
+
+    registrar_veiculo = forms.BooleanField(required=False)
+    veiculo_selecao = forms.CharField(required=False)
+    registrar_auxiliar = forms.BooleanField(required=False)
+    auxiliar_selecao = forms.ModelChoiceField(
+        queryset=Colaborador.objects.filter(cargo__in=CatalogoService.CARGOS_AUXILIARES),
+        required=False
+    )
+    auxiliares_extras_list = forms.CharField(required=False)
+    data_plantao = forms.DateField(required=False, input_formats=['%d/%m/%Y', '%Y-%m-%d'])
+    data_dorme_fora = forms.DateField(required=False, input_formats=['%d/%m/%Y', '%Y-%m-%d'])
+
+    class Meta:
+        model = Apontamento
+        fields = [
+            'colaborador', 'data_apontamento', 'local_execucao',
+            'projeto', 'codigo_cliente', 'centro_custo', 'ocorrencias',
+            'veiculo_manual_modelo', 'veiculo_manual_placa',
+            'em_plantao', 'data_plantao', 'dorme_fora', 'data_dorme_fora',
+            'latitude', 'longitude'
+        ]
+
+    def __init__(self, *args, identidade, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['data_apontamento'].input_formats = ['%d/%m/%Y', '%Y-%m-%d']
+        self.fields['projeto'].queryset = Projeto.objects.filter(ativo=True)
+        self.fields['centro_custo'].queryset = CentroCusto.objects.filter(ativo=True)
+        self.fields['codigo_cliente'].queryset = CodigoCliente.objects.filter(ativo=True)
+
+        # Mesmo escopo de colaborador do ApontamentoForm, sem carregar listas
+        if identidade.is_owner:
+            self.fields['colaborador'].queryset = Colaborador.objects.all()
+        elif identidade.colaborador_id is None:
+            self.fields['colaborador'].queryset = Colaborador.objects.none()
+        elif identidade.is_administrativo:
+            self.fields['colaborador'].queryset = Colaborador.objects.filter(pk__in=identidade.colaboradores_visiveis_ids)
+        else:
+            self.fields['colaborador'].queryset = Colaborador.objects.filter(pk=identidade.colaborador_id)
+
+    def clean(self):
+        cleaned_data = super().clean()
+
+        veiculo = None
+        selecao = str(cleaned_data.get('veiculo_selecao') or '')
+        if not cleaned_data.get('registrar_veiculo') or selecao != 'OUTRO':
+            cleaned_data['veiculo_manual_modelo'] = None
+            cleaned_data['veiculo_manual_placa'] = None
+            if cleaned_data.get('registrar_veiculo') and selecao.isdigit():
+                veiculo = Veiculo.objects.filter(pk=selecao).first()
+        cleaned_data['veiculo'] = veiculo
+
+        if not cleaned_data.get('registrar_auxiliar'):
+            cleaned_data['auxiliar_selecao'] = None
+            cleaned_data['auxiliares_extras_list'] = ''
+        return cleaned_data
+
+    def save(self, commit=True):
+        apontamento = super().save(commit=False)
+        apontamento.veiculo = self.cleaned_data['veiculo']
+        apontamento.auxiliar = self.cleaned_data['auxiliar_selecao']
+        apontamento.hora_termino = None
+        apontamento.status_aprovacao = 'EM_ANALISE'
+        if commit:
+            apontamento.save()
+            self.save_auxiliares(apontamento)
+        return apontamento
+
+    def save_auxiliares(self, apontamento):
+        ids_string = self.cleaned_data.get('auxiliares_extras_list')
+        if ids_string:
+            apontamento.auxiliares_extras.set([int(x) for x in ids_string.split(',') if x.strip().isdigit()])
@@ -0,0 +1,117 @@
+from django.core.cache import cache
+from .models import Colaborador
+
+# ==============================================================================
+# IDENTIDADE DO USUÁRIO (RBAC resolvido uma vez por requisição)
+# ==============================================================================
+# Colaborador vinculado, grupos, setores gerenciados e colaboradores visíveis
+# são carregados juntos, guardados no próprio objeto `user` (que vive durante
+# a requisição) e em um cache curto compartilhado entre requisições.
+# Qualquer alteração em Colaborador, grupos ou setores incrementa a versão
+# do cache (ver signals.py), descartando todas as identidades de uma vez.
+
+TIMEOUT_CACHE_IDENTIDADE = 60
+CHAVE_VERSAO_IDENTIDADE = 'identidade_versao'
+
+
+class Identidade:
+    """Visão somente-leitura das permissões do usuário logado."""
+
+    def __init__(self, user, dados):
+        self.user = user
+        self.colaborador = dados['colaborador']
+        self.grupos = frozenset(dados['grupos'])
+        self.setores_gerenciados_ids = frozenset(dados['setores_ids'])
+        self._visiveis_ids = frozenset(dados['visiveis_ids'])
+
+    @property
+    def colaborador_id(self):
+        return self.colaborador.pk if self.colaborador else None
+
+    @property
+    def is_owner(self):
+        return bool(self.user.is_superuser)
+
+    def tem_grupo(self, nome):
+        return nome in self.grupos
+
+    @property
+    def is_gestor(self):
+        return self.tem_grupo('GESTOR')
+
+    @property
+    def is_coordenador(self):
+        return self.tem_grupo('COORDENADOR')
+
+    @property
+    def is_administrativo(self):
+        return self.tem_grupo('ADMINISTRATIVO')
+
+    @property
+    def pode_ratear(self):
+        return self.is_owner or self.is_coordenador or self.is_administrativo
+
+    @property
+    def colaboradores_visiveis_ids(self):
+        """IDs dos colaboradores dos setores gerenciados + o próprio. Owner: None (todos)."""
+        return None if self.is_owner else self._visiveis_ids
+
+    def obter_colaborador(self):
+        """Igual a Colaborador.objects.get(user_account=user): levanta DoesNotExist se não houver vínculo."""
+        if self.colaborador is None:
+            raise Colaborador.DoesNotExist("Usuário sem colaborador vinculado.")
+        return self.colaborador
+
+
+def _carregar_dados(user):
+    colaborador = Colaborador.objects.filter(user_account=user).first()
+    setores_ids = []
+    visiveis_ids = []
+
+    if colaborador:
+        setores_ids = list(colaborador.setores_gerenciados.values_list('id', flat=True))
+        visiveis_ids = [colaborador.pk]
+        if setores_ids:
+            visiveis_ids += list(Colaborador.objects.filter(setor_id__in=setores_ids).values_list('id', flat=True))
+
+    return {
+        'colaborador': colaborador,
+        'grupos': list(user.groups.values_list('name', flat=True)),
+        'setores_ids': setores_ids,
+        'visiveis_ids': visiveis_ids,
+    }
+
+
+def obter_identidade(user):
+    """
+    Retorna a Identidade do usuário, memorizada no próprio objeto `user`
+    (escopo da requisição) e no cache por TIMEOUT_CACHE_IDENTIDADE segundos.
+    """
+    identidade = getattr(user, '_identidade', None)
+    if identidade is not None:
+        return identidade
+
+    if not getattr(user, 'is_authenticated', False):
+        identidade = Identidade(user, {'colaborador': None, 'grupos': [], 'setores_ids': [], 'visiveis_ids': []})
+    else:
+        versao = cache.get_or_set(CHAVE_VERSAO_IDENTIDADE, 1, None)
+        chave = f"identidade_{user.pk}_v{versao}"
+        dados = cache.get(chave)
+        if dados is None:
+            dados = _carregar_dados(user)
+            cache.set(chave, dados, TIMEOUT_CACHE_IDENTIDADE)
+        identidade = Identidade(user, dados)
+
+    try:
+        user._identidade = identidade
+    except AttributeError:
+        pass
+    return identidade
+
+
+def invalidar_identidades():
+    """Descarta todas as identidades em cache (mudança de colaborador, grupo ou setor)."""
+    try:
+        cache.incr(CHAVE_VERSAO_IDENTIDADE)
+    except ValueError:
+        cache.set(CHAVE_VERSAO_IDENTIDADE, 1, None)
@@ -0,0 +1,143 @@
+import io
+import os
+import socket
+import threading
+import time as time_module
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, connection
+from django.db.models import F, Q
+from django.utils import timezone
+from produtividade.models import TarefaAgendada, TravaAgendador
+from produtividade.tarefas import TAREFAS_AGENDADAS, tarefa_esta_pendente
+
+NOME_TRAVA = 'agendador'
+
+
+class Command(BaseCommand):
+    help = 'Executa as rotinas periódicas (aprovação, feriados, notificações) em processo, com trava única entre servidores.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Threads simultâneas para as rotinas (padrão: 2).')
+        parser.add_argument('--intervalo', type=int, default=30, help='Segundos entre cada verificação da agenda (padrão: 30).')
+        parser.add_argument('--ttl-trava', type=int, default=120, help='Validade da trava em segundos (padrão: 120).')
+        parser.add_argument('--uma-vez', action='store_true', help='Executa as rotinas pendentes uma única vez e encerra.')
+        parser.add_argument('--forcar', nargs='*', default=None, help='Executa imediatamente as rotinas informadas (ignora a agenda).')
+
+    def handle(self, *args, **options):
+        self.dono = f"{socket.gethostname()}:{os.getpid()}"
+        self.ttl_trava = timedelta(seconds=options['ttl_trava'])
+        self.em_execucao = {}
+        self.lock = threading.Lock()
+
+        forcar = options['forcar']
+        uma_vez = options['uma_vez'] or forcar is not None
+
+        self.stdout.write(f"Agendador iniciado ({self.dono}). Rotinas: {', '.join(t['nome'] for t in TAREFAS_AGENDADAS)}")
+
+        executor = ThreadPoolExecutor(max_workers=max(1, options['workers']), thread_name_prefix='agendador')
+        try:
+            while True:
+                if self._adquirir_trava():
+                    self._disparar_pendentes(executor, forcar)
+                elif uma_vez:
+                    self.stdout.write(self.style.WARNING("Outro agendador detém a trava. Nada foi executado."))
+
+                if uma_vez:
+                    break
+                time_module.sleep(options['intervalo'])
+
+        except KeyboardInterrupt:
+            self.stdout.write("Encerrando agendador...")
+        finally:
+            executor.shutdown(wait=True)
+            self._liberar_trava()
+
+        self.stdout.write(self.style.SUCCESS("Agendador finalizado."))
+
+    # ==========================================================================
+    # TRAVA DISTRIBUÍDA (Lease em linha do banco)
+    # ==========================================================================
+
+    def _adquirir_trava(self):
+        """
+        Renova (ou toma, se expirada) a trava com um único UPDATE condicional.
+        Apenas o processo que conseguir atualizar a linha segue como agendador ativo.
+        """
+        agora = timezone.now()
+        try:
+            TravaAgendador.objects.get_or_create(nome=NOME_TRAVA, defaults={'expira_em': agora})
+        except IntegrityError:
+            pass
+
+        atualizados = TravaAgendador.objects.filter(nome=NOME_TRAVA).filter(
+            Q(dono=self.dono) | Q(expira_em__lte=agora)
+        ).update(dono=self.dono, expira_em=agora + self.ttl_trava)
+        return atualizados == 1
+
+    def _liberar_trava(self):
+        TravaAgendador.objects.filter(nome=NOME_TRAVA, dono=self.dono).update(dono='', expira_em=timezone.now())
+
+    # ==========================================================================
+    # DISPARO E EXECUÇÃO
+    # ==========================================================================
+
+    def _disparar_pendentes(self, executor, forcar=None):
+        agora = timezone.localtime(timezone.now())
+        estados = {t.nome: t for t in TarefaAgendada.objects.all()}
+
+        for tarefa in TAREFAS_AGENDADAS:
+            nome = tarefa['nome']
+            with self.lock:
+                if nome in self.em_execucao:
+                    continue
+
+            if forcar is not None:
+                if forcar and nome not in forcar:
+                    continue
+            else:
+                estado = estados.get(nome)
+                if not tarefa_esta_pendente(tarefa, estado.ultima_execucao if estado else None, agora):
+                    continue
+
+            TarefaAgendada.objects.update_or_create(
+                nome=nome,
+                defaults={'ultima_execucao': timezone.now(), 'ultimo_status': 'EXECUTANDO'}
+            )
+            with self.lock:
+                self.em_execucao[nome] = executor.submit(self._executar, tarefa)
+
+    def _executar(self, tarefa):
+        nome = tarefa['nome']
+        inicio = time_module.monotonic()
+        status = 'SUCESSO'
+
+        try:
+            if tarefa.get('comando'):
+                saida = io.StringIO()
+                call_command(tarefa['comando'], stdout=saida, stderr=saida)
+                mensagem = saida.getvalue()
+            else:
+                mensagem = tarefa['funcao']() or ''
+        except Exception as e:
+            status = 'ERRO'
+            mensagem = f"{type(e).__name__}: {e}"
+
+        duracao = time_module.monotonic() - inicio
+
+        try:
+            TarefaAgendada.objects.filter(nome=nome).update(
+                ultima_duracao_segundos=round(duracao, 3),
+                ultimo_status=status,
+                ultima_mensagem=str(mensagem)[-2000:],
+                total_execucoes=F('total_execucoes') + 1
+            )
+        finally:
+            connection.close()
+            with self.lock:
+                self.em_execucao.pop(nome, None)
+
+        estilo = self.style.SUCCESS if status == 'SUCESSO' else self.style.ERROR
+        self.stdout.write(estilo(f"[{nome}] {status} em {duracao:.2f}s"))
@@ -1,78 +1,142 @@
-import logging
+import time as time_module
 from datetime import datetime, time, timedelta
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from django.db import transaction
+from django.db.models import F
 from produtividade.models import Apontamento, LogAuditoria
+from produtividade.services import ContadoresSetorService
+
+
+def calcular_gatilho_aprovacao(data_registro_local):
+    """
+    Retorna o datetime (aware) a partir do qual um registro enviado em
+    `data_registro_local` pode ser aprovado automaticamente.
+    """
+    hora_envio = data_registro_local.time()
+    data_base = data_registro_local.date()
+
+    # --- REGRA 1: Enviados entre 06:00 e 18:00 ---
+    # Aprovam à 00:00 do dia seguinte
+    if time(6, 0) <= hora_envio <= time(18, 0):
+        return timezone.make_aware(datetime.combine(data_base + timedelta(days=1), time(0, 0)))
+
+    # --- REGRA 2: Enviados entre 18:01 e 05:59 ---
+    # Após as 18h (ex: 20h) aprova às 08h de amanhã; de madrugada (ex: 02h), às 08h de hoje
+    data_alvo = data_base + timedelta(days=1) if hora_envio > time(18, 0) else data_base
+    return timezone.make_aware(datetime.combine(data_alvo, time(8, 0)))
+
 
 class Command(BaseCommand):
     help = 'Aprova automaticamente apontamentos originais (sem edição) e sem pendências de CLT.'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Apenas lista quantos registros seriam aprovados, sem gravar nada.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Quantidade de IDs aprovados por UPDATE (padrão: 500).'
+        )
+
     def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        batch_size = max(1, options['batch_size'])
+
         self.stdout.write("Iniciando rotina de aprovação automática...")
-        
+        inicio_execucao = time_module.monotonic()
+
         # 1. Busca apenas pendentes e que ESTÃO EM CONFORMIDADE (flag_atencao=False)
-        pendentes = Apontamento.objects.filter(
-            status_aprovacao='EM_ANALISE',
-            flag_atencao=False,
-            contagem_edicao=0
-        )
+        filtro_elegiveis = {
+            'status_aprovacao': 'EM_ANALISE',
+            'flag_atencao': False,
+            'contagem_edicao': 0,
+        }
+        pendentes = Apontamento.objects.filter(**filtro_elegiveis).values_list('id', 'data_registro')
 
         agora = timezone.localtime(timezone.now())
+        total_candidatos = 0
         total_aprovados = 0
+        lote = {}
 
-        self.stdout.write(f"Encontrados {pendentes.count()} candidatos à aprovação.")
-
-        for apt in pendentes:
+        for apt_id, data_registro in pendentes.iterator(chunk_size=2000):
             # Data/Hora exata que o registro foi criado no banco
-            data_registro_local = timezone.localtime(apt.data_registro)
-            hora_envio = data_registro_local.time()
-            
-            # Data de referência para calcular o gatilho
-            data_base = data_registro_local.date()
-            
-            gatilho_aprovacao = None
-
-            # --- REGRA 1: Enviados entre 06:00 e 18:00 ---
-            # Aprovam à 00:00 do dia seguinte
-            if time(6, 0) <= hora_envio <= time(18, 0):
-                # Gatilho: Dia seguinte às 00:00
-                data_alvo = data_base + timedelta(days=1)
-                gatilho_aprovacao = timezone.make_aware(datetime.combine(data_alvo, time(0, 0)))
-
-            # --- REGRA 2: Enviados entre 18:01 e 05:59 ---
-            # Aprovam às 08:00 da manhã
-            else:
-                # Se foi enviado após as 18h (ex: 20h), aprova às 08h de amanhã
-                if hora_envio > time(18, 0):
-                    data_alvo = data_base + timedelta(days=1)
-                # Se foi enviado de madrugada (ex: 02h), aprova às 08h de hoje mesmo
-                else:
-                    data_alvo = data_base
-                
-                gatilho_aprovacao = timezone.make_aware(datetime.combine(data_alvo, time(8, 0)))
-
-            # --- VERIFICAÇÃO FINAL ---
-            if gatilho_aprovacao and agora >= gatilho_aprovacao:
-                try:
-                    with transaction.atomic():
-                        apt.status_aprovacao = 'APROVADO'
-                        apt.save()
-
-                        # Gera Log de Auditoria (Sistema)
-                        LogAuditoria.objects.create(
-                            usuario=None, # None indica Sistema
-                            acao='APROVACAO',
-                            modelo_afetado='Apontamento',
-                            objeto_id=str(apt.id),
-                            detalhes=f"Aprovação Automática (Robô). Envio: {data_registro_local.strftime('%d/%m %H:%M')} | Gatilho: {gatilho_aprovacao.strftime('%d/%m %H:%M')}",
-                            ip_address='127.0.0.1'
-                        )
-                        
-                        total_aprovados += 1
-                        self.stdout.write(self.style.SUCCESS(f"Apontamento {apt.id} aprovado."))
-                        
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f"Erro ao aprovar {apt.id}: {e}"))
-
-        self.stdout.write(self.style.SUCCESS(f"Rotina finalizada. Total aprovados: {total_aprovados}"))
\ No newline at end of file
+            data_registro_local = timezone.localtime(data_registro)
+            gatilho_aprovacao = calcular_gatilho_aprovacao(data_registro_local)
+
+            if agora < gatilho_aprovacao:
+                continue
+
+            total_candidatos += 1
+            lote[apt_id] = (data_registro_local, gatilho_aprovacao)
+
+            if len(lote) >= batch_size:
+                total_aprovados += self._processar_lote(lote, filtro_elegiveis, dry_run)
+                lote = {}
+
+        if lote:
+            total_aprovados += self._processar_lote(lote, filtro_elegiveis, dry_run)
+
+        duracao = time_module.monotonic() - inicio_execucao
+        taxa = total_aprovados / duracao if duracao > 0 else 0
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING(
+                f"[DRY-RUN] {total_candidatos} registros seriam aprovados. Nada foi gravado."
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Rotina finalizada. Candidatos: {total_candidatos} | Total aprovados: {total_aprovados} "
+                f"| Tempo: {duracao:.2f}s ({taxa:.0f} registros/s)"
+            ))
+
+    def _processar_lote(self, lote, filtro_elegiveis, dry_run):
+        """
+        Aprova um lote de IDs com um único UPDATE condicional e grava a auditoria com um único bulk_create.
+        A condição de status no WHERE garante que registros alterados por outro processo
+        (edição, aprovação manual) entre a leitura e a escrita não sejam sobrescritos.
+        """
+        if dry_run:
+            return len(lote)
+
+        try:
+            with transaction.atomic():
+                ids_confirmados = list(
+                    Apontamento.objects.select_for_update()
+                    .filter(id__in=list(lote.keys()), **filtro_elegiveis)
+                    .values_list('id', flat=True)
+                )
+                if not ids_confirmados:
+                    return 0
+
+                # update() não dispara sinais: contadores por setor ajustados pela diferença
+                with ContadoresSetorService.acompanhar(Apontamento.objects.filter(id__in=ids_confirmados)):
+                    Apontamento.objects.filter(
+                        id__in=ids_confirmados, status_aprovacao='EM_ANALISE'
+                    ).update(status_aprovacao='APROVADO', versao=F('versao') + 1)
+
+                # Gera Log de Auditoria (Sistema) - usuario None indica Sistema
+                LogAuditoria.objects.bulk_create([
+                    LogAuditoria(
+                        usuario=None,
+                        acao='APROVACAO',
+                        modelo_afetado='Apontamento',
+                        objeto_id=str(apt_id),
+                        detalhes=(
+                            f"Aprovação Automática (Robô). Envio: {lote[apt_id][0].strftime('%d/%m %H:%M')} "
+                            f"| Gatilho: {lote[apt_id][1].strftime('%d/%m %H:%M')}"
+                        ),
+                        ip_address='127.0.0.1'
+                    )
+                    for apt_id in ids_confirmados
+                ])
+
+            return len(ids_confirmados)
+
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"Erro ao aprovar lote ({len(lote)} registros): {e}"))
+            return 0
@@ -0,0 +1,137 @@
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from produtividade.models import LogAuditoria
+from produtividade.services import ArquivoAuditoriaService
+
+CAMPOS_ARQUIVO = ['id', 'usuario_id', 'usuario__username', 'acao', 'modelo_afetado', 'objeto_id', 'detalhes', 'ip_address', 'data_hora']
+
+
+class Command(BaseCommand):
+    help = 'Move os logs de auditoria mais antigos que N meses para arquivos mensais gzip JSONL e os remove do banco.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--meses', type=int, default=None, help='Meses mantidos no banco (padrão: settings.AUDITORIA_RETENCAO_MESES).')
+        parser.add_argument('--chunk', type=int, default=1000, help='Registros por DELETE / leitura (padrão: 1000).')
+        parser.add_argument('--dry-run', action='store_true', help='Apenas informa quantos registros seriam arquivados.')
+
+    def handle(self, *args, **options):
+        meses = options['meses'] if options['meses'] is not None else settings.AUDITORIA_RETENCAO_MESES
+        chunk = max(1, options['chunk'])
+
+        # Corte no 1º dia do mês (fuso local): só meses completos saem do banco
+        hoje = timezone.localdate()
+        ano, mes = divmod(hoje.year * 12 + hoje.month - 1 - max(0, meses), 12)
+        corte = timezone.make_aware(datetime(ano, mes + 1, 1))
+
+        mais_antigo = LogAuditoria.objects.filter(data_hora__lt=corte).order_by('data_hora').values_list('data_hora', flat=True).first()
+        if not mais_antigo:
+            self.stdout.write(f"Nenhum log anterior a {corte.strftime('%m/%Y')}. Nada a arquivar.")
+            return
+
+        ArquivoAuditoriaService.diretorio().mkdir(parents=True, exist_ok=True)
+        inicio_mes = timezone.localtime(mais_antigo).date().replace(day=1)
+        total_arquivado = 0
+
+        while True:
+            inicio = timezone.make_aware(datetime.combine(inicio_mes, datetime.min.time()))
+            if inicio >= corte:
+                break
+            proximo_mes = (inicio_mes + timedelta(days=32)).replace(day=1)
+            fim = timezone.make_aware(datetime.combine(proximo_mes, datetime.min.time()))
+
+            # Intervalo semiaberto [inicio, fim): usa o índice de data_hora
+            logs_mes = LogAuditoria.objects.filter(data_hora__gte=inicio, data_hora__lt=fim)
+
+            if options['dry_run']:
+                qtd = logs_mes.count()
+                if qtd:
+                    self.stdout.write(f"[DRY-RUN] {ArquivoAuditoriaService.chave_mes(inicio_mes)}: {qtd} logs seriam arquivados.")
+                total_arquivado += qtd
+            else:
+                total_arquivado += self._arquivar_mes(logs_mes, inicio_mes, chunk)
+
+            inicio_mes = proximo_mes
+
+        estilo = self.style.WARNING if options['dry_run'] else self.style.SUCCESS
+        self.stdout.write(estilo(f"Retenção concluída: {total_arquivado} logs anteriores a {corte.strftime('%m/%Y')}."))
+
+    # ==========================================================================
+    # ESCRITA DO ARQUIVO MENSAL + REMOÇÃO EM LOTES
+    # ==========================================================================
+
+    def _arquivar_mes(self, logs_mes, inicio_mes, chunk):
+        chave = ArquivoAuditoriaService.chave_mes(inicio_mes)
+        diretorio = ArquivoAuditoriaService.diretorio()
+        manifesto = ArquivoAuditoriaService.ler_manifesto()
+        partes = manifesto.get(chave, [])
+
+        # Retomada após falha: linhas já gravadas em partes anteriores só precisam ser removidas
+        if partes:
+            ja_arquivado = max(p['ultimo_id'] for p in partes)
+            self._remover_em_lotes(logs_mes.filter(id__lte=ja_arquivado), chunk)
+            logs_mes = logs_mes.filter(id__gt=ja_arquivado)
+
+        # Reexecuções no mesmo mês (ex: logs com data retroativa) geram uma nova parte
+        nome_arquivo = f"auditoria_{chave}.jsonl.gz" if not partes else f"auditoria_{chave}.parte{len(partes) + 1}.jsonl.gz"
+        temporario = diretorio / f"{nome_arquivo}.tmp"
+
+        registros = 0
+        ultimo_id = None
+        with open(temporario, 'wb') as bruto:
+            with gzip.open(bruto, 'wt', encoding='utf-8') as f:
+                for log in logs_mes.order_by('data_hora', 'id').values(*CAMPOS_ARQUIVO).iterator(chunk_size=chunk):
+                    log['usuario'] = log.pop('usuario__username')
+                    log['data_hora'] = log['data_hora'].isoformat()
+                    f.write(json.dumps(log, ensure_ascii=False) + '\n')
+                    registros += 1
+                    ultimo_id = log['id'] if ultimo_id is None else max(ultimo_id, log['id'])
+            bruto.flush()
+            os.fsync(bruto.fileno())
+
+        if not registros:
+            temporario.unlink()
+            return 0
+
+        # Confere o arquivo antes de apagar qualquer linha do banco
+        sha256 = hashlib.sha256()
+        with open(temporario, 'rb') as f:
+            for bloco in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(bloco)
+        with gzip.open(temporario, 'rt', encoding='utf-8') as f:
+            linhas_gravadas = sum(1 for _ in f)
+        if linhas_gravadas != registros:
+            temporario.unlink()
+            self.stdout.write(self.style.ERROR(f"  ✖ {chave}: arquivo inconsistente ({linhas_gravadas}/{registros}). Nada foi removido."))
+            return 0
+
+        os.replace(temporario, diretorio / nome_arquivo)
+
+        partes.append({
+            'arquivo': nome_arquivo,
+            'registros': registros,
+            'sha256': sha256.hexdigest(),
+            'ultimo_id': ultimo_id,
+            'gerado_em': timezone.now().isoformat(),
+        })
+        manifesto[chave] = partes
+        ArquivoAuditoriaService.salvar_manifesto(manifesto)
+
+        removidos = self._remover_em_lotes(logs_mes.filter(id__lte=ultimo_id), chunk)
+
+        self.stdout.write(self.style.SUCCESS(f"  ✔ {chave}: {registros} logs arquivados em {nome_arquivo} ({removidos} removidos do banco)."))
+        return registros
+
+    def _remover_em_lotes(self, queryset, chunk):
+        """DELETEs curtos (cada um em sua própria transação) para não travar a tabela."""
+        removidos = 0
+        while True:
+            ids = list(queryset.order_by('id').values_list('id', flat=True)[:chunk])
+            if not ids:
+                return removidos
+            removidos += LogAuditoria.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,206 @@
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from produtividade.models import Apontamento, InconsistenciaApontamento
+from produtividade.services import ConflitoHorarioService, TimersAtivosService, ContadoresSetorService
+from produtividade.utils import get_data_contabil, buffer_auditoria, enfileirar_log
+
+CAMPOS_VARREDURA = ['id', 'colaborador_id', 'data_apontamento', 'hora_inicio', 'hora_termino', 'inicio_em', 'fim_em', 'id_agrupamento']
+
+
+class Command(BaseCommand):
+    help = (
+        'Varre os apontamentos por colaborador em ordem de início (uma passada, tempo linear) e registra '
+        'sobreposições, lacunas na jornada, timers esquecidos abertos e rateios inconsistentes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--inicio', type=str, default=None, help='Data inicial AAAA-MM-DD (padrão: todo o histórico).')
+        parser.add_argument('--fim', type=str, default=None, help='Data final AAAA-MM-DD (padrão: hoje).')
+        parser.add_argument('--lacuna-minutos', type=int, default=180, help='Intervalo sem apontamento, no mesmo dia contábil, considerado lacuna (padrão: 180).')
+        parser.add_argument('--timer-horas', type=int, default=16, help='Horas para um timer aberto ser considerado esquecido (padrão: 16).')
+        parser.add_argument('--chunk', type=int, default=2000, help='Linhas por leitura / bulk_create (padrão: 2000).')
+        parser.add_argument('--corrigir', action='store_true', help='Encerra timers esquecidos e sinaliza sobreposições (flag de atenção).')
+        parser.add_argument('--dry-run', action='store_true', help='Apenas exibe o resumo, sem gravar achados.')
+
+    def handle(self, *args, **options):
+        try:
+            self.inicio = datetime.strptime(options['inicio'], '%Y-%m-%d').date() if options['inicio'] else None
+            self.fim = datetime.strptime(options['fim'], '%Y-%m-%d').date() if options['fim'] else timezone.localdate()
+        except ValueError:
+            raise CommandError("Datas devem estar no formato AAAA-MM-DD.")
+
+        self.chunk = max(1, options['chunk'])
+        self.lacuna = timedelta(minutes=options['lacuna_minutos'])
+        self.agora = timezone.localtime(timezone.now()).replace(tzinfo=None)
+        self.limite_timer = self.agora - timedelta(hours=options['timer_horas'])
+        self.dry_run = options['dry_run']
+        self.pendentes = []
+        self.totais = {tipo: 0 for tipo, _ in InconsistenciaApontamento.TIPO_CHOICES}
+        self.timers_abertos = []
+        self.sobrepostos = set()
+
+        if not self.dry_run:
+            anteriores = InconsistenciaApontamento.objects.filter(corrigido=False, data_referencia__lte=self.fim)
+            if self.inicio:
+                anteriores = anteriores.filter(data_referencia__gte=self.inicio)
+            anteriores.delete()
+
+        self._varrer()
+        self._gravar(forcar=True)
+
+        if options['corrigir'] and not self.dry_run:
+            self._corrigir()
+
+        self.stdout.write(f"{'TIPO':<28} {'ACHADOS':>8}")
+        for tipo, rotulo in InconsistenciaApontamento.TIPO_CHOICES:
+            self.stdout.write(f"{rotulo:<28} {self.totais[tipo]:>8}")
+        estilo = self.style.WARNING if any(self.totais.values()) else self.style.SUCCESS
+        prefixo = "[DRY-RUN] " if self.dry_run else ""
+        self.stdout.write(estilo(f"{prefixo}Auditoria concluída: {sum(self.totais.values())} inconsistências."))
+
+    # ==========================================================================
+    # VARREDURA (ORDENADA POR COLABORADOR + INÍCIO ABSOLUTO)
+    # ==========================================================================
+
+    def _varrer(self):
+        consulta = Apontamento.objects.filter(data_apontamento__lte=self.fim)
+        if self.inicio:
+            # Um dia antes para pegar turnos noturnos que invadem o período
+            consulta = consulta.filter(data_apontamento__gte=self.inicio - timedelta(days=1))
+
+        linhas = (
+            consulta.order_by('colaborador_id', 'inicio_em', 'id')
+            .values(*CAMPOS_VARREDURA)
+            .iterator(chunk_size=self.chunk)
+        )
+
+        colaborador_atual = None
+        for apt in linhas:
+            if apt['colaborador_id'] != colaborador_atual:
+                if colaborador_atual is not None:
+                    self._fechar_colaborador(colaborador_atual)
+                colaborador_atual = apt['colaborador_id']
+                self.maior_fim = None      # (fim, id, início) do intervalo que vai mais longe
+                self.grupos = {}           # id_agrupamento -> [menor início, maior fim, minutos somados, qtd, primeiro id, data]
+            self._processar(apt)
+
+        if colaborador_atual is not None:
+            self._fechar_colaborador(colaborador_atual)
+
+    def _processar(self, apt):
+        inicio, fim = ConflitoHorarioService.intervalo_gravado(apt['inicio_em'], apt['fim_em'], self.agora)
+        no_periodo = self.inicio is None or apt['data_apontamento'] >= self.inicio
+
+        if apt['hora_termino'] is None and inicio < self.limite_timer:
+            # Timer esquecido: registrado e tratado como duração zero no restante da varredura
+            fim = inicio
+            if no_periodo:
+                horas = int((self.agora - inicio).total_seconds() // 3600)
+                self._achado('TIMER_ABERTO', apt, minutos=0, detalhes=f"Timer aberto há {horas}h (início {inicio:%d/%m/%Y %H:%M}).")
+                self.timers_abertos.append(apt['id'])
+
+        if self.maior_fim is not None and no_periodo:
+            fim_anterior, id_anterior, inicio_anterior = self.maior_fim
+            if inicio < fim_anterior:
+                minutos = int((min(fim, fim_anterior) - inicio).total_seconds() // 60)
+                self._achado('SOBREPOSICAO', apt, relacionado=id_anterior, minutos=minutos,
+                             detalhes=f"Sobrepõe o apontamento #{id_anterior} em {minutos} min.")
+                self.sobrepostos.update((apt['id'], id_anterior))
+            elif inicio - fim_anterior > self.lacuna and get_data_contabil(inicio) == get_data_contabil(inicio_anterior):
+                minutos = int((inicio - fim_anterior).total_seconds() // 60)
+                self._achado('LACUNA', apt, relacionado=id_anterior, minutos=minutos,
+                             detalhes=f"{minutos} min sem apontamento desde {fim_anterior:%H:%M}.")
+
+        if self.maior_fim is None or fim > self.maior_fim[0]:
+            self.maior_fim = (fim, apt['id'], inicio)
+
+        if apt['id_agrupamento']:
+            grupo = self.grupos.get(apt['id_agrupamento'])
+            minutos = int((fim - inicio).total_seconds() // 60)
+            if grupo is None:
+                self.grupos[apt['id_agrupamento']] = [inicio, fim, minutos, 1, apt['id'], apt['data_apontamento']]
+            else:
+                grupo[0] = min(grupo[0], inicio)
+                grupo[1] = max(grupo[1], fim)
+                grupo[2] += minutos
+                grupo[3] += 1
+
+    def _fechar_colaborador(self, colaborador_id):
+        """Rateio: as fatias do grupo devem cobrir exatamente o intervalo original, sem buracos nem sobras."""
+        for uid, (inicio, fim, soma, qtd, primeiro_id, data_ref) in self.grupos.items():
+            if qtd < 2 or (self.inicio and data_ref < self.inicio):
+                continue
+            intervalo = int((fim - inicio).total_seconds() // 60)
+            if abs(intervalo - soma) > 1:
+                self._achado(
+                    'RATEIO', {'id': primeiro_id, 'colaborador_id': colaborador_id, 'data_apontamento': data_ref},
+                    minutos=abs(intervalo - soma), id_agrupamento=uid,
+                    detalhes=f"{qtd} fatias somam {soma} min, mas o grupo vai de {inicio:%d/%m %H:%M} a {fim:%d/%m %H:%M} ({intervalo} min).",
+                )
+
+    # ==========================================================================
+    # GRAVAÇÃO DOS ACHADOS E CORREÇÃO AUTOMÁTICA
+    # ==========================================================================
+
+    def _achado(self, tipo, apt, relacionado=None, minutos=0, detalhes='', id_agrupamento=None):
+        self.totais[tipo] += 1
+        if self.dry_run:
+            return
+        self.pendentes.append(InconsistenciaApontamento(
+            tipo=tipo,
+            colaborador_id=apt['colaborador_id'],
+            apontamento_id=apt['id'],
+            apontamento_relacionado_id=relacionado,
+            id_agrupamento=id_agrupamento or apt.get('id_agrupamento'),
+            data_referencia=apt['data_apontamento'],
+            minutos=minutos,
+            detalhes=detalhes,
+        ))
+        self._gravar()
+
+    def _gravar(self, forcar=False):
+        if self.pendentes and (forcar or len(self.pendentes) >= self.chunk):
+            InconsistenciaApontamento.objects.bulk_create(self.pendentes, batch_size=self.chunk)
+            self.pendentes = []
+
+    def _corrigir(self):
+        """
+        Timers esquecidos: encerrados com duração zero (nenhuma hora inventada) e sinalizados para ajuste.
+        Sobreposições: apenas sinalizadas (flag_atencao), a correção do horário é do gestor.
+        """
+        with buffer_auditoria(), transaction.atomic():
+            encerrados = 0
+            for i in range(0, len(self.timers_abertos), self.chunk):
+                lote = self.timers_abertos[i:i + self.chunk]
+                with ContadoresSetorService.acompanhar(Apontamento.objects.filter(pk__in=lote)):
+                    encerrados += Apontamento.objects.filter(pk__in=lote, hora_termino__isnull=True).update(
+                        hora_termino=F('hora_inicio'),
+                        fim_em=F('inicio_em'),
+                        versao=F('versao') + 1,
+                        flag_atencao=True,
+                        motivo_alerta="Timer esquecido aberto: encerrado com duração zero pela auditoria de consistência.",
+                    )
+                InconsistenciaApontamento.objects.filter(tipo='TIMER_ABERTO', apontamento_id__in=lote, corrigido=False).update(corrigido=True)
+                for pk in lote:
+                    enfileirar_log(usuario=None, acao='EDICAO', modelo_afetado='Apontamento', objeto_id=str(pk),
+                                   detalhes="Timer esquecido encerrado automaticamente (auditar_consistencia).")
+
+            ids_sobrepostos = list(self.sobrepostos)
+            for i in range(0, len(ids_sobrepostos), self.chunk):
+                lote = ids_sobrepostos[i:i + self.chunk]
+                with ContadoresSetorService.acompanhar(Apontamento.objects.filter(pk__in=lote)):
+                    Apontamento.objects.filter(pk__in=lote, flag_atencao=False).update(
+                        flag_atencao=True,
+                        motivo_alerta="Sobreposição de horário detectada pela auditoria de consistência.",
+                    )
+
+            if encerrados:
+                # update() não dispara sinais
+                TimersAtivosService.invalidar()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Correção: {encerrados} timers encerrados, {len(ids_sobrepostos)} apontamentos sobrepostos sinalizados."
+        ))
@@ -0,0 +1,61 @@
+import json
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from produtividade.models import Apontamento, ApontamentoHistorico
+from produtividade.services import HistoricoVersaoService
+
+
+class Command(BaseCommand):
+    help = (
+        'Converte os snapshots completos do histórico de edições (formato legado) em deltas por campo, '
+        'com os nomes das FKs gravados no próprio registro.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk', type=int, default=500, help='Apontamentos processados por transação (padrão: 500).')
+        parser.add_argument('--dry-run', action='store_true', help='Apenas calcula a economia, sem gravar.')
+
+    def handle(self, *args, **options):
+        chunk = max(1, options['chunk'])
+        dry_run = options['dry_run']
+
+        apontamento_ids = list(
+            ApontamentoHistorico.objects.filter(formato='COMPLETO')
+            .order_by('apontamento_original_id')
+            .values_list('apontamento_original_id', flat=True).distinct()
+        )
+
+        # ==========================================================================
+        # CONVERSÃO EM LOTES (um conjunto de apontamentos por transação)
+        # ==========================================================================
+        convertidos = 0
+        bytes_antes = 0
+        bytes_depois = 0
+        for i in range(0, len(apontamento_ids), chunk):
+            lote = apontamento_ids[i:i + chunk]
+            with transaction.atomic():
+                apontamentos = Apontamento.objects.in_bulk(lote)
+                historicos = list(ApontamentoHistorico.objects.filter(apontamento_original_id__in=lote))
+                tamanhos = {h.pk: len(json.dumps(h.dados_snapshot, default=str)) for h in historicos}
+
+                alterados = HistoricoVersaoService.compactar(apontamentos, historicos)
+                for historico in alterados:
+                    bytes_antes += tamanhos[historico.pk]
+                    bytes_depois += len(json.dumps(historico.dados_snapshot, default=str))
+                convertidos += len(alterados)
+
+                if not dry_run and alterados:
+                    ApontamentoHistorico.objects.bulk_update(alterados, ['dados_snapshot', 'formato'], batch_size=chunk)
+
+        # ==========================================================================
+        # RESUMO
+        # ==========================================================================
+        if not convertidos:
+            self.stdout.write(self.style.SUCCESS("Nenhum snapshot completo para compactar."))
+            return
+
+        prefixo = "[DRY-RUN] " if dry_run else ""
+        economia = 100 - (bytes_depois * 100 // bytes_antes) if bytes_antes else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefixo}{convertidos} versões convertidas em delta: {bytes_antes} -> {bytes_depois} bytes (~{economia}% menor)."
+        ))
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from produtividade.services import EncerramentoTimersService
+from produtividade.utils import buffer_auditoria
+
+
+class Command(BaseCommand):
+    help = (
+        'Encerra em lote os timers abertos (um UPDATE), filtrando por setor, obra e/ou tempo em aberto. '
+        'Recalcula as regras CLT uma vez por colaborador/dia e grava um único log de auditoria.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--setor', type=int, default=None, help='Apenas colaboradores deste setor (id).')
+        parser.add_argument('--projeto', type=int, default=None, help='Apenas timers desta obra/projeto (id).')
+        parser.add_argument('--horas', type=float, default=None, help='Apenas timers abertos há pelo menos N horas.')
+        parser.add_argument('--todos', action='store_true', help='Obrigatório quando nenhum filtro é informado.')
+        parser.add_argument('--dry-run', action='store_true', help='Apenas lista os timers que seriam encerrados.')
+
+    def handle(self, *args, **options):
+        if options['horas'] is not None:
+            try:
+                EncerramentoTimersService.validar_horas(options['horas'])
+            except ValueError:
+                raise CommandError("--horas deve ser um número positivo.")
+        if not (options['setor'] or options['projeto'] or options['horas']) and not options['todos']:
+            raise CommandError("Informe --setor, --projeto, --horas ou use --todos.")
+
+        # ==========================================================================
+        # SELEÇÃO
+        # ==========================================================================
+        abertos = EncerramentoTimersService.selecionar(
+            setor_id=options['setor'], projeto_id=options['projeto'], horas=options['horas']
+        )
+        if not abertos:
+            self.stdout.write(self.style.SUCCESS("Nenhum timer aberto atende aos filtros."))
+            return
+
+        if options['dry_run']:
+            for a in abertos:
+                self.stdout.write(f"#{a['id']} colaborador {a['colaborador_id']} desde {a['data_apontamento']:%d/%m/%Y} {a['hora_inicio']:%H:%M}")
+            self.stdout.write(self.style.WARNING(f"[DRY-RUN] {len(abertos)} timers seriam encerrados."))
+            return
+
+        # ==========================================================================
+        # ENCERRAMENTO (UPDATE ÚNICO + RECÁLCULO CLT E AUDITORIA NO COMMIT)
+        # ==========================================================================
+        with buffer_auditoria(), transaction.atomic():
+            encerrados, recalculos = EncerramentoTimersService.encerrar(abertos, origem='encerrar_timers')
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{encerrados} timers encerrados, {recalculos} recálculos CLT (colaborador/dia)."
+        ))
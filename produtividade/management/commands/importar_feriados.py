@@ -1,126 +1,197 @@
 import requests
 import os
-import unicodedata
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+from django.core.cache import cache
 from django.core.management.base import BaseCommand
-from django.db import transaction
-from produtividade.models import Feriado
+from produtividade.models import Colaborador, Feriado, Municipio
+from produtividade.utils import normalizar_texto
+from produtividade.services import FeriadoService
 
 class Command(BaseCommand):
-    help = 'Importa feriados da API externa e salva no banco'
+    help = 'Importa feriados da API externa (cidades dos colaboradores) e salva no banco'
 
-    def normalizar_texto(self, texto):
-        """
-        Remove acentos e coloca em caixa alta.
-        Ex: 'São Paulo' -> 'SAO PAULO'
-        """
-        if not texto: return ""
-        try:
-            texto_normalizado = unicodedata.normalize('NFD', texto)
-            texto_sem_acento = ''.join(c for c in texto_normalizado if unicodedata.category(c) != 'Mn')
-            return texto_sem_acento.upper()
-        except Exception:
-            return texto.upper()
-        
-
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--anos', nargs='*', type=int, help='Anos a importar (padrão: ano atual e o seguinte).')
+        parser.add_argument('--workers', type=int, default=4, help='Requisições simultâneas à API (padrão: 4).')
+        parser.add_argument('--timeout', type=int, default=10, help='Timeout por requisição em segundos.')
+        parser.add_argument('--api-url', default=None, help='URL base da API de feriados (padrão: settings.FERIADOS_API_URL).')
+        parser.add_argument('--ibge-url', default=None, help='URL base da API de localidades do IBGE (padrão: settings.IBGE_API_URL).')
+
+    def handle(self, *args, **options):
         TOKEN = os.getenv('FERIADOS_API_TOKEN')
-        HEADERS = {}
-        if TOKEN:
-            HEADERS['Authorization'] = f'Bearer {TOKEN}'
-        
+        workers = max(1, options['workers'])
+        self.timeout = options['timeout']
+        api_url = (options['api_url'] or settings.FERIADOS_API_URL).rstrip('/')
+        ibge_url = (options['ibge_url'] or settings.IBGE_API_URL).rstrip('/')
+
         ano_atual = datetime.now().year
-        ANOS = [ano_atual, ano_atual + 1]
-
-        # LISTA DE CIDADES
-        cidades_alvo = [
-            {'nome': 'Porto Seguro', 'uf': 'BA', 'ibge': '2925303'},
-            {'nome': 'Guarapari', 'uf': 'ES', 'ibge': '3202405'},
-            {'nome': 'Conceição do Mato Dentro', 'uf': 'MG', 'ibge': '3117504'},
-            {'nome': 'Congonhas', 'uf': 'MG', 'ibge': '3118007'},
-            {'nome': 'Conselheiro Lafaiete', 'uf': 'MG', 'ibge': '3118304'},
-            {'nome': 'Sete Lagoas', 'uf': 'MG', 'ibge': '3167202'},
-            {'nome': 'Duque de Caxias', 'uf': 'RJ', 'ibge': '3301702'},
-            {'nome': 'Resende', 'uf': 'RJ', 'ibge': '3304201'},
-            {'nome': 'Rio de Janeiro', 'uf': 'RJ', 'ibge': '3304557'},
-            {'nome': 'Cajamar', 'uf': 'SP', 'ibge': '3509205'},
-            {'nome': 'Campinas', 'uf': 'SP', 'ibge': '3509502'},
-            {'nome': 'Jundiaí', 'uf': 'SP', 'ibge': '3525904'},
-            {'nome': 'Piracicaba', 'uf': 'SP', 'ibge': '3538709'},
-            {'nome': 'Porto Feliz', 'uf': 'SP', 'ibge': '3540606'},
-            {'nome': 'Ribeirão Preto', 'uf': 'SP', 'ibge': '3543402'},
-            {'nome': 'São Paulo', 'uf': 'SP', 'ibge': '3550308'},
-            {'nome': 'Sorocaba', 'uf': 'SP', 'ibge': '3552205'},
-        ]
+        ANOS = options['anos'] or [ano_atual, ano_atual + 1]
+
+        # Sessão única compartilhada pelas threads (pool de conexões keep-alive)
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=2,
+            pool_maxsize=workers,
+            max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if TOKEN:
+            session.headers['Authorization'] = f'Bearer {TOKEN}'
 
         self.stdout.write("--- INICIANDO IMPORTAÇÃO ---")
 
-        for ano in ANOS:
-            self.stdout.write(f"\n> Processando ano {ano}...")
-            
-            for cidade in cidades_alvo:
-                ibge = cidade['ibge']
-                nome_cidade_banco = self.normalizar_texto(cidade['nome'])
-                uf_banco = self.normalizar_texto(cidade['uf'])
-                
-                url = f"https://www.feriadosapi.com/api/v1/feriados/cidade/{ibge}?ano={ano}"
+        cidades_alvo = self._cidades_alvo(session, ibge_url)
+        if not cidades_alvo:
+            self.stdout.write(self.style.WARNING("Nenhuma cidade com código IBGE encontrada nos cadastros de colaboradores."))
+            return
 
-                try:
-                    response = requests.get(url, headers=HEADERS, timeout=10)
-                    
-                    if response.status_code == 200:
-                        retorno_api = response.json()
-                        
-                        if isinstance(retorno_api, list):
-                            lista_feriados = retorno_api
-                        elif isinstance(retorno_api, dict):
-                            lista_feriados = retorno_api.get('feriados', [])
-                        else:
-                            self.stdout.write(self.style.WARNING(f"Formato inesperado API em {nome_cidade_banco}"))
-                            continue
-                        
-                        count_novos = 0
-                        count_atualizados = 0
-
-                        with transaction.atomic():
-                            for item in lista_feriados:
-                                raw_date = item.get('data') or item.get('date')
-                                nome_feriado = item.get('nome') or item.get('name')
-                                
-                                if not raw_date: continue
-
-                                try:
-                                    if '-' in raw_date:
-                                        data_formatada = datetime.strptime(raw_date, '%Y-%m-%d').date()
-                                    else:
-                                        data_formatada = datetime.strptime(raw_date, '%d/%m/%Y').date()
-                                except ValueError:
-                                    continue
-
-                                obj, created = Feriado.objects.update_or_create(
-                                    data=data_formatada,
-                                    cidade__iexact=nome_cidade_banco, 
-                                    uf__iexact=uf_banco,
-                                    defaults={
-                                        'cidade': nome_cidade_banco,
-                                        'uf': uf_banco,
-                                        'descricao': nome_feriado
-                                    }
-                                )
-
-                                if created:
-                                    count_novos += 1
-                                else:
-                                    count_atualizados += 1
-                        
-                        self.stdout.write(self.style.SUCCESS(
-                            f"  ✔ {nome_cidade_banco}: {count_novos} novos, {count_atualizados} atualizados."
-                        ))
+        self.stdout.write(f"> {len(cidades_alvo)} cidades x {len(ANOS)} anos ({workers} requisições simultâneas)")
+
+        # Chave (data, cidade, uf) -> descrição. Deduplica antes do upsert.
+        registros = {}
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futuros = {
+                executor.submit(self._buscar_feriados, session, api_url, cidade, ano): (cidade, ano)
+                for ano in ANOS for cidade in cidades_alvo
+            }
+
+            for futuro in as_completed(futuros):
+                cidade, ano = futuros[futuro]
+                rotulo = f"{cidade['nome']}/{cidade['uf']} ({ano})"
+                erro, lista_feriados = futuro.result()
+
+                if erro:
+                    self.stdout.write(self.style.ERROR(f"  ✖ {rotulo}: {erro}"))
+                    continue
+
+                for data_formatada, nome_feriado in lista_feriados:
+                    registros[(data_formatada, cidade['nome'], cidade['uf'])] = nome_feriado
+
+                self.stdout.write(self.style.SUCCESS(f"  ✔ {rotulo}: {len(lista_feriados)} feriados recebidos."))
+
+        session.close()
+
+        if registros:
+            Feriado.objects.bulk_create(
+                [
+                    Feriado(data=data, cidade=cidade, uf=uf, descricao=(descricao or '')[:100])
+                    for (data, cidade, uf), descricao in registros.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['data', 'cidade', 'uf'],
+                update_fields=['descricao'],
+                batch_size=500,
+            )
+
+            # bulk_create não dispara post_save: invalida o cache de consulta manualmente
+            cache.delete_many(list({
+                FeriadoService.chave_cache_municipal(data.year, cidade, uf)
+                for (data, cidade, uf) in registros
+            }))
+
+        self.stdout.write(self.style.SUCCESS(f"\n--- IMPORTAÇÃO CONCLUÍDA: {len(registros)} feriados gravados ---"))
+
+    # ==========================================================================
+    # RESOLUÇÃO DE CIDADES (Colaboradores -> Código IBGE)
+    # ==========================================================================
+
+    def _cidades_alvo(self, session, ibge_url):
+        """
+        Monta a lista de cidades a partir dos cadastros de colaboradores.
+        Códigos IBGE ausentes na tabela Municipio são buscados uma vez por UF na API do IBGE.
+        """
+        pares = set()
+        for cidade, uf in Colaborador.objects.exclude(cidade__isnull=True).exclude(cidade='').exclude(
+            uf__isnull=True
+        ).exclude(uf='').values_list('cidade', 'uf').distinct():
+            pares.add((normalizar_texto(cidade), normalizar_texto(uf)))
+
+        if not pares:
+            return []
+
+        ufs = {uf for _, uf in pares}
+        codigos = {
+            (m.nome, m.uf): m.codigo_ibge
+            for m in Municipio.objects.filter(uf__in=ufs)
+        }
+
+        faltantes = pares - set(codigos)
+        novos_municipios = []
+
+        for uf in sorted({uf for _, uf in faltantes}):
+            try:
+                response = session.get(f"{ibge_url}/localidades/estados/{uf}/municipios", timeout=self.timeout)
+                response.raise_for_status()
+                municipios_uf = {normalizar_texto(m['nome']): str(m['id']) for m in response.json()}
+            except Exception as e:
+                self.stdout.write(self.style.WARNING(f"  ! Não foi possível consultar o IBGE para {uf}: {e}"))
+                continue
+
+            for nome, uf_par in faltantes:
+                if uf_par == uf and nome in municipios_uf:
+                    codigos[(nome, uf)] = municipios_uf[nome]
+                    novos_municipios.append(Municipio(codigo_ibge=municipios_uf[nome], nome=nome, uf=uf))
+
+        if novos_municipios:
+            Municipio.objects.bulk_create(novos_municipios, ignore_conflicts=True)
+
+        for nome, uf in sorted(pares - set(codigos)):
+            self.stdout.write(self.style.WARNING(f"  ! Cidade sem código IBGE: {nome}/{uf} (verifique o cadastro)"))
+
+        return [
+            {'nome': nome, 'uf': uf, 'ibge': codigos[(nome, uf)]}
+            for nome, uf in sorted(pares) if (nome, uf) in codigos
+        ]
 
+    # ==========================================================================
+    # CONSULTA À API (Executada nas threads - sem acesso ao banco)
+    # ==========================================================================
+
+    def _buscar_feriados(self, session, api_url, cidade, ano):
+        """Retorna (erro, [(data, nome)]) para uma cidade/ano."""
+        url = f"{api_url}/feriados/cidade/{cidade['ibge']}?ano={ano}"
+
+        try:
+            response = session.get(url, timeout=self.timeout)
+        except Exception as e:
+            return f"Falha de conexão: {e}", []
+
+        if response.status_code != 200:
+            return f"Erro {response.status_code}", []
+
+        # Corpo não-JSON (página de erro, resposta truncada) ou itens fora do formato: falha só desta cidade
+        try:
+            retorno_api = response.json()
+            if isinstance(retorno_api, list):
+                lista_api = retorno_api
+            elif isinstance(retorno_api, dict):
+                lista_api = retorno_api.get('feriados', [])
+            else:
+                return "Formato inesperado da API", []
+
+            feriados = []
+            for item in lista_api:
+                raw_date = item.get('data') or item.get('date')
+                nome_feriado = item.get('nome') or item.get('name')
+
+                if not raw_date: continue
+
+                try:
+                    if '-' in raw_date:
+                        data_formatada = datetime.strptime(raw_date, '%Y-%m-%d').date()
                     else:
-                        self.stdout.write(self.style.ERROR(f"  ✖ Erro {response.status_code} em {nome_cidade_banco}"))
-                
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f"  ✖ Falha de conexão em {nome_cidade_banco}: {str(e)}"))
+                        data_formatada = datetime.strptime(raw_date, '%d/%m/%Y').date()
+                except ValueError:
+                    continue
+
+                feriados.append((data_formatada, nome_feriado))
+        except (ValueError, AttributeError, TypeError) as e:
+            return f"Resposta inválida: {e}", []
 
-        self.stdout.write(self.style.SUCCESS("\n--- IMPORTAÇÃO CONCLUÍDA ---"))
\ No newline at end of file
+        return None, feriados
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from produtividade.models import Setor
+from produtividade.services import ContadoresSetorService
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula os contadores de pendências por setor (aprovação, ajustes e alertas CLT) '
+        'a partir dos apontamentos e corrige os que divergirem.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Apenas lista as divergências, sem corrigir.')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+
+        with transaction.atomic():
+            divergentes = ContadoresSetorService.reconciliar(corrigir=not dry_run)
+
+        if not divergentes:
+            self.stdout.write(self.style.SUCCESS("Contadores consistentes."))
+            return
+
+        nomes = dict(Setor.objects.filter(pk__in=[s for s in divergentes if s]).values_list('pk', 'nome'))
+        campos = ContadoresSetorService.CAMPOS
+        for setor_id, (gravado, real) in divergentes.items():
+            gravado = gravado or [0] * len(campos)
+            diferencas = ", ".join(f"{c}: {g} -> {r}" for c, g, r in zip(campos, gravado, real) if g != r)
+            self.stdout.write(f"{nomes.get(setor_id, 'Sem setor')}: {diferencas}")
+
+        prefixo = "[DRY-RUN] " if dry_run else ""
+        self.stdout.write(self.style.WARNING(f"{prefixo}{len(divergentes)} setor(es) divergente(s){'' if dry_run else ' corrigido(s)'}."))
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from produtividade.models import Colaborador
+from produtividade.services import ConflitoHorarioService
+
+
+class Command(BaseCommand):
+    help = 'Lista pessoas escaladas em dois apontamentos ao mesmo tempo (colaborador, auxiliar ou auxiliar extra).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--inicio', type=str, default=None, help='Data inicial AAAA-MM-DD (padrão: 30 dias atrás).')
+        parser.add_argument('--fim', type=str, default=None, help='Data final AAAA-MM-DD (padrão: hoje).')
+        parser.add_argument('--colaborador', type=int, action='append', default=None, help='Restringe a um colaborador (id). Pode repetir.')
+
+    def handle(self, *args, **options):
+        try:
+            fim = datetime.strptime(options['fim'], '%Y-%m-%d').date() if options['fim'] else timezone.localdate()
+            inicio = datetime.strptime(options['inicio'], '%Y-%m-%d').date() if options['inicio'] else fim - timedelta(days=30)
+        except ValueError:
+            raise CommandError("Datas devem estar no formato AAAA-MM-DD.")
+        if inicio > fim:
+            raise CommandError("--inicio deve ser anterior ou igual a --fim.")
+
+        # Um dia de margem para turnos noturnos que começam antes do período
+        indice = ConflitoHorarioService.participacoes(inicio - timedelta(days=1), fim, pessoas_ids=options['colaborador'])
+        sobreposicoes = [
+            s for s in ConflitoHorarioService.varrer_sobreposicoes(indice)
+            if s['segundo'][0].date() >= inicio or s['primeiro'][0].date() >= inicio
+        ]
+
+        if not sobreposicoes:
+            self.stdout.write(self.style.SUCCESS(f"Nenhuma sobreposição entre {inicio:%d/%m/%Y} e {fim:%d/%m/%Y}."))
+            return
+
+        nomes = dict(Colaborador.objects.filter(pk__in={s['pessoa_id'] for s in sobreposicoes}).values_list('id', 'nome_completo'))
+        sobreposicoes.sort(key=lambda s: (nomes.get(s['pessoa_id'], ''), s['segundo'][0]))
+
+        self.stdout.write(f"{'COLABORADOR':<30} {'APONTAMENTO A':<34} {'APONTAMENTO B':<34} {'MIN':>5}")
+        total_minutos = 0
+        for s in sobreposicoes:
+            total_minutos += s['minutos']
+            self.stdout.write(
+                f"{nomes.get(s['pessoa_id'], s['pessoa_id'])!s:<30.30} "
+                f"{self._descrever(s['primeiro']):<34} {self._descrever(s['segundo']):<34} {s['minutos']:>5}"
+            )
+
+        self.stdout.write(self.style.WARNING(
+            f"{len(sobreposicoes)} sobreposições ({total_minutos} min contados em dobro) entre {inicio:%d/%m/%Y} e {fim:%d/%m/%Y}."
+        ))
+
+    def _descrever(self, participacao):
+        inicio, fim, apontamento_id, papel = participacao
+        return f"#{apontamento_id} {papel[:3]} {inicio:%d/%m %H:%M}-{fim:%H:%M}"
@@ -0,0 +1,38 @@
+from django.utils.functional import SimpleLazyObject
+from .identidade import obter_identidade
+from .utils import buffer_auditoria
+
+# ==============================================================================
+# AUDITORIA EM LOTE (1 INSERT por requisição)
+# ==============================================================================
+
+class AuditoriaMiddleware:
+    """
+    Abre um buffer de auditoria por requisição. Todos os logs gerados pela view,
+    pelos sinais de login/logout e pelos serviços são gravados juntos ao final.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with buffer_auditoria():
+            return self.get_response(request)
+
+
+# ==============================================================================
+# IDENTIDADE DA REQUISIÇÃO (request.identidade)
+# ==============================================================================
+
+class IdentidadeMiddleware:
+    """
+    Expõe `request.identidade` (colaborador, grupos, setores e colaboradores visíveis).
+    Preguiçoso: só consulta banco/cache se a view usar. Deve vir após o AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.identidade = SimpleLazyObject(lambda: obter_identidade(request.user))
+        return self.get_response(request)
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Alinha o estado das migrações com o que models.py já declarava antes do agendador:
+    # índice em LogAuditoria.acao e índices de Apontamento (colaborador/data, data, status)
+
+    dependencies = [
+        ('produtividade', '0027_alter_apontamento_hora_termino'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='logauditoria',
+            name='acao',
+            field=models.CharField(choices=[('LOGIN', 'Login / Acesso'), ('LOGOUT', 'Logout / Saída'), ('LOGIN_FALHA', 'Falha de Login'), ('CRIACAO', 'Criação de Registro'), ('EDICAO', 'Edição de Registro'), ('EXCLUSAO', 'Exclusão de Registro'), ('APROVACAO', 'Aprovação de Apontamento'), ('REJEICAO', 'Rejeição de Apontamento'), ('SOLICITACAO', 'Solicitação de Ajuste'), ('APROVACAO_AJUSTE', 'Aprovação de Ajuste'), ('EXPORTACAO', 'Exportação de Dados')], db_index=True, max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='apontamento',
+            index=models.Index(fields=['colaborador', 'data_apontamento'], name='produtivida_colabor_d2acc9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='apontamento',
+            index=models.Index(fields=['data_apontamento'], name='produtivida_data_ap_6e061f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='apontamento',
+            index=models.Index(fields=['status_aprovacao'], name='produtivida_status__2920e3_idx'),
+        ),
+    ]
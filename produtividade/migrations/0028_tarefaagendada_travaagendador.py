@@ -0,0 +1,45 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produtividade', '0027_sincroniza_indices_baseline'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TarefaAgendada',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=100, unique=True, verbose_name='Rotina')),
+                ('ultima_execucao', models.DateTimeField(blank=True, null=True, verbose_name='Última Execução')),
+                ('ultima_duracao_segundos', models.FloatField(blank=True, null=True, verbose_name='Duração (s)')),
+                ('ultimo_status', models.CharField(blank=True, choices=[('EXECUTANDO', 'Em Execução'), ('SUCESSO', 'Sucesso'), ('ERRO', 'Erro')], max_length=20, null=True, verbose_name='Resultado')),
+                ('ultima_mensagem', models.TextField(blank=True, null=True, verbose_name='Saída / Erro')),
+                ('total_execucoes', models.IntegerField(default=0, verbose_name='Qtd. Execuções')),
+            ],
+            options={
+                'verbose_name': 'Rotina Agendada',
+                'verbose_name_plural': 'Rotinas Agendadas',
+                'ordering': ['nome'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TravaAgendador',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=50, unique=True)),
+                ('dono', models.CharField(blank=True, default='', max_length=255, verbose_name='Processo Detentor')),
+                ('expira_em', models.DateTimeField(verbose_name='Expira Em')),
+            ],
+            options={
+                'verbose_name': 'Trava do Agendador',
+                'verbose_name_plural': 'Travas do Agendador',
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:17
+
+from django.db import migrations, models
+
+# Cidades que eram fixas no importador de feriados (nomes já normalizados)
+MUNICIPIOS_INICIAIS = [
+    ('2925303', 'PORTO SEGURO', 'BA'),
+    ('3202405', 'GUARAPARI', 'ES'),
+    ('3117504', 'CONCEICAO DO MATO DENTRO', 'MG'),
+    ('3118007', 'CONGONHAS', 'MG'),
+    ('3118304', 'CONSELHEIRO LAFAIETE', 'MG'),
+    ('3167202', 'SETE LAGOAS', 'MG'),
+    ('3301702', 'DUQUE DE CAXIAS', 'RJ'),
+    ('3304201', 'RESENDE', 'RJ'),
+    ('3304557', 'RIO DE JANEIRO', 'RJ'),
+    ('3509205', 'CAJAMAR', 'SP'),
+    ('3509502', 'CAMPINAS', 'SP'),
+    ('3525904', 'JUNDIAI', 'SP'),
+    ('3538709', 'PIRACICABA', 'SP'),
+    ('3540606', 'PORTO FELIZ', 'SP'),
+    ('3543402', 'RIBEIRAO PRETO', 'SP'),
+    ('3550308', 'SAO PAULO', 'SP'),
+    ('3552205', 'SOROCABA', 'SP'),
+]
+
+
+def popular_municipios(apps, schema_editor):
+    Municipio = apps.get_model('produtividade', 'Municipio')
+    Municipio.objects.bulk_create(
+        [Municipio(codigo_ibge=codigo, nome=nome, uf=uf) for codigo, nome, uf in MUNICIPIOS_INICIAIS],
+        ignore_conflicts=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produtividade', '0028_tarefaagendada_travaagendador'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Municipio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('codigo_ibge', models.CharField(max_length=7, unique=True, verbose_name='Código IBGE')),
+                ('nome', models.CharField(max_length=100, verbose_name='Município (Normalizado)')),
+                ('uf', models.CharField(max_length=2)),
+            ],
+            options={
+                'verbose_name': 'Município (IBGE)',
+                'verbose_name_plural': 'Municípios (IBGE)',
+                'ordering': ['uf', 'nome'],
+                'unique_together': {('nome', 'uf')},
+            },
+        ),
+        migrations.RunPython(popular_municipios, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produtividade', '0029_municipio'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='logauditoria',
+            index=models.Index(fields=['usuario', 'acao', 'data_hora', 'id'], name='log_usuario_acao_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='logauditoria',
+            index=models.Index(fields=['usuario', 'data_hora', 'id'], name='log_usuario_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='logauditoria',
+            index=models.Index(fields=['acao', 'data_hora', 'id'], name='log_acao_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='logauditoria',
+            index=models.Index(fields=['data_hora', 'id'], name='log_data_id_idx'),
+        ),
+    ]
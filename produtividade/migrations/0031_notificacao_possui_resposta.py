@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:25
+
+from django.db import migrations, models
+
+
+def preencher_possui_resposta(apps, schema_editor):
+    Notificacao = apps.get_model('produtividade', 'Notificacao')
+    Notificacao.objects.filter(comentario_colaborador__isnull=False).exclude(
+        comentario_colaborador=''
+    ).update(possui_resposta=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produtividade', '0030_logauditoria_indices_trilha'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificacao',
+            name='possui_resposta',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(preencher_possui_resposta, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='notificacao',
+            index=models.Index(fields=['possui_resposta', '-data_criacao'], name='notif_respostas_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notificacao',
+            index=models.Index(fields=['colaborador', '-data_criacao'], name='notif_colab_data_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produtividade', '0031_notificacao_possui_resposta'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='codigocliente',
+            index=models.Index(fields=['nome'], name='cliente_nome_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='colaborador',
+            index=models.Index(fields=['nome_completo'], name='colab_nome_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='projeto',
+            index=models.Index(fields=['nome'], name='projeto_nome_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='veiculo',
+            index=models.Index(fields=['descricao'], name='veiculo_descricao_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produtividade', '0032_indices_autocomplete_catalogos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InconsistenciaApontamento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('SOBREPOSICAO', 'Sobreposição de Horário'), ('LACUNA', 'Lacuna na Jornada'), ('TIMER_ABERTO', 'Timer Esquecido Aberto'), ('RATEIO', 'Rateio Inconsistente')], max_length=20)),
+                ('id_agrupamento', models.CharField(blank=True, max_length=100, null=True, verbose_name='ID de Agrupamento (Rateio)')),
+                ('data_referencia', models.DateField(verbose_name='Data')),
+                ('minutos', models.IntegerField(default=0, verbose_name='Minutos Afetados')),
+                ('detalhes', models.TextField(blank=True, default='')),
+                ('corrigido', models.BooleanField(default=False, verbose_name='Corrigido Automaticamente')),
+                ('detectado_em', models.DateTimeField(auto_now_add=True)),
+                ('apontamento', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='inconsistencias', to='produtividade.apontamento')),
+                ('apontamento_relacionado', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='produtividade.apontamento', verbose_name='Apontamento Relacionado')),
+                ('colaborador', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inconsistencias', to='produtividade.colaborador')),
+            ],
+            options={
+                'verbose_name': 'Inconsistência de Apontamento',
+                'verbose_name_plural': 'Inconsistências de Apontamentos',
+                'ordering': ['-data_referencia', 'colaborador'],
+                'indexes': [models.Index(fields=['tipo', 'data_referencia'], name='inconsist_tipo_data_idx'), models.Index(fields=['corrigido', 'data_referencia'], name='inconsist_corrigido_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produtividade', '0033_inconsistencia_apontamento'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apontamentohistorico',
+            name='formato',
+            field=models.CharField(choices=[('COMPLETO', 'Snapshot Completo'), ('DELTA', 'Delta por Campo')], default='COMPLETO', max_length=10, verbose_name='Formato do Registro'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:45
+
+from django.db import migrations, models
+from django.db.models import Count, F, Max
+
+
+def encerrar_timers_duplicados(apps, schema_editor):
+    """Antes do índice único: mantém só o timer aberto mais recente de cada colaborador."""
+    Apontamento = apps.get_model('produtividade', 'Apontamento')
+    abertos = Apontamento.objects.filter(hora_termino__isnull=True)
+    duplicados = (
+        abertos.values('colaborador_id').annotate(qtd=Count('id'), ultimo=Max('id')).filter(qtd__gt=1)
+    )
+    for grupo in duplicados:
+        abertos.filter(colaborador_id=grupo['colaborador_id']).exclude(pk=grupo['ultimo']).update(
+            hora_termino=F('hora_inicio'),
+            flag_atencao=True,
+            motivo_alerta="Timer duplicado encerrado com duração zero na criação do índice de timer único.",
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produtividade', '0034_historico_delta'),
+    ]
+
+    operations = [
+        migrations.RunPython(encerrar_timers_duplicados, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='apontamento',
+            constraint=models.UniqueConstraint(condition=models.Q(('hora_termino__isnull', True)), fields=('colaborador',), name='apontamento_timer_aberto_unico', violation_error_message='Você já possui uma atividade em andamento.'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:54
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produtividade', '0035_timer_aberto_unico'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='apontamento',
+            index=models.Index(fields=['status_aprovacao', '-data_apontamento', '-id'], name='apont_fila_aprov_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produtividade', '0036_fila_aprovacao_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apontamento',
+            name='versao',
+            field=models.PositiveIntegerField(default=1, editable=False, verbose_name='Versão do Registro'),
+        ),
+    ]
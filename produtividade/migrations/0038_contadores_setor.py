@@ -0,0 +1,54 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def popular_contadores(apps, schema_editor):
+    """Carga inicial: uma linha por setor (e a de sem setor), preenchida com uma agregação."""
+    Apontamento = apps.get_model('produtividade', 'Apontamento')
+    ContadorSetor = apps.get_model('produtividade', 'ContadorSetor')
+    Setor = apps.get_model('produtividade', 'Setor')
+    totais = {
+        t['colaborador__setor_id']: t
+        for t in Apontamento.objects.order_by().values('colaborador__setor_id').annotate(
+            pendentes=Count('id', filter=Q(status_aprovacao='EM_ANALISE')),
+            ajustes=Count('id', filter=Q(status_ajuste='PENDENTE')),
+            alertas=Count('id', filter=Q(flag_atencao=True)),
+        )
+    }
+    vazio = {'pendentes': 0, 'ajustes': 0, 'alertas': 0}
+    ContadorSetor.objects.bulk_create([
+        ContadorSetor(
+            setor_id=setor_id, pendentes=totais.get(setor_id, vazio)['pendentes'],
+            ajustes_pendentes=totais.get(setor_id, vazio)['ajustes'], alertas_clt=totais.get(setor_id, vazio)['alertas'],
+        )
+        for setor_id in [None, *Setor.objects.values_list('id', flat=True)]
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produtividade', '0037_apontamento_versao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorSetor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pendentes', models.IntegerField(default=0, verbose_name='Aguardando Aprovação')),
+                ('ajustes_pendentes', models.IntegerField(default=0, verbose_name='Solicitações de Ajuste')),
+                ('alertas_clt', models.IntegerField(default=0, verbose_name='Alertas CLT')),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+                ('setor', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='contador', to='produtividade.setor', verbose_name='Setor')),
+            ],
+            options={
+                'verbose_name': 'Contador do Setor',
+                'verbose_name_plural': 'Contadores dos Setores',
+            },
+        ),
+        migrations.RunPython(popular_contadores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produtividade', '0038_contadores_setor'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apontamento',
+            name='data_contabil',
+            field=models.DateField(blank=True, editable=False, null=True, verbose_name='Dia Contábil'),
+        ),
+        migrations.AddField(
+            model_name='apontamento',
+            name='fim_em',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Término (Data/Hora)'),
+        ),
+        migrations.AddField(
+            model_name='apontamento',
+            name='inicio_em',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Início (Data/Hora)'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.8 on 2026-10-19 12:10
+
+from datetime import datetime, timedelta
+
+from django.db import migrations, models, transaction
+from django.utils import timezone
+
+LOTE = 2000
+
+
+def preencher_instantes(apps, schema_editor):
+    """
+    Backfill de inicio_em / fim_em / data_contabil em lotes por faixa de id,
+    cada lote na sua própria transação (tabelas grandes não seguram um lock único).
+    Mesma regra de Apontamento.calcular_instantes.
+    """
+    Apontamento = apps.get_model('produtividade', 'Apontamento')
+    ultimo_id = 0
+    while True:
+        lote = list(
+            Apontamento.objects.filter(pk__gt=ultimo_id, inicio_em__isnull=True)
+            .order_by('pk').only('id', 'data_apontamento', 'hora_inicio', 'hora_termino')[:LOTE]
+        )
+        if not lote:
+            break
+        for apt in lote:
+            inicio = datetime.combine(apt.data_apontamento, apt.hora_inicio)
+            fim = None
+            if apt.hora_termino is not None:
+                fim = datetime.combine(apt.data_apontamento, apt.hora_termino)
+                if fim < inicio:
+                    fim += timedelta(days=1)
+                fim = timezone.make_aware(fim)
+            apt.inicio_em = timezone.make_aware(inicio)
+            apt.fim_em = fim
+            apt.data_contabil = apt.data_apontamento - timedelta(days=1) if apt.hora_inicio.hour < 6 else apt.data_apontamento
+        with transaction.atomic():
+            Apontamento.objects.bulk_update(lote, ['inicio_em', 'fim_em', 'data_contabil'])
+        ultimo_id = lote[-1].pk
+
+
+class Migration(migrations.Migration):
+    # Backfill em lotes com commit por lote; os índices são criados depois, sobre os dados já preenchidos
+    atomic = False
+
+    dependencies = [
+        ('produtividade', '0039_instantes_absolutos'),
+    ]
+
+    operations = [
+        migrations.RunPython(preencher_instantes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='apontamento',
+            index=models.Index(fields=['colaborador', 'inicio_em'], name='apont_colab_inicio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='apontamento',
+            index=models.Index(fields=['colaborador', 'data_contabil'], name='apont_colab_contabil_idx'),
+        ),
+    ]
@@ -77,6 +77,10 @@ class Projeto(models.Model):
         verbose_name = "Projeto/Obra"
         verbose_name_plural = "Projetos/Obras"
         ordering = ['codigo']
+        indexes = [
+            # Autocomplete por prefixo (codigo já é unique/indexado)
+            models.Index(fields=['nome'], name='projeto_nome_idx'),
+        ]
 
     def __str__(self):
         return f"{self.codigo} - {self.nome}"
@@ -105,6 +109,9 @@ class CodigoCliente(models.Model):
         verbose_name = "Código do Cliente"
         verbose_name_plural = "Códigos de Cliente"
         ordering = ['codigo']
+        indexes = [
+            models.Index(fields=['nome'], name='cliente_nome_idx'),
+        ]
 
     def __str__(self):
         return f"{self.codigo} - {self.nome}"
@@ -159,6 +166,9 @@ class Colaborador(models.Model):
         verbose_name = "Colaborador"
         verbose_name_plural = "Colaboradores"
         ordering = ['nome_completo']
+        indexes = [
+            models.Index(fields=['nome_completo'], name='colab_nome_idx'),
+        ]
 
     def __str__(self):
         return f"{self.nome_completo}"
@@ -183,6 +193,9 @@ class Veiculo(models.Model):
     class Meta:
         verbose_name = "Veículo"
         verbose_name_plural = "Veículos"
+        indexes = [
+            models.Index(fields=['descricao'], name='veiculo_descricao_idx'),
+        ]
 
     def __str__(self):
         if self.descricao:
@@ -204,6 +217,24 @@ class Feriado(models.Model):
     def __str__(self):
         return f"{self.descricao} ({self.cidade}/{self.uf})"
 
+class Municipio(models.Model):
+    """
+    Tabela de consulta do código IBGE por cidade/UF (usada na importação de feriados).
+    O nome é armazenado normalizado (sem acentos, caixa alta).
+    """
+    codigo_ibge = models.CharField(max_length=7, unique=True, verbose_name="Código IBGE")
+    nome = models.CharField(max_length=100, verbose_name="Município (Normalizado)")
+    uf = models.CharField(max_length=2)
+
+    class Meta:
+        verbose_name = "Município (IBGE)"
+        verbose_name_plural = "Municípios (IBGE)"
+        unique_together = ('nome', 'uf')
+        ordering = ['uf', 'nome']
+
+    def __str__(self):
+        return f"{self.nome}/{self.uf} ({self.codigo_ibge})"
+
 # ==============================================================================
 # TABELA PRINCIPAL (CORE)
 # ==============================================================================
@@ -370,6 +401,19 @@ class Apontamento(models.Model):
         verbose_name="Motivo da Rejeição (Gerente)"
     )
 
+    # --- 8b. Instantes absolutos (derivados de data + horários, sincronizados no save) ---
+    # Permitem consultas de intervalo/janela por faixa indexada, sem remontar datetimes em Python
+    inicio_em = models.DateTimeField(null=True, blank=True, editable=False, verbose_name="Início (Data/Hora)")
+    fim_em = models.DateTimeField(null=True, blank=True, editable=False, verbose_name="Término (Data/Hora)")
+    data_contabil = models.DateField(null=True, blank=True, editable=False, verbose_name="Dia Contábil")
+
+    # Controle de concorrência otimista: incrementada a cada gravação (save, CAS e UPDATEs em lote)
+    versao = models.PositiveIntegerField(
+        default=1,
+        editable=False,
+        verbose_name="Versão do Registro"
+    )
+
     # --- 8. Geolocalização ---
     latitude = models.DecimalField(
         max_digits=12,
@@ -397,6 +441,44 @@ class Apontamento(models.Model):
         verbose_name="Motivo do Alerta"
     )
 
+    CAMPOS_HORARIO = ('data_apontamento', 'hora_inicio', 'hora_termino')
+    CAMPOS_INSTANTES = ('inicio_em', 'fim_em', 'data_contabil')
+
+    @staticmethod
+    def calcular_instantes(data_ref, hora_inicio, hora_termino):
+        """
+        (inicio_em, fim_em, data_contabil) a partir de data + horários locais.
+        Término menor que o início atravessa a meia-noite; timer aberto não tem fim.
+        O dia contábil começa às 06:00 (mesma regra de utils.get_data_contabil).
+        """
+        inicio = datetime.combine(data_ref, hora_inicio)
+        fim = None
+        if hora_termino is not None:
+            fim = datetime.combine(data_ref, hora_termino)
+            if fim < inicio:
+                fim += timedelta(days=1)
+            fim = timezone.make_aware(fim)
+        data_contabil = data_ref - timedelta(days=1) if hora_inicio.hour < 6 else data_ref
+        return timezone.make_aware(inicio), fim, data_contabil
+
+    def sincronizar_instantes(self):
+        self.inicio_em, self.fim_em, self.data_contabil = Apontamento.calcular_instantes(
+            self.data_apontamento, self.hora_inicio, self.hora_termino
+        )
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or set(Apontamento.CAMPOS_HORARIO) & set(update_fields):
+            self.sincronizar_instantes()
+            if update_fields is not None:
+                update_fields = kwargs['update_fields'] = {*update_fields, *Apontamento.CAMPOS_INSTANTES}
+        # Gravação completa também gera nova versão: quem ainda tem a versão antiga recebe conflito
+        if not self._state.adding:
+            self.versao += 1
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'versao'}
+        super().save(*args, **kwargs)
+
     @property
     def duracao_total_str(self):
         """Calcula a duração formatada HH:MM considerando virada de dia"""
@@ -424,6 +506,21 @@ class Apontamento(models.Model):
             models.Index(fields=['colaborador', 'data_apontamento']),
             models.Index(fields=['data_apontamento']),
             models.Index(fields=['status_aprovacao']),
+            # Fila de aprovação: filtro por status + paginação por cursor (data, id) sem ordenação em memória
+            models.Index(fields=['status_aprovacao', '-data_apontamento', '-id'], name='apont_fila_aprov_idx'),
+            # Conflitos/interjornada por faixa de instantes e janelas CLT por dia contábil
+            models.Index(fields=['colaborador', 'inicio_em'], name='apont_colab_inicio_idx'),
+            models.Index(fields=['colaborador', 'data_contabil'], name='apont_colab_contabil_idx'),
+        ]
+        constraints = [
+            # Índice único filtrado (SQLite/PostgreSQL: partial index; SQL Server: filtered index):
+            # no máximo um timer aberto por colaborador, garantido pelo banco mesmo com requisições simultâneas
+            models.UniqueConstraint(
+                fields=['colaborador'],
+                condition=models.Q(hora_termino__isnull=True),
+                name='apontamento_timer_aberto_unico',
+                violation_error_message='Você já possui uma atividade em andamento.',
+            ),
         ]
 
     def __str__(self):
@@ -438,7 +535,17 @@ class ApontamentoHistorico(models.Model):
     """
     Armazena o estado anterior de um apontamento antes de ser editado.
     Permite que o Gerente compare a versão original com a editada.
+
+    Formato DELTA: `dados_snapshot` guarda só os campos alterados na edição,
+    {campo: {'antes', 'depois'[, 'rotulo_antes', 'rotulo_depois']}}, com os nomes
+    das FKs capturados no momento da gravação. Formato COMPLETO (legado): cópia
+    integral de model_to_dict do estado anterior.
     """
+    FORMATO_CHOICES = [
+        ('COMPLETO', 'Snapshot Completo'),
+        ('DELTA', 'Delta por Campo'),
+    ]
+
     apontamento_original = models.ForeignKey(
         Apontamento,
         on_delete=models.CASCADE,
@@ -449,6 +556,13 @@ class ApontamentoHistorico(models.Model):
     dados_snapshot = models.JSONField(
         verbose_name="Cópia dos Dados (Snapshot)"
     )
+
+    formato = models.CharField(
+        max_length=10,
+        choices=FORMATO_CHOICES,
+        default='COMPLETO',
+        verbose_name="Formato do Registro"
+    )
     
     editado_por = models.ForeignKey(
         User,
@@ -513,10 +627,24 @@ class Notificacao(models.Model):
         verbose_name="Resposta/Justificativa"
     )
 
+    # Espelho indexável de "comentario_colaborador preenchido" (TextField não entra em índice)
+    possui_resposta = models.BooleanField(default=False, editable=False)
+
     class Meta:
         verbose_name = "Notificação"
         verbose_name_plural = "Notificações"
         ordering = ['-data_criacao']
+        indexes = [
+            models.Index(fields=['possui_resposta', '-data_criacao'], name='notif_respostas_idx'),
+            models.Index(fields=['colaborador', '-data_criacao'], name='notif_colab_data_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.possui_resposta = bool(self.comentario_colaborador)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'comentario_colaborador' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'possui_resposta'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.colaborador.nome_completo} - {self.titulo}"
@@ -568,8 +696,131 @@ class LogAuditoria(models.Model):
         ordering = ['-data_hora']
         indexes = [
             models.Index(fields=['data_hora', 'acao']),
+            # Filtros da trilha (usuário / ação) + paginação por cursor em (data_hora, id)
+            models.Index(fields=['usuario', 'acao', 'data_hora', 'id'], name='log_usuario_acao_data_idx'),
+            models.Index(fields=['usuario', 'data_hora', 'id'], name='log_usuario_data_idx'),
+            models.Index(fields=['acao', 'data_hora', 'id'], name='log_acao_data_idx'),
+            models.Index(fields=['data_hora', 'id'], name='log_data_id_idx'),
         ]
 
     def __str__(self):
         user_str = self.usuario.username if self.usuario else "Usuário Removido/Sistema"
-        return f"[{self.data_hora.strftime('%d/%m %H:%M')}] {user_str} - {self.acao}"
\ No newline at end of file
+        return f"[{self.data_hora.strftime('%d/%m %H:%M')}] {user_str} - {self.acao}"
+
+# ==============================================================================
+# AUDITORIA DE CONSISTÊNCIA DOS APONTAMENTOS
+# ==============================================================================
+
+class InconsistenciaApontamento(models.Model):
+    """
+    Achados do comando `auditar_consistencia`: sobreposições, lacunas na jornada,
+    timers esquecidos abertos e rateios cuja divisão não fecha com o intervalo do grupo.
+    """
+    TIPO_CHOICES = [
+        ('SOBREPOSICAO', 'Sobreposição de Horário'),
+        ('LACUNA', 'Lacuna na Jornada'),
+        ('TIMER_ABERTO', 'Timer Esquecido Aberto'),
+        ('RATEIO', 'Rateio Inconsistente'),
+    ]
+
+    tipo = models.CharField(max_length=20, choices=TIPO_CHOICES)
+    colaborador = models.ForeignKey(Colaborador, on_delete=models.CASCADE, related_name='inconsistencias')
+    apontamento = models.ForeignKey(
+        Apontamento, on_delete=models.CASCADE, null=True, blank=True, related_name='inconsistencias'
+    )
+    apontamento_relacionado = models.ForeignKey(
+        Apontamento, on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+        verbose_name="Apontamento Relacionado"
+    )
+    id_agrupamento = models.CharField(max_length=100, null=True, blank=True, verbose_name="ID de Agrupamento (Rateio)")
+    data_referencia = models.DateField(verbose_name="Data")
+    minutos = models.IntegerField(default=0, verbose_name="Minutos Afetados")
+    detalhes = models.TextField(blank=True, default='')
+    corrigido = models.BooleanField(default=False, verbose_name="Corrigido Automaticamente")
+    detectado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Inconsistência de Apontamento"
+        verbose_name_plural = "Inconsistências de Apontamentos"
+        ordering = ['-data_referencia', 'colaborador']
+        indexes = [
+            models.Index(fields=['tipo', 'data_referencia'], name='inconsist_tipo_data_idx'),
+            models.Index(fields=['corrigido', 'data_referencia'], name='inconsist_corrigido_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} - {self.colaborador} ({self.data_referencia})"
+
+
+# ==============================================================================
+# CONTADORES DESNORMALIZADOS POR SETOR
+# ==============================================================================
+
+class ContadorSetor(models.Model):
+    """
+    Pendências por setor mantidas incrementalmente (ContadoresSetorService) a cada
+    transição de status, criação e exclusão de apontamento. Badges de menus e painéis
+    leem esta tabela em vez de varrer os apontamentos. Linha sem setor = colaboradores
+    não lotados. O comando `reconciliar_contadores` recalcula tudo a partir da origem.
+    """
+    setor = models.OneToOneField(
+        Setor, on_delete=models.CASCADE, null=True, blank=True, related_name='contador',
+        verbose_name="Setor"
+    )
+    pendentes = models.IntegerField(default=0, verbose_name="Aguardando Aprovação")
+    ajustes_pendentes = models.IntegerField(default=0, verbose_name="Solicitações de Ajuste")
+    alertas_clt = models.IntegerField(default=0, verbose_name="Alertas CLT")
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Contador do Setor"
+        verbose_name_plural = "Contadores dos Setores"
+
+    def __str__(self):
+        return f"{self.setor or 'Sem setor'}: {self.pendentes} pendentes"
+
+
+# ==============================================================================
+# TABELAS DO AGENDADOR DE ROTINAS
+# ==============================================================================
+
+class TarefaAgendada(models.Model):
+    """
+    Estado da última execução de cada rotina executada pelo comando `agendador`.
+    """
+    STATUS_CHOICES = [
+        ('EXECUTANDO', 'Em Execução'),
+        ('SUCESSO', 'Sucesso'),
+        ('ERRO', 'Erro'),
+    ]
+
+    nome = models.CharField(max_length=100, unique=True, verbose_name="Rotina")
+    ultima_execucao = models.DateTimeField(null=True, blank=True, verbose_name="Última Execução")
+    ultima_duracao_segundos = models.FloatField(null=True, blank=True, verbose_name="Duração (s)")
+    ultimo_status = models.CharField(max_length=20, choices=STATUS_CHOICES, null=True, blank=True, verbose_name="Resultado")
+    ultima_mensagem = models.TextField(blank=True, null=True, verbose_name="Saída / Erro")
+    total_execucoes = models.IntegerField(default=0, verbose_name="Qtd. Execuções")
+
+    class Meta:
+        verbose_name = "Rotina Agendada"
+        verbose_name_plural = "Rotinas Agendadas"
+        ordering = ['nome']
+
+    def __str__(self):
+        return f"{self.nome} ({self.ultimo_status or 'Nunca executada'})"
+
+
+class TravaAgendador(models.Model):
+    """
+    Linha de trava (lease) que garante um único agendador ativo entre os servidores.
+    """
+    nome = models.CharField(max_length=50, unique=True)
+    dono = models.CharField(max_length=255, blank=True, default='', verbose_name="Processo Detentor")
+    expira_em = models.DateTimeField(verbose_name="Expira Em")
+
+    class Meta:
+        verbose_name = "Trava do Agendador"
+        verbose_name_plural = "Travas do Agendador"
+
+    def __str__(self):
+        return f"{self.nome} -> {self.dono or 'livre'}"
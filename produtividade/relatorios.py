@@ -1,12 +1,15 @@
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.shortcuts import HttpResponse
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 from datetime import timedelta, datetime, date
 import openpyxl
 from openpyxl.styles import Font, PatternFill, Alignment
 
+import csv
 from .models import Apontamento
-from .utils import is_owner
+from .utils import is_owner, registrar_log
+from .services import TrilhaAuditoriaService
 
 @login_required
 @user_passes_test(is_owner)
@@ -165,4 +168,44 @@ def exportar_relatorio_excel(request):
     response['Content-Disposition'] = f'attachment; filename={filename}'
     
     wb.save(response)
-    return response
\ No newline at end of file
+    return response
+
+class _Eco:
+    """Pseudo-arquivo para o csv.writer: devolve a linha em vez de acumular em memória."""
+    def write(self, valor):
+        return valor
+
+
+@login_required
+@user_passes_test(is_owner)
+def exportar_auditoria_csv(request):
+    """
+    Exporta a trilha de auditoria filtrada (data_ini/data_fim, user, acao) em CSV.
+    A resposta é gerada em streaming: memória constante mesmo para um ano inteiro de logs.
+    """
+    user_id = request.GET.get('user')
+    user_id = user_id if user_id and user_id.isdigit() else None
+    acao = request.GET.get('acao') or None
+    data_ini = request.GET.get('data_ini')
+    data_fim = request.GET.get('data_fim') or data_ini
+
+    inicio, fim = TrilhaAuditoriaService.intervalo_por_datas(data_ini, data_fim) if data_ini else (None, None)
+
+    registrar_log(request, 'EXPORTACAO', 'LogAuditoria', None,
+                  f"Exportação CSV da auditoria. Período: {data_ini or 'tudo'} a {data_fim or 'tudo'} | Usuário: {user_id or 'todos'} | Ação: {acao or 'todas'}")
+
+    escritor = csv.writer(_Eco(), delimiter=';')
+
+    def gerar_linhas():
+        yield '\ufeff'  # BOM para o Excel reconhecer UTF-8
+        yield escritor.writerow(['ID', 'Data/Hora', 'Usuário', 'Ação', 'Módulo', 'Objeto', 'IP', 'Detalhes'])
+        for log_id, data_hora, usuario, acao_log, modelo, objeto_id, ip, detalhes in TrilhaAuditoriaService.linhas_exportacao(user_id, acao, inicio, fim):
+            yield escritor.writerow([
+                log_id, timezone.localtime(data_hora).strftime('%d/%m/%Y %H:%M:%S'),
+                usuario, acao_log, modelo, objeto_id, ip, detalhes
+            ])
+
+    nome_arquivo = f"auditoria_{data_ini or 'completa'}_{data_fim or ''}".rstrip('_')
+    response = StreamingHttpResponse(gerar_linhas(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{nome_arquivo}.csv"'
+    return response
@@ -1,40 +1,87 @@
-from datetime import timedelta, date
-from .models import Colaborador, Feriado
+from datetime import timedelta, date, datetime, time
+from decimal import Decimal
+from .models import Colaborador, Feriado, Apontamento, ApontamentoHistorico, Notificacao, LogAuditoria, Projeto, CodigoCliente, CentroCusto, Veiculo, ContadorSetor
+from .utils import normalizar_texto, distribuir_horarios_com_gap, calcular_regras_clt, registrar_log
+from collections import deque, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from django.conf import settings
 from django.core.cache import cache
+from django.db import models, transaction
 from django.db.models import Q
+from django.utils import timezone
+from functools import lru_cache
 import os
+import gzip
+import math
+import hashlib
+import uuid
+import json
 import logging
 import requests
 import calendar
+import holidays
 
 logger = logging.getLogger('services')
 
 class FeriadoService:
     """
     Serviço responsável por verificar os feriados.
+    - Nacionais e estaduais: calculados localmente pelo pacote `holidays` (offline, memoizado por ano/UF).
+    - Municipais: tabela Feriado, carregada uma vez por ano/cidade e mantida em cache.
     """
+    TIMEOUT_CACHE_MUNICIPAL = 86400
+
     @staticmethod
-    def eh_feriado(data_ref, cidade=None, uf=None):
-        cidade_busca = cidade.strip().upper() if cidade else ""
-        uf_busca = uf.strip().upper() if uf else ""
+    @lru_cache(maxsize=256)
+    def feriados_oficiais(ano: int, uf: str = "") -> dict:
+        """Feriados nacionais (e estaduais, se a UF for informada) do ano. Não acessa o banco."""
+        try:
+            calendario = holidays.country_holidays('BR', subdiv=uf or None, years=ano)
+        except NotImplementedError:
+            logger.warning(f"UF '{uf}' não reconhecida para feriados estaduais. Usando apenas nacionais.")
+            calendario = holidays.country_holidays('BR', years=ano)
+        return dict(calendario)
 
-        cidade_cache = cidade_busca.replace(" ", "_")
-        uf_cache = uf_busca.replace(" ", "_")
+    @staticmethod
+    def chave_cache_municipal(ano, cidade, uf):
+        return f"feriados_municipais_{ano}_{normalizar_texto(cidade).replace(' ', '_')}_{normalizar_texto(uf)}"
 
-        cache_key = f"feriado_{data_ref}_{cidade_cache}_{uf_cache}"
-        
+    @staticmethod
+    def feriados_municipais(ano: int, cidade: str, uf: str) -> dict:
+        """Feriados cadastrados no banco para a cidade/UF no ano (1 consulta por ano/cidade, depois cache)."""
+        cache_key = FeriadoService.chave_cache_municipal(ano, cidade, uf)
         resultado = cache.get(cache_key)
-        
+
         if resultado is None:
-            resultado = Feriado.objects.filter(
-                data=data_ref,
-                cidade__iexact=cidade_busca,
-                uf__iexact=uf_busca
-            ).exists()
-            cache.set(cache_key, resultado, 86400)
-            
+            resultado = dict(Feriado.objects.filter(
+                data__range=(date(ano, 1, 1), date(ano, 12, 31)),
+                cidade__iexact=normalizar_texto(cidade),
+                uf__iexact=normalizar_texto(uf)
+            ).values_list('data', 'descricao'))
+            cache.set(cache_key, resultado, FeriadoService.TIMEOUT_CACHE_MUNICIPAL)
+
         return resultado
 
+    @staticmethod
+    def feriados_do_ano(ano: int, cidade=None, uf=None) -> dict:
+        """Mapa {data: descrição} com feriados nacionais, estaduais e municipais mesclados."""
+        uf_busca = normalizar_texto(uf)
+        feriados = dict(FeriadoService.feriados_oficiais(ano, uf_busca))
+
+        if cidade and uf_busca:
+            feriados.update(FeriadoService.feriados_municipais(ano, cidade, uf_busca))
+
+        return feriados
+
+    @staticmethod
+    def nome_feriado(data_ref, cidade=None, uf=None):
+        return FeriadoService.feriados_do_ano(data_ref.year, cidade, uf).get(data_ref)
+
+    @staticmethod
+    def eh_feriado(data_ref, cidade=None, uf=None):
+        return data_ref in FeriadoService.feriados_do_ano(data_ref.year, cidade, uf)
+
 class ControlePontoService:
     """
     Serviço responsável por consultar a fonte oficial de ponto (Futuramente API Sólides).
@@ -46,14 +93,18 @@ class ControlePontoService:
     TOLERANCIA_PADRAO = 900  # 15 minutos em segundos
 
     @staticmethod
-    def _calcular_meta_padrao(data_ref: date, cidade: str, uf: str) -> dict:
+    def _calcular_meta_padrao(data_ref: date, cidade: str, uf: str, feriados: dict = None) -> dict:
         """
         Método privado que centraliza a regra de negócio local (Fallback) para definir 
         a meta diária com base em dias úteis, finais de semana e feriados.
+        `feriados` permite reaproveitar o mapa do ano já carregado pelo chamador.
         """
         dia_semana = data_ref.weekday()
         is_fim_de_semana = dia_semana >= 5
-        is_feriado = FeriadoService.eh_feriado(data_ref, cidade, uf)
+        if feriados is None:
+            is_feriado = FeriadoService.eh_feriado(data_ref, cidade, uf)
+        else:
+            is_feriado = data_ref in feriados
         
         is_dia_folga = is_fim_de_semana or is_feriado
 
@@ -136,9 +187,15 @@ class ControlePontoService:
         # ---------------------------------------------------------
         # 3. PROCESSAMENTO E FALLBACK
         # ---------------------------------------------------------
+        feriados_por_local = {}
+
         for colab in colaboradores:
             if colab.id not in ids_para_consultar:
                 continue 
+
+            local = (colab.cidade, colab.uf)
+            if local not in feriados_por_local:
+                feriados_por_local[local] = FeriadoService.feriados_do_ano(ano, colab.cidade, colab.uf)
                 
             for dia in range(1, num_dias + 1):
                 data_atual = date(ano, mes, dia)
@@ -151,11 +208,592 @@ class ControlePontoService:
                     mapa_escalas[colab.id][data_atual] = ControlePontoService._calcular_meta_padrao(
                         data_atual, 
                         colab.cidade, 
-                        colab.uf
+                        colab.uf,
+                        feriados_por_local[local]
                     )
 
         return mapa_escalas
     
+# ==============================================================================
+# SERVIÇO DE CONFLITO DE HORÁRIOS (SOBREPOSIÇÃO DE INTERVALOS)
+# ==============================================================================
+
+class ConflitoHorarioService:
+    """
+    Detecção de sobreposição entre apontamentos de um colaborador.
+    Cada apontamento vira um intervalo absoluto [início, fim): término menor que o início
+    atravessa a meia-noite e atividades em andamento (sem término) valem até agora.
+    Os gravados já trazem o intervalo pronto (inicio_em/fim_em): uma consulta por faixa de
+    instantes no índice (colaborador, inicio_em) e a comparação é feita em memória.
+    """
+
+    TITULOS = {
+        'MESMO_DIA': "Conflito de horário (Mesmo dia)",
+        'DIA_ANTERIOR': "Conflito Interjornada (Dia Anterior)",
+        'DIA_SEGUINTE': "Conflito Interjornada (Dia Seguinte)",
+        'ENTRE_CANDIDATOS': "Conflito entre os horários informados",
+    }
+    PRIORIDADE = ['MESMO_DIA', 'DIA_ANTERIOR', 'DIA_SEGUINTE', 'ENTRE_CANDIDATOS']
+
+    @staticmethod
+    def intervalo(data_ref, inicio, termino, agora=None):
+        """Converte (data, início, término) em datetimes [início, fim) sem fuso."""
+        dt_inicio = datetime.combine(data_ref, inicio)
+        if termino is None:
+            agora = agora or timezone.localtime(timezone.now()).replace(tzinfo=None)
+            return dt_inicio, max(dt_inicio, agora)
+
+        dt_fim = datetime.combine(data_ref, termino)
+        if dt_fim < dt_inicio:
+            dt_fim += timedelta(days=1)
+        return dt_inicio, dt_fim
+
+    @staticmethod
+    def intervalo_gravado(inicio_em, fim_em, agora=None):
+        """Mesmo formato de `intervalo` a partir dos instantes persistidos (hora local, sem fuso)."""
+        dt_inicio = timezone.localtime(inicio_em).replace(tzinfo=None)
+        if fim_em is None:
+            agora = agora or timezone.localtime(timezone.now()).replace(tzinfo=None)
+            return dt_inicio, max(dt_inicio, agora)
+        return dt_inicio, timezone.localtime(fim_em).replace(tzinfo=None)
+
+    @staticmethod
+    def conflitos(colaborador, candidatos, excluir_ids=()):
+        """
+        `candidatos`: lista de (data, hora_inicio, hora_termino) a validar juntos (ex: rateio, importação).
+        Retorna todos os conflitos como dicts {'candidato': índice, 'tipo', 'apontamento' ou 'outro'},
+        ordenados por gravidade (mesmo dia primeiro) e horário.
+        """
+        if not candidatos:
+            return []
+
+        agora = timezone.localtime(timezone.now()).replace(tzinfo=None)
+        intervalos_candidatos = [
+            ConflitoHorarioService.intervalo(data_ref, inicio, termino, agora)
+            for data_ref, inicio, termino in candidatos
+        ]
+
+        # Faixa de busca: quem começou até 1 dia antes do primeiro candidato (cobre virada de meia-noite
+        # e timers abertos desde o dia anterior) e antes do fim do último
+        janela_ini = timezone.make_aware(min(c[0] for c in intervalos_candidatos) - timedelta(days=1))
+        janela_fim = timezone.make_aware(max(c[1] for c in intervalos_candidatos))
+        existentes = (
+            Apontamento.objects
+            .filter(colaborador=colaborador, inicio_em__gte=janela_ini, inicio_em__lt=janela_fim)
+            .exclude(pk__in=[pk for pk in excluir_ids if pk])
+            .select_related('projeto', 'codigo_cliente', 'centro_custo')
+        )
+        intervalos_existentes = [
+            (ConflitoHorarioService.intervalo_gravado(a.inicio_em, a.fim_em, agora), a)
+            for a in existentes
+        ]
+
+        encontrados = []
+        for indice, (c_inicio, c_fim) in enumerate(intervalos_candidatos):
+            data_ref = candidatos[indice][0]
+
+            for (a_inicio, a_fim), apontamento in intervalos_existentes:
+                if a_inicio < c_fim and c_inicio < a_fim:
+                    if apontamento.data_apontamento == data_ref:
+                        tipo = 'MESMO_DIA'
+                    elif apontamento.data_apontamento < data_ref:
+                        tipo = 'DIA_ANTERIOR'
+                    else:
+                        tipo = 'DIA_SEGUINTE'
+                    encontrados.append({'candidato': indice, 'tipo': tipo, 'apontamento': apontamento, 'inicio': a_inicio})
+
+            for outro in range(indice + 1, len(intervalos_candidatos)):
+                o_inicio, o_fim = intervalos_candidatos[outro]
+                if o_inicio < c_fim and c_inicio < o_fim:
+                    encontrados.append({'candidato': indice, 'tipo': 'ENTRE_CANDIDATOS', 'outro': outro, 'inicio': o_inicio})
+
+        encontrados.sort(key=lambda c: (ConflitoHorarioService.PRIORIDADE.index(c['tipo']), c['inicio']))
+        return encontrados
+
+    # --------------------------------------------------------------------------
+    # PARTICIPAÇÃO (COLABORADOR + AUXILIAR + AUXILIARES EXTRAS)
+    # --------------------------------------------------------------------------
+
+    PAPEIS = {
+        'COLABORADOR': "Colaborador",
+        'AUXILIAR': "Auxiliar",
+        'AUXILIAR_EXTRA': "Auxiliar extra",
+    }
+
+    @staticmethod
+    def participacoes(data_inicio, data_fim, pessoas_ids=None, excluir_ids=()):
+        """
+        Índice de participação {colaborador_id: [(inicio, fim, apontamento_id, papel), ...]} ordenado por início.
+        Cada pessoa aparece em todo apontamento em que está: como colaborador, auxiliar ou auxiliar extra.
+        Duas consultas com values(): apontamentos do período e tabela de auxiliares extras.
+        """
+        agora = timezone.localtime(timezone.now()).replace(tzinfo=None)
+        excluir_ids = [pk for pk in excluir_ids if pk]
+        pessoas = set(pessoas_ids) if pessoas_ids is not None else None
+        indice = defaultdict(list)
+
+        diretos = Apontamento.objects.filter(data_apontamento__gte=data_inicio, data_apontamento__lte=data_fim).exclude(pk__in=excluir_ids)
+        if pessoas is not None:
+            diretos = diretos.filter(Q(colaborador_id__in=pessoas) | Q(auxiliar_id__in=pessoas))
+
+        for apt in diretos.values('id', 'inicio_em', 'fim_em', 'colaborador_id', 'auxiliar_id').order_by():
+            inicio, fim = ConflitoHorarioService.intervalo_gravado(apt['inicio_em'], apt['fim_em'], agora)
+            if pessoas is None or apt['colaborador_id'] in pessoas:
+                indice[apt['colaborador_id']].append((inicio, fim, apt['id'], 'COLABORADOR'))
+            if apt['auxiliar_id'] and (pessoas is None or apt['auxiliar_id'] in pessoas):
+                indice[apt['auxiliar_id']].append((inicio, fim, apt['id'], 'AUXILIAR'))
+
+        extras = Apontamento.auxiliares_extras.through.objects.filter(
+            apontamento__data_apontamento__gte=data_inicio,
+            apontamento__data_apontamento__lte=data_fim,
+        ).exclude(apontamento_id__in=excluir_ids)
+        if pessoas is not None:
+            extras = extras.filter(colaborador_id__in=pessoas)
+
+        for extra in extras.values('colaborador_id', 'apontamento_id', 'apontamento__inicio_em', 'apontamento__fim_em'):
+            inicio, fim = ConflitoHorarioService.intervalo_gravado(extra['apontamento__inicio_em'], extra['apontamento__fim_em'], agora)
+            indice[extra['colaborador_id']].append((inicio, fim, extra['apontamento_id'], 'AUXILIAR_EXTRA'))
+
+        for lista in indice.values():
+            lista.sort()
+        return indice
+
+    @staticmethod
+    def conflitos_participacao(data_ref, inicio, termino, pessoas_ids, colaborador_id=None, excluir_ids=()):
+        """
+        Pessoas do formulário (colaborador + auxiliares) já presentes em outro apontamento no mesmo horário.
+        O colaborador como titular dos próprios apontamentos fica de fora: isso já é coberto por `conflitos`.
+        """
+        pessoas_ids = {p for p in pessoas_ids if p}
+        if not pessoas_ids:
+            return []
+
+        c_inicio, c_fim = ConflitoHorarioService.intervalo(data_ref, inicio, termino)
+        indice = ConflitoHorarioService.participacoes(
+            data_ref - timedelta(days=1), data_ref + timedelta(days=1), pessoas_ids=pessoas_ids, excluir_ids=excluir_ids
+        )
+
+        encontrados = []
+        for pessoa_id, lista in indice.items():
+            for a_inicio, a_fim, apontamento_id, papel in lista:
+                if pessoa_id == colaborador_id and papel == 'COLABORADOR':
+                    continue
+                if a_inicio < c_fim and c_inicio < a_fim:
+                    encontrados.append({'pessoa_id': pessoa_id, 'apontamento_id': apontamento_id, 'papel': papel, 'inicio': a_inicio, 'fim': a_fim})
+        encontrados.sort(key=lambda c: c['inicio'])
+        return encontrados
+
+    @staticmethod
+    def varrer_sobreposicoes(indice):
+        """
+        Sort-and-sweep por pessoa sobre o índice de participação (já ordenado por início).
+        Gera cada par de participações sobrepostas em apontamentos diferentes.
+        """
+        for pessoa_id, lista in indice.items():
+            ativos = []
+            for atual in lista:
+                ativos = [a for a in ativos if a[1] > atual[0]]
+                for anterior in ativos:
+                    if anterior[2] != atual[2]:
+                        minutos = int((min(anterior[1], atual[1]) - atual[0]).total_seconds() // 60)
+                        yield {'pessoa_id': pessoa_id, 'primeiro': anterior, 'segundo': atual, 'minutos': minutos}
+                ativos.append(atual)
+
+
+# ==============================================================================
+# SERVIÇO DE RATEIO (CRIAÇÃO EM LOTE)
+# ==============================================================================
+
+class RateioService:
+    """
+    Divide um apontamento em fatias sequenciais (uma por obra/cliente) e grava tudo em lote:
+    in_bulk dos alvos, um bulk_create dos apontamentos, um bulk_create dos auxiliares extras,
+    logs no buffer da requisição e um cálculo CLT por dia contábil afetado.
+    O número de consultas não depende da quantidade de obras.
+    """
+
+    # Dados comuns copiados do apontamento base para cada fatia
+    CAMPOS_COPIADOS = [
+        'colaborador', 'data_apontamento', 'local_execucao', 'veiculo', 'veiculo_manual_modelo',
+        'veiculo_manual_placa', 'auxiliar', 'ocorrencias', 'em_plantao', 'data_plantao',
+        'dorme_fora', 'data_dorme_fora', 'latitude', 'longitude', 'registrado_por',
+    ]
+
+    @staticmethod
+    def resolver_alvos(itens):
+        """'P_<id>' / 'C_<id>' -> [(Projeto ou None, CodigoCliente ou None)], ignorando ids inexistentes."""
+        pares = []
+        for item in itens:
+            prefixo, _, obj_id = item.strip().partition('_')
+            if prefixo in ('P', 'C') and obj_id.isdigit():
+                pares.append((prefixo, int(obj_id)))
+
+        ids_projetos = [i for p, i in pares if p == 'P']
+        ids_clientes = [i for p, i in pares if p == 'C']
+        projetos = Projeto.objects.in_bulk(ids_projetos) if ids_projetos else {}
+        clientes = CodigoCliente.objects.in_bulk(ids_clientes) if ids_clientes else {}
+
+        alvos = []
+        for prefixo, obj_id in pares:
+            if prefixo == 'P' and obj_id in projetos:
+                alvos.append((projetos[obj_id], None))
+            elif prefixo == 'C' and obj_id in clientes:
+                alvos.append((None, clientes[obj_id]))
+        return alvos
+
+    @staticmethod
+    def criar(base, itens, auxiliares_extras_ids=(), request=None):
+        """
+        Cria as fatias do rateio a partir de `base` (Apontamento não salvo com os dados do formulário).
+        Deve ser chamado dentro de transaction.atomic(). Retorna os apontamentos criados.
+        """
+        alvos = RateioService.resolver_alvos(itens)
+        if not alvos:
+            return []
+
+        # Horários distribuídos só entre os alvos válidos: as fatias cobrem o intervalo inteiro
+        horarios = distribuir_horarios_com_gap(base.hora_inicio, base.hora_termino, len(alvos))
+        agrupamento_uid = str(uuid.uuid4())
+
+        novos = []
+        for (projeto, cliente), (inicio, termino) in zip(alvos, horarios):
+            novo = Apontamento(**{campo: getattr(base, campo) for campo in RateioService.CAMPOS_COPIADOS})
+            novo.hora_inicio = inicio
+            novo.hora_termino = termino
+            novo.projeto = projeto
+            novo.codigo_cliente = cliente
+            novo.status_aprovacao = 'EM_ANALISE'
+            novo.contagem_edicao = 0
+            novo.id_agrupamento = agrupamento_uid
+            # bulk_create não passa pelo save(): instantes calculados aqui
+            novo.sincronizar_instantes()
+            novos.append(novo)
+
+        criados = Apontamento.objects.bulk_create(novos)
+        # bulk_create não dispara sinais: todas as fatias são do mesmo colaborador e setor
+        deltas = {}
+        for novo in criados:
+            ContadoresSetorService.somar(deltas, base.colaborador.setor_id, ContadoresSetorService.estado(novo))
+        ContadoresSetorService.aplicar(deltas)
+        if any(a.pk is None for a in criados):
+            # Backend sem RETURNING no bulk insert: recupera as fatias pelo agrupamento
+            criados = list(
+                Apontamento.objects.filter(id_agrupamento=agrupamento_uid)
+                .select_related('projeto', 'codigo_cliente').order_by('hora_inicio', 'id')
+            )
+
+        if auxiliares_extras_ids:
+            validos = list(Colaborador.objects.filter(pk__in=set(auxiliares_extras_ids)).values_list('id', flat=True))
+            Through = Apontamento.auxiliares_extras.through
+            Through.objects.bulk_create([
+                Through(apontamento_id=apontamento.pk, colaborador_id=colaborador_id)
+                for apontamento in criados for colaborador_id in validos
+            ])
+
+        for apontamento in criados:
+            nome_obra = apontamento.projeto.nome if apontamento.projeto else (apontamento.codigo_cliente.nome if apontamento.codigo_cliente else "Obra Indefinida")
+            registrar_log(
+                request, 'CRIACAO', 'Apontamento', apontamento.id,
+                f"Rateio automático criado: {nome_obra} | Horário: {apontamento.hora_inicio} - {apontamento.hora_termino}"
+            )
+
+        for data_contabil in sorted({a.data_contabil for a in criados}):
+            calcular_regras_clt(base.colaborador, data_contabil)
+
+        return criados
+
+
+# ==============================================================================
+# SERVIÇO DE DIFF DE SNAPSHOTS (ANÁLISE DE EDIÇÕES)
+# ==============================================================================
+
+class DiffSnapshotService:
+    """
+    Compara o snapshot salvo no histórico (JSON de model_to_dict) com o registro atual.
+    Percorre os campos do modelo e normaliza pelo tipo (FK, hora, data, booleano, choices, texto).
+    Os nomes das FKs alteradas são resolvidos em lote, com um in_bulk por modelo relacionado,
+    então uma fila inteira de aprovação custa o mesmo que um único registro.
+    """
+
+    # Campo -> (rótulo, ícone), na ordem de exibição da tela de análise
+    CAMPOS_APONTAMENTO = {
+        'hora_inicio': ('Hora Início', 'clock'),
+        'hora_termino': ('Hora Término', 'clock'),
+        'local_execucao': ('Local', 'map'),
+        'projeto': ('Projeto/Obra', 'briefcase'),
+        'codigo_cliente': ('Cliente', 'user'),
+        'veiculo': ('Veículo (Frota)', 'truck'),
+        'veiculo_manual_placa': ('Veículo (Externo/Placa)', 'truck'),
+        'em_plantao': ('Em Plantão?', 'siren'),
+        'dorme_fora': ('Dorme Fora?', 'moon'),
+        'ocorrencias': ('Observações', 'pencil'),
+        'centro_custo': ('Centro de Custo', 'map'),
+        'veiculo_manual_modelo': ('Modelo Veículo (Manual)', 'truck'),
+        'auxiliar': ('Auxiliar Principal', 'user'),
+        'data_apontamento': ('Data do Registro', 'calendar'),
+    }
+
+    @staticmethod
+    def _normalizar(campo, valor):
+        """Leva o valor do snapshot (JSON) e o do modelo à mesma forma comparável."""
+        if valor in (None, ''):
+            return None if not isinstance(campo, models.BooleanField) else False
+        if isinstance(campo, models.ForeignKey):
+            return int(valor)
+        if isinstance(campo, models.BooleanField):
+            return bool(valor)
+        if isinstance(campo, models.TimeField):
+            return valor.strftime('%H:%M') if hasattr(valor, 'strftime') else str(valor)[:5]
+        if isinstance(campo, models.DateField):
+            return valor.isoformat() if hasattr(valor, 'isoformat') else str(valor)[:10]
+        if isinstance(campo, (models.CharField, models.TextField)):
+            return str(valor).strip() or None
+        return valor
+
+    @staticmethod
+    def _formatar(campo, valor, rotulos):
+        if isinstance(campo, models.BooleanField):
+            return "SIM" if valor else "NÃO"
+        if valor is None:
+            return "-"
+        if isinstance(campo, models.ForeignKey):
+            rotulo = rotulos.get(campo.related_model, {}).get(valor)
+            return rotulo if rotulo is not None else f"(ID: {valor} removido)"
+        if isinstance(campo, models.DateField):
+            return datetime.strptime(valor, '%Y-%m-%d').strftime('%d/%m/%Y')
+        if campo.choices:
+            return str(dict(campo.flatchoices).get(valor, valor)).upper()
+        return str(valor)
+
+    @staticmethod
+    def comparar_lote(pares, campos=None):
+        """
+        `pares`: [(snapshot, instância)]. Retorna, na mesma ordem, a lista de diferenças de cada par:
+        [{'campo', 'antes', 'depois', 'icon'}]. Instâncias devem ser do mesmo modelo.
+        """
+        if not pares:
+            return []
+        campos = campos or DiffSnapshotService.CAMPOS_APONTAMENTO
+        meta = pares[0][1]._meta
+
+        # 1ª passada: campos alterados (valores crus) e ids de FK por modelo relacionado
+        alteracoes = []
+        ids_por_modelo = defaultdict(set)
+        for snapshot, instancia in pares:
+            mudancas = []
+            for nome in campos:
+                campo = meta.get_field(nome)
+                antes = DiffSnapshotService._normalizar(campo, snapshot.get(nome))
+                depois = DiffSnapshotService._normalizar(campo, getattr(instancia, campo.attname))
+                if antes != depois:
+                    mudancas.append((nome, campo, antes, depois))
+                    if isinstance(campo, models.ForeignKey):
+                        ids_por_modelo[campo.related_model].update(v for v in (antes, depois) if v is not None)
+            alteracoes.append(mudancas)
+
+        # 2ª passada: um in_bulk por modelo relacionado
+        rotulos = {
+            modelo: {pk: str(obj) for pk, obj in modelo.objects.in_bulk(list(ids)).items()}
+            for modelo, ids in ids_por_modelo.items()
+        }
+
+        return [
+            [
+                {
+                    'campo': campos[nome][0],
+                    'antes': DiffSnapshotService._formatar(campo, antes, rotulos),
+                    'depois': DiffSnapshotService._formatar(campo, depois, rotulos),
+                    'icon': campos[nome][1],
+                }
+                for nome, campo, antes, depois in mudancas
+            ]
+            for mudancas in alteracoes
+        ]
+
+    @staticmethod
+    def ultimos_historicos(apontamento_ids):
+        """Última versão do histórico de cada apontamento, em uma consulta: {apontamento_id: historico}."""
+        ultimos = {}
+        if not apontamento_ids:
+            return ultimos
+        historicos = (
+            ApontamentoHistorico.objects.filter(apontamento_original_id__in=apontamento_ids)
+            .select_related('editado_por').order_by('apontamento_original_id', '-numero_edicao')
+        )
+        for historico in historicos:
+            ultimos.setdefault(historico.apontamento_original_id, historico)
+        return ultimos
+
+    @staticmethod
+    def comparar_historicos(pares, campos=None):
+        """
+        `pares`: [(historico, instância)]. Históricos em DELTA já trazem antes/depois e os nomes
+        das FKs gravados na edição (nenhuma consulta); os legados (COMPLETO) passam por comparar_lote.
+        """
+        campos = campos or DiffSnapshotService.CAMPOS_APONTAMENTO
+        resultado = [None] * len(pares)
+        legados = []
+        for i, (historico, instancia) in enumerate(pares):
+            if historico.formato != 'DELTA':
+                legados.append(i)
+                continue
+            meta = instancia._meta
+            diffs = []
+            for nome, (rotulo, icone) in campos.items():
+                alteracao = historico.dados_snapshot.get(nome)
+                if alteracao is None:
+                    continue
+                campo = meta.get_field(nome)
+                valores = []
+                for lado in ('antes', 'depois'):
+                    valor = DiffSnapshotService._normalizar(campo, alteracao.get(lado))
+                    if isinstance(campo, models.ForeignKey) and valor is not None:
+                        valores.append(alteracao.get(f'rotulo_{lado}') or f"(ID: {valor} removido)")
+                    else:
+                        valores.append(DiffSnapshotService._formatar(campo, valor, {}))
+                if valores[0] != valores[1]:
+                    diffs.append({'campo': rotulo, 'antes': valores[0], 'depois': valores[1], 'icon': icone})
+            resultado[i] = diffs
+
+        if legados:
+            diffs_legados = DiffSnapshotService.comparar_lote(
+                [(pares[i][0].dados_snapshot, pares[i][1]) for i in legados], campos
+            )
+            for i, diffs in zip(legados, diffs_legados):
+                resultado[i] = diffs
+        return resultado
+
+
+class HistoricoVersaoService:
+    """
+    Histórico de edições em deltas: cada versão guarda só os campos alterados, com valores
+    crus (JSON) e o nome das FKs capturado na gravação, para que exclusões posteriores de
+    projetos/veículos não apaguem o que o gestor vê. Qualquer versão é reconstruída
+    aplicando os deltas de trás para frente a partir do registro atual.
+    """
+
+    EXCLUIDOS = ('id', 'user_account')
+
+    @staticmethod
+    def campos(meta):
+        return [
+            f for f in meta.concrete_fields
+            if f.editable and not f.primary_key and f.name not in HistoricoVersaoService.EXCLUIDOS
+        ]
+
+    @staticmethod
+    def _serializar(valor):
+        if isinstance(valor, (datetime, date, time)):
+            return valor.isoformat()
+        if isinstance(valor, Decimal):
+            return str(valor)
+        return valor
+
+    @staticmethod
+    def capturar(instancia):
+        """Estado atual em JSON, no mesmo formato do snapshot legado (FK como id, datas em ISO)."""
+        return {
+            f.name: HistoricoVersaoService._serializar(getattr(instancia, f.attname))
+            for f in HistoricoVersaoService.campos(instancia._meta)
+        }
+
+    @staticmethod
+    def delta(antes, depois):
+        """Campos cujo valor mudou: {campo: {'antes', 'depois'}}. Chaves ausentes em `antes` são ignoradas."""
+        return {
+            nome: {'antes': antes[nome], 'depois': valor}
+            for nome, valor in depois.items()
+            if nome in antes and antes[nome] != valor
+        }
+
+    @staticmethod
+    def rotular(deltas, meta):
+        """Grava o nome das FKs em cada delta da lista (in-place), com um in_bulk por modelo relacionado."""
+        ids_por_modelo = defaultdict(set)
+        for delta in deltas:
+            for nome, alteracao in delta.items():
+                campo = meta.get_field(nome)
+                if isinstance(campo, models.ForeignKey):
+                    ids_por_modelo[campo.related_model].update(
+                        int(v) for v in (alteracao['antes'], alteracao['depois']) if v not in (None, '')
+                    )
+
+        rotulos = {
+            modelo: {pk: str(obj) for pk, obj in modelo.objects.in_bulk(list(ids)).items()}
+            for modelo, ids in ids_por_modelo.items()
+        }
+
+        for delta in deltas:
+            for nome, alteracao in delta.items():
+                campo = meta.get_field(nome)
+                if not isinstance(campo, models.ForeignKey):
+                    continue
+                for lado in ('antes', 'depois'):
+                    if alteracao[lado] not in (None, ''):
+                        alteracao[f'rotulo_{lado}'] = rotulos.get(campo.related_model, {}).get(int(alteracao[lado]))
+        return deltas
+
+    @staticmethod
+    def registrar_edicao(instancia, estado_anterior, usuario):
+        """Grava a versão `instancia.contagem_edicao` como delta contra o estado capturado antes da edição."""
+        delta = HistoricoVersaoService.delta(estado_anterior, HistoricoVersaoService.capturar(instancia))
+        HistoricoVersaoService.rotular([delta], instancia._meta)
+        return ApontamentoHistorico.objects.create(
+            apontamento_original=instancia,
+            dados_snapshot=delta,
+            formato='DELTA',
+            editado_por=usuario,
+            numero_edicao=instancia.contagem_edicao,
+        )
+
+    @staticmethod
+    def aplicar_reverso(estado, historico):
+        """Desfaz uma edição sobre `estado`: o resultado é o estado anterior a `historico.numero_edicao`."""
+        if historico.formato == 'DELTA':
+            for nome, alteracao in historico.dados_snapshot.items():
+                estado[nome] = alteracao['antes']
+        else:
+            estado.update({nome: valor for nome, valor in historico.dados_snapshot.items() if nome in estado})
+        return estado
+
+    @staticmethod
+    def reconstruir(apontamento, versao):
+        """Estado (JSON) do apontamento na `versao` indicada (0 = registro original)."""
+        estado = HistoricoVersaoService.capturar(apontamento)
+        historicos = apontamento.historico_versoes.filter(numero_edicao__gt=versao).order_by('-numero_edicao')
+        for historico in historicos:
+            HistoricoVersaoService.aplicar_reverso(estado, historico)
+        return estado
+
+    @staticmethod
+    def compactar(apontamentos, historicos):
+        """
+        Converte os snapshots COMPLETO em DELTA. `historicos`: todas as versões dos `apontamentos`
+        ({id: instância}). Retorna a lista de históricos alterados (ainda não salvos).
+        """
+        por_apontamento = defaultdict(list)
+        for historico in historicos:
+            por_apontamento[historico.apontamento_original_id].append(historico)
+
+        convertidos = []
+        for apontamento_id, versoes in por_apontamento.items():
+            apontamento = apontamentos.get(apontamento_id)
+            if apontamento is None:
+                continue
+            posterior = HistoricoVersaoService.capturar(apontamento)
+            for historico in sorted(versoes, key=lambda h: h.numero_edicao, reverse=True):
+                anterior = HistoricoVersaoService.aplicar_reverso(dict(posterior), historico)
+                if historico.formato != 'DELTA':
+                    historico.dados_snapshot = HistoricoVersaoService.delta(anterior, posterior)
+                    historico.formato = 'DELTA'
+                    convertidos.append(historico)
+                posterior = anterior
+
+        if convertidos:
+            HistoricoVersaoService.rotular([h.dados_snapshot for h in convertidos], Apontamento._meta)
+        return convertidos
+
+
 class WhatsAppService:
     """
     Integração com Script Node.js Local (WPPConnect)
@@ -210,4 +848,996 @@ class WhatsAppService:
             return False
         except Exception as e:
             logger.error(f"Falha de conexão com WhatsApp Service: {e}")
-            return False
\ No newline at end of file
+            return False
+
+class NotificacaoService:
+    """
+    Geração das notificações de pendência de apontamento (sistema + WhatsApp).
+    Usado pela tela de conformidade e pelo agendador.
+    Também mantém o cache do sino de notificações (context processor).
+    """
+    TIMEOUT_CACHE_SINO = 300
+    CHAVE_RESPOSTAS_OWNER = 'notificacoes_respostas_owner'
+
+    @staticmethod
+    def chave_sino(colaborador_id):
+        return f"notificacoes_sino_{colaborador_id}"
+
+    @staticmethod
+    def resumo_colaborador(colaborador_id, limite=10):
+        """Últimas notificações + contagem de não lidas do colaborador (em cache)."""
+        chave = NotificacaoService.chave_sino(colaborador_id)
+        resumo = cache.get(chave)
+        if resumo is None:
+            resumo = {
+                'ultimas': list(Notificacao.objects.filter(colaborador_id=colaborador_id).order_by('-data_criacao')[:limite]),
+                'nao_lidas': Notificacao.objects.filter(colaborador_id=colaborador_id, lida=False).count(),
+            }
+            cache.set(chave, resumo, NotificacaoService.TIMEOUT_CACHE_SINO)
+        return resumo
+
+    @staticmethod
+    def respostas_owner(limite=15):
+        """Últimas respostas dos colaboradores (sino do Owner), em cache."""
+        respostas = cache.get(NotificacaoService.CHAVE_RESPOSTAS_OWNER)
+        if respostas is None:
+            respostas = list(
+                Notificacao.objects.filter(possui_resposta=True)
+                .select_related('colaborador').order_by('-data_criacao')[:limite]
+            )
+            cache.set(NotificacaoService.CHAVE_RESPOSTAS_OWNER, respostas, NotificacaoService.TIMEOUT_CACHE_SINO)
+        return respostas
+
+    @staticmethod
+    def invalidar_cache(colaborador_ids):
+        """Chamado em toda escrita de Notificacao (signals cobrem save/delete; bulk/update chamam direto)."""
+        cache.delete_many(
+            [NotificacaoService.chave_sino(c) for c in set(colaborador_ids)] + [NotificacaoService.CHAVE_RESPOSTAS_OWNER]
+        )
+    @staticmethod
+    def notificar_pendencias(data_ref: date) -> tuple:
+        """
+        Cria alertas para quem não apontou ou apontou menos que a meta em `data_ref`.
+        Retorna (notificações criadas, WhatsApps enviados).
+        """
+        colaboradores = Colaborador.objects.filter(user_account__is_active=True)
+
+        notificacoes_criar = []
+
+        for colab in colaboradores:
+            if not colab.user_account:
+                continue
+
+            dados_ponto = ControlePontoService.obter_meta_do_dia(colab, data_ref)
+
+            if not dados_ponto['deve_notificar']:
+                continue
+
+            meta_segundos = dados_ponto['meta_segundos']
+            tolerancia = dados_ponto['tolerancia_segundos']
+
+            apontamentos = Apontamento.objects.filter(colaborador=colab, data_apontamento=data_ref)
+            total_segundos = 0
+
+            for apt in apontamentos:
+                if apt.hora_inicio and apt.hora_termino:
+                    dummy = date(2000, 1, 1)
+                    dt_ini = datetime.combine(dummy, apt.hora_inicio)
+                    dt_fim = datetime.combine(dummy, apt.hora_termino)
+                    if dt_fim < dt_ini: dt_fim += timedelta(days=1)
+                    total_segundos += (dt_fim - dt_ini).total_seconds()
+
+            if total_segundos == 0:
+                notificacoes_criar.append(Notificacao(
+                    colaborador=colab,
+                    titulo="Ausência de Registro",
+                    mensagem=f"Olá {colab.nome_completo.split()[0]}, não identificamos apontamentos seus no dia {data_ref.strftime('%d/%m')}. Por favor, verifique.",
+                    tipo='ALERTA',
+                    data_referencia=data_ref
+                ))
+
+            elif total_segundos < (meta_segundos - tolerancia):
+                notificacoes_criar.append(Notificacao(
+                    colaborador=colab,
+                    titulo="Horas Incompletas",
+                    mensagem=f"Olá {colab.nome_completo.split()[0]}, identificamos divergência nos horários registrados entre seu Tangerino e seu apontamento no Timesheet do dia {data_ref.strftime('%d/%m')}. Por favor, verifique seus envios.",
+                    tipo='ALERTA',
+                    data_referencia=data_ref
+                ))
+
+        if not notificacoes_criar:
+            return 0, 0
+
+        Notificacao.objects.bulk_create(notificacoes_criar)
+        NotificacaoService.invalidar_cache(n.colaborador_id for n in notificacoes_criar)
+
+        wpp_enviados = 0
+        for notif in notificacoes_criar:
+            if notif.tipo == 'ALERTA':
+                msg_wpp = (
+                    f"*⚠️ Atenção*\n\n"
+                    f"Olá {notif.colaborador.nome_completo.split()[0]},\n"
+                    f"Há notificações no seu Timesheet referentes ao dia {notif.data_referencia.strftime('%d/%m/%Y')}.\n"
+                    f"Por favor, acesse o sistema para verificar."
+                )
+
+                if WhatsAppService.enviar_notificacao_pendencia(notif.colaborador, msg_wpp):
+                    wpp_enviados += 1
+
+        return len(notificacoes_criar), wpp_enviados
+
+
+class ArquivoAuditoriaService:
+    """
+    Arquivo morto da auditoria: meses antigos de LogAuditoria ficam em arquivos
+    gzip JSONL (uma linha por log), listados em um manifesto JSON.
+    A leitura é em streaming, linha a linha, sem carregar o mês inteiro na memória.
+    """
+    NOME_MANIFESTO = 'manifesto.json'
+
+    @staticmethod
+    def diretorio():
+        return Path(settings.AUDITORIA_ARQUIVO_DIR)
+
+    @staticmethod
+    def chave_mes(data_ref):
+        return f"{data_ref.year:04d}-{data_ref.month:02d}"
+
+    @staticmethod
+    def ler_manifesto():
+        """Retorna {'YYYY-MM': [partes]} ou {} se ainda não houver arquivo."""
+        caminho = ArquivoAuditoriaService.diretorio() / ArquivoAuditoriaService.NOME_MANIFESTO
+        if not caminho.exists():
+            return {}
+        with open(caminho, encoding='utf-8') as f:
+            return json.load(f)
+
+    @staticmethod
+    def salvar_manifesto(manifesto):
+        """Escrita atômica (arquivo temporário + rename) para não corromper o manifesto."""
+        diretorio = ArquivoAuditoriaService.diretorio()
+        temporario = diretorio / f"{ArquivoAuditoriaService.NOME_MANIFESTO}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(manifesto, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporario, diretorio / ArquivoAuditoriaService.NOME_MANIFESTO)
+
+    @staticmethod
+    def mes_arquivado(data_ref):
+        return ArquivoAuditoriaService.chave_mes(data_ref) in ArquivoAuditoriaService.ler_manifesto()
+
+    @staticmethod
+    def intervalo_tem_arquivo(inicio, fim):
+        """Indica se algum mês arquivado cruza o intervalo [inicio, fim)."""
+        manifesto = ArquivoAuditoriaService.ler_manifesto()
+        if not manifesto:
+            return False
+        primeiro = ArquivoAuditoriaService.chave_mes(timezone.localtime(inicio))
+        ultimo = ArquivoAuditoriaService.chave_mes(timezone.localtime(fim - timedelta(microseconds=1)))
+        return any(primeiro <= chave <= ultimo for chave in manifesto)
+
+    @staticmethod
+    def ler_registros(inicio, fim, usuario_id=None, acao=None, antes_de=None):
+        """
+        Gerador com os logs arquivados em [inicio, fim) (datetimes aware), na ordem cronológica.
+        `antes_de` = (data_hora, id) restringe aos registros anteriores ao cursor.
+        Só abre os arquivos dos meses que cruzam o intervalo.
+        """
+        manifesto = ArquivoAuditoriaService.ler_manifesto()
+        diretorio = ArquivoAuditoriaService.diretorio()
+
+        mes = timezone.localtime(inicio).date().replace(day=1)
+        ultimo_mes = timezone.localtime(fim - timedelta(microseconds=1)).date().replace(day=1)
+
+        while mes <= ultimo_mes:
+            for parte in manifesto.get(ArquivoAuditoriaService.chave_mes(mes), []):
+                with gzip.open(diretorio / parte['arquivo'], 'rt', encoding='utf-8') as f:
+                    for linha in f:
+                        registro = json.loads(linha)
+                        data_hora = datetime.fromisoformat(registro['data_hora'])
+                        if not (inicio <= data_hora < fim):
+                            continue
+                        if usuario_id and registro['usuario_id'] != int(usuario_id):
+                            continue
+                        if acao and registro['acao'] != acao:
+                            continue
+                        if antes_de and (data_hora, registro['id']) >= antes_de:
+                            continue
+                        registro['data_hora'] = data_hora
+                        yield registro
+            mes = (mes + timedelta(days=32)).replace(day=1)
+
+    @staticmethod
+    def buscar(inicio, fim, usuario_id=None, acao=None, limite=200, antes_de=None):
+        """
+        Retorna os `limite` logs arquivados mais recentes do intervalo como instâncias
+        (não salvas) de LogAuditoria, prontas para os mesmos templates do banco.
+        """
+        from django.contrib.auth.models import User
+
+        recentes = deque(
+            ArquivoAuditoriaService.ler_registros(inicio, fim, usuario_id, acao, antes_de),
+            maxlen=limite
+        )
+
+        usuarios = User.objects.in_bulk({r['usuario_id'] for r in recentes if r['usuario_id']})
+        logs = []
+        for registro in reversed(recentes):
+            log = LogAuditoria(
+                id=registro['id'],
+                usuario_id=registro['usuario_id'],
+                acao=registro['acao'],
+                modelo_afetado=registro['modelo_afetado'],
+                objeto_id=registro['objeto_id'],
+                detalhes=registro['detalhes'],
+                ip_address=registro['ip_address'],
+                data_hora=registro['data_hora'],
+            )
+            log.usuario = usuarios.get(registro['usuario_id'])
+            logs.append(log)
+        return logs
+
+
+class TrilhaAuditoriaService:
+    """
+    Consulta da trilha de auditoria (banco + arquivo morto).
+    Paginação por cursor (keyset) sobre (data_hora, id): cada página custa o mesmo,
+    não importa a profundidade, e usa os índices compostos de LogAuditoria.
+    """
+    POR_PAGINA = 200
+
+    @staticmethod
+    def filtrar(usuario_id=None, acao=None, inicio=None, fim=None):
+        """Queryset filtrado. Datas como intervalo semiaberto [inicio, fim)."""
+        logs = LogAuditoria.objects.all()
+        if usuario_id:
+            logs = logs.filter(usuario_id=usuario_id)
+        if acao:
+            logs = logs.filter(acao=acao)
+        if inicio:
+            logs = logs.filter(data_hora__gte=inicio)
+        if fim:
+            logs = logs.filter(data_hora__lt=fim)
+        return logs
+
+    @staticmethod
+    def intervalo_por_datas(data_ini, data_fim=None):
+        """
+        Converte datas 'YYYY-MM-DD' (inclusivas) em [inicio, fim) aware.
+        Sem data_fim, o intervalo é o próprio dia. Datas inválidas retornam (None, None).
+        """
+        try:
+            dia_ini = date.fromisoformat(data_ini)
+            dia_fim = date.fromisoformat(data_fim) if data_fim else dia_ini
+        except (TypeError, ValueError):
+            return None, None
+        inicio = timezone.make_aware(datetime.combine(dia_ini, datetime.min.time()))
+        fim = timezone.make_aware(datetime.combine(dia_fim + timedelta(days=1), datetime.min.time()))
+        return inicio, fim
+
+    @staticmethod
+    def codificar_cursor(log):
+        return f"{log.data_hora.isoformat()}_{log.id}"
+
+    @staticmethod
+    def decodificar_cursor(cursor):
+        """Retorna (data_hora, id) ou None se o cursor for inválido."""
+        try:
+            data_hora, log_id = cursor.rsplit('_', 1)
+            return datetime.fromisoformat(data_hora), int(log_id)
+        except (AttributeError, ValueError):
+            return None
+
+    @staticmethod
+    def pagina(usuario_id=None, acao=None, inicio=None, fim=None, cursor=None, limite=POR_PAGINA):
+        """
+        Retorna (logs, proximo_cursor), do mais recente para o mais antigo.
+        Se o intervalo cruzar meses arquivados, mescla o arquivo morto na mesma ordem.
+        """
+        logs = TrilhaAuditoriaService.filtrar(usuario_id, acao, inicio, fim).select_related('usuario')
+        posicao = TrilhaAuditoriaService.decodificar_cursor(cursor) if cursor else None
+        if posicao:
+            logs = logs.filter(Q(data_hora__lt=posicao[0]) | Q(data_hora=posicao[0], id__lt=posicao[1]))
+
+        # limite + 1: o excedente só indica que existe próxima página
+        resultado = list(logs.order_by('-data_hora', '-id')[:limite + 1])
+
+        if inicio and fim and ArquivoAuditoriaService.intervalo_tem_arquivo(inicio, fim):
+            arquivados = ArquivoAuditoriaService.buscar(inicio, fim, usuario_id, acao, limite=limite + 1, antes_de=posicao)
+            resultado = sorted(resultado + arquivados, key=lambda l: (l.data_hora, l.id), reverse=True)[:limite + 1]
+
+        proximo_cursor = None
+        if len(resultado) > limite:
+            resultado = resultado[:limite]
+            proximo_cursor = TrilhaAuditoriaService.codificar_cursor(resultado[-1])
+        return resultado, proximo_cursor
+
+    @staticmethod
+    def linhas_exportacao(usuario_id=None, acao=None, inicio=None, fim=None, chunk=2000):
+        """
+        Gerador de tuplas para exportação, em ordem cronológica e memória constante:
+        primeiro os meses arquivados do intervalo, depois o banco (via iterator()).
+        """
+        if inicio and fim:
+            for r in ArquivoAuditoriaService.ler_registros(inicio, fim, usuario_id, acao):
+                yield (r['id'], r['data_hora'], r.get('usuario') or '', r['acao'], r['modelo_afetado'],
+                       r['objeto_id'] or '', r['ip_address'] or '', r['detalhes'] or '')
+
+        campos = ('id', 'data_hora', 'usuario__username', 'acao', 'modelo_afetado', 'objeto_id', 'ip_address', 'detalhes')
+        for linha in TrilhaAuditoriaService.filtrar(usuario_id, acao, inicio, fim).order_by('data_hora', 'id').values_list(*campos).iterator(chunk_size=chunk):
+            yield tuple('' if valor is None else valor for valor in linha)
+
+    # --- Autocomplete de usuários (filtro do painel) ---
+    CHAVE_VERSAO_USUARIOS = 'auditoria_usuarios_versao'
+
+    @staticmethod
+    def buscar_usuarios(termo, limite=20):
+        """Usuários cujo login/nome começa com `termo`. Cache por prefixo, invalidado por versão."""
+        from django.contrib.auth.models import User
+
+        termo = (termo or '').strip().lower()[:50]
+        versao = cache.get_or_set(TrilhaAuditoriaService.CHAVE_VERSAO_USUARIOS, 1, None)
+        cache_key = f"auditoria_usuarios_v{versao}_{normalizar_texto(termo).replace(' ', '_')}"
+
+        usuarios = cache.get(cache_key)
+        if usuarios is None:
+            consulta = User.objects.all()
+            if termo:
+                consulta = consulta.filter(Q(username__istartswith=termo) | Q(first_name__istartswith=termo))
+            usuarios = [
+                {'id': u['id'], 'nome': u['first_name'] or u['username'], 'login': u['username']}
+                for u in consulta.order_by('username').values('id', 'username', 'first_name')[:limite]
+            ]
+            cache.set(cache_key, usuarios, 300)
+        return usuarios
+
+    @staticmethod
+    def invalidar_usuarios():
+        try:
+            cache.incr(TrilhaAuditoriaService.CHAVE_VERSAO_USUARIOS)
+        except ValueError:
+            cache.set(TrilhaAuditoriaService.CHAVE_VERSAO_USUARIOS, 1, None)
+
+
+# ==============================================================================
+# SERVIÇO DE CATÁLOGOS (AUTOCOMPLETE DOS SELECTS)
+# ==============================================================================
+
+class CatalogoService:
+    """
+    Busca paginada dos cadastros usados no formulário de apontamento (Select2 via AJAX).
+    O formulário renderiza apenas a opção selecionada; o restante vem daqui sob demanda.
+    Filtra por prefixo (istartswith -> LIKE 'termo%'), que aproveita os índices dos campos,
+    e guarda cada página em cache por versão do catálogo (incrementada em signals.py).
+    """
+    POR_PAGINA = 20
+    MAX_PAGINAS = 50
+    TIMEOUT_CACHE = 600
+    TIMEOUT_SNAPSHOT = 86400
+    CARGOS_AUXILIARES = ['AUXILIAR TECNICO', 'OFICIAL DE SISTEMAS']
+
+    CATALOGOS = {
+        'projetos': {'modelo': Projeto, 'filtro': {'ativo': True}, 'campos': ['codigo', 'nome'], 'ordem': ['codigo', 'id']},
+        'clientes': {'modelo': CodigoCliente, 'filtro': {'ativo': True}, 'campos': ['codigo', 'nome'], 'ordem': ['codigo', 'id']},
+        'centros-custo': {'modelo': CentroCusto, 'filtro': {'ativo': True}, 'campos': ['nome'], 'ordem': ['nome', 'id']},
+        'veiculos': {'modelo': Veiculo, 'filtro': {}, 'campos': ['placa', 'descricao'], 'ordem': ['placa', 'id']},
+        'colaboradores': {'modelo': Colaborador, 'filtro': {}, 'campos': ['nome_completo', 'id_colaborador'], 'ordem': ['nome_completo', 'id'], 'extras': ['cargo']},
+    }
+
+    @staticmethod
+    def chave_versao(catalogo):
+        return f"catalogo_versao_{catalogo}"
+
+    @staticmethod
+    def _consulta(catalogo, escopo_ids=None):
+        config = CatalogoService.CATALOGOS[catalogo]
+        consulta = config['modelo'].objects.filter(**config['filtro'])
+        if escopo_ids is not None:
+            consulta = consulta.filter(pk__in=escopo_ids)
+        return consulta.only('pk', *config['campos'], *config.get('extras', []))
+
+    @staticmethod
+    def _item(catalogo, registro):
+        item = {'id': registro.pk, 'text': str(registro)}
+        for campo in CatalogoService.CATALOGOS[catalogo].get('extras', []):
+            item[campo] = getattr(registro, campo)
+        return item
+
+    @staticmethod
+    def buscar(catalogo, termo='', pagina=1, escopo_ids=None):
+        """
+        Retorna uma página no formato do Select2: {'results': [{'id', 'text'}], 'pagination': {'more'}}.
+        `escopo_ids` restringe o catálogo (ex: colaboradores visíveis ao Administrativo); None = todos.
+        """
+        config = CatalogoService.CATALOGOS[catalogo]
+        termo = (termo or '').strip()[:50]
+        pagina = min(max(1, pagina), CatalogoService.MAX_PAGINAS)
+
+        escopo = 'todos'
+        if escopo_ids is not None:
+            escopo = hashlib.md5(','.join(map(str, sorted(escopo_ids))).encode()).hexdigest()[:12]
+
+        versao = cache.get_or_set(CatalogoService.chave_versao(catalogo), 1, None)
+        chave_termo = hashlib.md5(termo.lower().encode()).hexdigest()[:12]
+        cache_key = f"catalogo_{catalogo}_v{versao}_{escopo}_{chave_termo}_p{pagina}"
+
+        resultado = cache.get(cache_key)
+        if resultado is None:
+            consulta = CatalogoService._consulta(catalogo, escopo_ids)
+            if termo:
+                filtro = Q()
+                for campo in config['campos']:
+                    filtro |= Q(**{f"{campo}__istartswith": termo})
+                consulta = consulta.filter(filtro)
+
+            # Busca um registro a mais só para saber se existe próxima página
+            inicio = (pagina - 1) * CatalogoService.POR_PAGINA
+            registros = list(consulta.order_by(*config['ordem'])[inicio:inicio + CatalogoService.POR_PAGINA + 1])
+            resultado = {
+                'results': [CatalogoService._item(catalogo, r) for r in registros[:CatalogoService.POR_PAGINA]],
+                'pagination': {'more': len(registros) > CatalogoService.POR_PAGINA},
+            }
+            cache.set(cache_key, resultado, CatalogoService.TIMEOUT_CACHE)
+        return resultado
+
+    @staticmethod
+    def rotulos(catalogo, ids, escopo_ids=None):
+        """Texto das opções já escolhidas (ex: linhas de rateio restauradas na edição)."""
+        ids = [i for i in ids if str(i).isdigit()][:CatalogoService.POR_PAGINA]
+        if not ids:
+            return {'results': [], 'pagination': {'more': False}}
+        registros = CatalogoService._consulta(catalogo, escopo_ids).filter(pk__in=ids)
+        return {'results': [CatalogoService._item(catalogo, r) for r in registros], 'pagination': {'more': False}}
+
+    @staticmethod
+    def invalidar(catalogo):
+        try:
+            cache.incr(CatalogoService.chave_versao(catalogo))
+        except ValueError:
+            cache.set(CatalogoService.chave_versao(catalogo), 1, None)
+
+    # --------------------------------------------------------------------------
+    # SNAPSHOT COMPLETO (api/catalogo/)
+    # --------------------------------------------------------------------------
+
+    @staticmethod
+    def versao_snapshot():
+        """Hash das versões de todos os catálogos: muda sempre que um sinal invalida algum deles."""
+        chaves = [CatalogoService.chave_versao(c) for c in CatalogoService.CATALOGOS]
+        versoes = cache.get_many(chaves)
+        for chave in chaves:
+            if chave not in versoes:
+                versoes[chave] = cache.get_or_set(chave, 1, None)
+        assinatura = '|'.join(f"{chave}:{versoes[chave]}" for chave in chaves)
+        return hashlib.md5(assinatura.encode()).hexdigest()[:16]
+
+    @staticmethod
+    def snapshot():
+        """
+        Todos os cadastros ativos do formulário em listas compactas ([id, campos...]),
+        para o navegador resolver nomes e regras localmente.
+        """
+        versao = CatalogoService.versao_snapshot()
+        cache_key = f"catalogo_snapshot_{versao}"
+        dados = cache.get(cache_key)
+        if dados is None:
+            dados = {
+                'versao': versao,
+                'projetos': list(Projeto.objects.filter(ativo=True).order_by('codigo').values_list('id', 'codigo', 'nome')),
+                'clientes': list(CodigoCliente.objects.filter(ativo=True).order_by('codigo').values_list('id', 'codigo', 'nome')),
+                'centros_custo': list(CentroCusto.objects.filter(ativo=True).order_by('nome').values_list('id', 'nome', 'permite_alocacao')),
+                'veiculos': list(Veiculo.objects.order_by('placa').values_list('id', 'placa', 'descricao')),
+                'auxiliares': list(
+                    Colaborador.objects.filter(cargo__in=CatalogoService.CARGOS_AUXILIARES)
+                    .order_by('nome_completo').values_list('id', 'nome_completo', 'cargo')
+                ),
+            }
+            cache.set(cache_key, dados, CatalogoService.TIMEOUT_SNAPSHOT)
+        return dados
+
+
+class TimersAtivosService:
+    """
+    Registro dos timers abertos da empresa inteira em uma única entrada de cache:
+    {colaborador_id: dados do timer}. O status do cronômetro e o "quem está em campo agora"
+    viram leitura de cache; a reconstrução é uma consulta pelo índice de timer aberto.
+    Início, parada, edição e exclusão (signals.py) incrementam a versão do registro.
+    """
+    CHAVE_VERSAO = 'timers_ativos_versao'
+    TIMEOUT_CACHE = 3600
+
+    @staticmethod
+    def _dados(apontamento):
+        """Mesmo formato da resposta de api_status_cronometro (sem a chave 'ativo')."""
+        veiculo_id = None
+        if apontamento.veiculo_id:
+            veiculo_id = apontamento.veiculo_id
+        elif apontamento.veiculo_manual_modelo or apontamento.veiculo_manual_placa:
+            veiculo_id = 'OUTRO'
+
+        inicio = apontamento.inicio_em
+        return {
+            'id': apontamento.pk,
+            'inicio_timestamp': inicio.timestamp(),
+            'inicio_str': apontamento.hora_inicio.strftime('%H:%M'),
+            'data_registro': apontamento.data_apontamento.strftime('%d/%m/%Y'),
+            'colaborador_id': apontamento.colaborador_id,
+            'colaborador_nome': str(apontamento.colaborador),
+            'veiculo_id': veiculo_id,
+            'veiculo_nome': str(apontamento.veiculo) if apontamento.veiculo else 'Veículo Manual',
+            'projeto_nome': str(apontamento.projeto) if apontamento.projeto else None,
+            'projeto_id': apontamento.projeto_id,
+            'cliente_nome': str(apontamento.codigo_cliente) if apontamento.codigo_cliente else None,
+            'cliente_id': apontamento.codigo_cliente_id,
+            'cc_nome': str(apontamento.centro_custo) if apontamento.centro_custo else None,
+            'cc_id': apontamento.centro_custo_id,
+            'local': apontamento.local_execucao,
+        }
+
+    @staticmethod
+    def todos():
+        """{colaborador_id: dados} de todos os timers abertos."""
+        versao = cache.get_or_set(TimersAtivosService.CHAVE_VERSAO, 1, None)
+        chave = f"timers_ativos_v{versao}"
+        registro = cache.get(chave)
+        if registro is None:
+            abertos = (
+                Apontamento.objects.filter(hora_termino__isnull=True)
+                .select_related('colaborador', 'projeto', 'codigo_cliente', 'centro_custo', 'veiculo')
+            )
+            registro = {apt.colaborador_id: TimersAtivosService._dados(apt) for apt in abertos}
+            cache.set(chave, registro, TimersAtivosService.TIMEOUT_CACHE)
+        return registro
+
+    @staticmethod
+    def do_colaborador(colaborador_id):
+        """Timer aberto do colaborador (dict) ou None."""
+        return TimersAtivosService.todos().get(colaborador_id)
+
+    @staticmethod
+    def painel(registro, escopo_ids=None):
+        """Agregado para o painel ao vivo: total em campo e pessoas por obra, da maior para a menor."""
+        por_projeto = {}
+        ativos = 0
+        for colaborador_id, timer in registro.items():
+            if escopo_ids is not None and colaborador_id not in escopo_ids:
+                continue
+            ativos += 1
+            linha = por_projeto.setdefault(timer['projeto_id'], {
+                'projeto_id': timer['projeto_id'],
+                'projeto_nome': timer['projeto_nome'] or timer['cc_nome'] or timer['cliente_nome'] or 'Sem obra',
+                'pessoas': 0,
+            })
+            linha['pessoas'] += 1
+        return {
+            'ativos': ativos,
+            'por_projeto': sorted(por_projeto.values(), key=lambda l: (-l['pessoas'], l['projeto_nome'])),
+        }
+
+    @staticmethod
+    def _incrementar():
+        try:
+            cache.incr(TimersAtivosService.CHAVE_VERSAO)
+        except ValueError:
+            cache.set(TimersAtivosService.CHAVE_VERSAO, 1, None)
+
+    @staticmethod
+    def invalidar():
+        """
+        Incrementa já (leituras na mesma transação) e de novo após o commit: um registro
+        reconstruído por outra requisição antes do commit fica numa versão descartada.
+        """
+        TimersAtivosService._incrementar()
+        transaction.on_commit(TimersAtivosService._incrementar)
+
+
+class EncerramentoTimersService:
+    """
+    Encerra timers abertos em lote (fim do dia de uma equipe ou de uma obra):
+    um UPDATE para o término, um recálculo CLT por (colaborador, dia contábil)
+    após o commit e um único registro de auditoria para a operação inteira.
+    Timers abertos há LIMITE_ABERTO ou mais são tratados como esquecidos (mesma regra de
+    auditar_consistencia --corrigir): duração zero e alerta, em vez de um término no dia errado.
+    """
+    LOTE = 2000
+    LIMITE_ABERTO = timedelta(hours=24)
+    MOTIVO_ESQUECIDO = "Timer esquecido aberto: encerrado com duração zero no encerramento em lote."
+
+    # Teto do filtro --horas (10 anos): valores acima estouram o datetime ao calcular o limite
+    HORAS_MAXIMO = 24 * 365 * 10
+
+    @staticmethod
+    def validar_horas(valor):
+        """Filtro de horas em aberto: número finito, positivo e dentro do teto. Levanta ValueError."""
+        horas = float(valor)
+        if not math.isfinite(horas) or horas <= 0 or horas > EncerramentoTimersService.HORAS_MAXIMO:
+            raise ValueError(f"Horas inválidas: {valor}")
+        return horas
+
+    @staticmethod
+    def selecionar(setor_id=None, projeto_id=None, horas=None, agora=None):
+        """Timers abertos que atendem a todos os filtros informados (values com id, colaborador, data, início e dia contábil)."""
+        consulta = Apontamento.objects.filter(hora_termino__isnull=True)
+        if setor_id:
+            consulta = consulta.filter(colaborador__setor_id=setor_id)
+        if projeto_id:
+            consulta = consulta.filter(projeto_id=projeto_id)
+
+        if horas:
+            consulta = consulta.filter(inicio_em__lte=(agora or timezone.now()) - timedelta(hours=horas))
+        return list(consulta.order_by('id').values('id', 'colaborador_id', 'data_apontamento', 'hora_inicio', 'inicio_em', 'data_contabil'))
+
+    @staticmethod
+    def encerrar(abertos, request=None, origem='', agora=None):
+        """
+        Grava o término (hora atual) nos timers de `abertos` ainda abertos. Retorna (encerrados, recálculos CLT).
+        Os esquecidos (abertos há LIMITE_ABERTO ou mais) são encerrados com duração zero e sinalizados.
+        Deve rodar dentro de transaction.atomic(): recálculo e auditoria só acontecem no commit.
+        """
+        if not abertos:
+            return 0, 0
+
+        agora = timezone.localtime(agora or timezone.now())
+        ids = [a['id'] for a in abertos]
+        esquecidos = [a for a in abertos if agora - a['inicio_em'] >= EncerramentoTimersService.LIMITE_ABERTO]
+        ids_esquecidos = {a['id'] for a in esquecidos}
+        recentes = [a for a in abertos if a['id'] not in ids_esquecidos]
+
+        # fim_em depende da data de cada timer (virada de meia-noite): um UPDATE por instante de término
+        por_fim = defaultdict(list)
+        for a in recentes:
+            _, fim_em, _ = Apontamento.calcular_instantes(a['data_apontamento'], a['hora_inicio'], agora.time())
+            por_fim[fim_em].append(a['id'])
+
+        encerrados = 0
+        lista_esquecidos = sorted(ids_esquecidos)
+        for i in range(0, len(lista_esquecidos), EncerramentoTimersService.LOTE):
+            lote = lista_esquecidos[i:i + EncerramentoTimersService.LOTE]
+            with ContadoresSetorService.acompanhar(Apontamento.objects.filter(pk__in=lote)):
+                encerrados += Apontamento.objects.filter(pk__in=lote, hora_termino__isnull=True).update(
+                    hora_termino=models.F('hora_inicio'),
+                    fim_em=models.F('inicio_em'),
+                    versao=models.F('versao') + 1,
+                    flag_atencao=True,
+                    motivo_alerta=EncerramentoTimersService.MOTIVO_ESQUECIDO,
+                )
+        for fim_em, grupo in por_fim.items():
+            for i in range(0, len(grupo), EncerramentoTimersService.LOTE):
+                encerrados += Apontamento.objects.filter(
+                    pk__in=grupo[i:i + EncerramentoTimersService.LOTE], hora_termino__isnull=True
+                ).update(hora_termino=agora.time(), fim_em=fim_em, versao=models.F('versao') + 1)
+
+        # update() não dispara sinais
+        TimersAtivosService.invalidar()
+
+        # Um recálculo por (colaborador, dia contábil), em vez de um por timer. Os esquecidos (duração zero)
+        # ficam de fora: o recálculo apagaria o alerta que os marca para revisão do gestor
+        recalculos = sorted({(a['colaborador_id'], a['data_contabil']) for a in recentes})
+        transaction.on_commit(lambda: EncerramentoTimersService._recalcular_clt(recalculos))
+
+        registrar_log(
+            request, 'EDICAO', 'Apontamento', None,
+            f"Encerramento em lote de {encerrados} timer(s) às {agora:%H:%M}{f' ({origem})' if origem else ''}"
+            f"{f', {len(esquecidos)} esquecido(s) com duração zero' if esquecidos else ''}. "
+            f"IDs: {', '.join(map(str, ids))}"
+        )
+        return encerrados, len(recalculos)
+
+    @staticmethod
+    def _recalcular_clt(recalculos):
+        for colaborador_id, dia in recalculos:
+            try:
+                calcular_regras_clt(colaborador_id, dia)
+            except Exception as e:
+                logger.error(f"Erro ao recalcular regras CLT (colaborador {colaborador_id}, {dia}): {e}")
+
+
+class FilaAprovacaoService:
+    """
+    Fila de aprovação dos gestores: paginação por cursor (keyset) sobre (data, id),
+    contagem de pendências lida dos contadores por setor (ContadoresSetorService)
+    e aprovação/rejeição em lote com um UPDATE condicionado a EM_ANALISE, para que
+    dois gestores revisando ao mesmo tempo não sobrescrevam a decisão um do outro.
+    """
+    POR_PAGINA = 50
+    # IDs por UPDATE: abaixo do limite de 2100 parâmetros do SQL Server
+    LOTE = 2000
+    ACOES = {
+        'APROVAR': ('APROVADO', 'APROVACAO'),
+        'REJEITAR': ('REJEITADO', 'REJEICAO'),
+    }
+
+    @staticmethod
+    def escopo(identidade):
+        """Pendências visíveis: Owner vê todas; gestor, as dos seus setores (menos as próprias)."""
+        pendentes = Apontamento.objects.filter(status_aprovacao='EM_ANALISE')
+        if identidade.is_owner:
+            return pendentes
+        return pendentes.filter(colaborador__setor_id__in=identidade.setores_gerenciados_ids).exclude(
+            colaborador_id=identidade.colaborador_id
+        )
+
+    @staticmethod
+    def filtrar(consulta, colaborador_id=None, data_ini=None, data_fim=None):
+        """Filtros opcionais da fila (datas 'YYYY-MM-DD' inclusivas; valores inválidos são ignorados)."""
+        if colaborador_id and str(colaborador_id).isdigit():
+            consulta = consulta.filter(colaborador_id=int(colaborador_id))
+        for valor, lookup in ((data_ini, 'data_apontamento__gte'), (data_fim, 'data_apontamento__lte')):
+            try:
+                consulta = consulta.filter(**{lookup: date.fromisoformat(valor)}) if valor else consulta
+            except ValueError:
+                pass
+        return consulta
+
+    @staticmethod
+    def codificar_cursor(apontamento):
+        return f"{apontamento.data_apontamento.isoformat()}_{apontamento.id}"
+
+    @staticmethod
+    def decodificar_cursor(cursor):
+        """Retorna (data, id) ou None se o cursor for inválido."""
+        try:
+            data_ref, apontamento_id = cursor.rsplit('_', 1)
+            return date.fromisoformat(data_ref), int(apontamento_id)
+        except (AttributeError, ValueError):
+            return None
+
+    @staticmethod
+    def pagina(consulta, cursor=None, limite=POR_PAGINA):
+        """Retorna (itens, proximo_cursor), da data mais recente para a mais antiga."""
+        posicao = FilaAprovacaoService.decodificar_cursor(cursor) if cursor else None
+        if posicao:
+            consulta = consulta.filter(
+                Q(data_apontamento__lt=posicao[0]) | Q(data_apontamento=posicao[0], id__lt=posicao[1])
+            )
+
+        # limite + 1: o excedente só indica que existe próxima página
+        itens = list(consulta.order_by('-data_apontamento', '-id')[:limite + 1])
+        proximo_cursor = None
+        if len(itens) > limite:
+            itens = itens[:limite]
+            proximo_cursor = FilaAprovacaoService.codificar_cursor(itens[-1])
+        return itens, proximo_cursor
+
+    @staticmethod
+    def contagem_pendentes(identidade):
+        """Tamanho da fila: contadores dos setores, menos as pendências do próprio gestor (fora do escopo)."""
+        total = ContadoresSetorService.resumo(identidade)['pendentes']
+        if not identidade.is_owner and identidade.colaborador_id is not None \
+                and identidade.colaborador.setor_id in identidade.setores_gerenciados_ids:
+            total -= Apontamento.objects.filter(colaborador_id=identidade.colaborador_id, status_aprovacao='EM_ANALISE').count()
+        return total
+
+    @staticmethod
+    def processar_lote(consulta, acao, motivo, request=None):
+        """
+        Aprova ou rejeita as pendências de `consulta` (seleção ou filtro já restritos ao escopo).
+        Retorna a quantidade processada. Deve rodar dentro de transaction.atomic().
+        """
+        novo_status, acao_log = FilaAprovacaoService.ACOES[acao]
+        candidatos = list(consulta.values_list('id', flat=True))
+
+        processados = []
+        for i in range(0, len(candidatos), FilaAprovacaoService.LOTE):
+            lote = candidatos[i:i + FilaAprovacaoService.LOTE]
+            # Trava só as linhas ainda pendentes: as já decididas por outro gestor ficam de fora
+            ids = list(
+                Apontamento.objects.select_for_update()
+                .filter(pk__in=lote, status_aprovacao='EM_ANALISE').values_list('id', flat=True)
+            )
+            if ids:
+                with ContadoresSetorService.acompanhar(Apontamento.objects.filter(pk__in=ids)):
+                    Apontamento.objects.filter(pk__in=ids, status_aprovacao='EM_ANALISE').update(
+                        status_aprovacao=novo_status, motivo_rejeicao=motivo, versao=models.F('versao') + 1
+                    )
+                processados += ids
+
+        if processados:
+            detalhes = "Apontamento aprovado pelo Gestor (lote)." if acao == 'APROVAR' else f"Rejeitado (lote). Motivo: {motivo}"
+            for apontamento_id in processados:
+                registrar_log(request, acao_log, 'Apontamento', apontamento_id, detalhes)
+        return len(processados)
+
+
+# ==============================================================================
+# SERVIÇO DE CONCORRÊNCIA OTIMISTA (VERSÃO DO APONTAMENTO)
+# ==============================================================================
+
+class ConflitoVersao(Exception):
+    """O apontamento foi alterado por outra pessoa/processo depois de lido."""
+    MENSAGEM = "Este registro foi alterado por outra pessoa enquanto você o analisava. Recarregue e tente novamente."
+
+
+class VersaoApontamentoService:
+    """
+    Gravação compare-and-swap: UPDATE só dos campos alterados, condicionado à versão lida
+    (WHERE id = X AND versao = N) e incrementando a versão. Nenhuma transição sobrescreve
+    em silêncio a gravação de outra; quem perde a corrida recebe ConflitoVersao.
+    Mudanças de status/alerta também atualizam os contadores por setor.
+    Os recálculos de CLT (flag_atencao/motivo_alerta) são derivados e não mudam a versão.
+    """
+    TENTATIVAS = 3
+
+    @staticmethod
+    def versao_enviada(valor, apontamento):
+        """Versão vinda do formulário (campo oculto); sem ela, vale a versão recém-lida."""
+        return int(valor) if str(valor or '').isdigit() else apontamento.versao
+
+    @staticmethod
+    def gravar(apontamento, campos, versao=None):
+        """
+        Grava `campos` (nomes dos fields) com os valores atuais da instância.
+        Levanta ConflitoVersao se a linha não estiver mais na versão esperada.
+        """
+        versao = apontamento.versao if versao is None else versao
+        if set(campos) & set(Apontamento.CAMPOS_HORARIO):
+            apontamento.sincronizar_instantes()
+            campos = [*campos, *Apontamento.CAMPOS_INSTANTES]
+        meta = apontamento._meta
+        valores = {meta.get_field(nome).attname: getattr(apontamento, meta.get_field(nome).attname) for nome in campos}
+
+        linha = Apontamento.objects.filter(pk=apontamento.pk, versao=versao)
+        if set(campos) & set(ContadoresSetorService.ORIGEM):
+            with transaction.atomic():
+                # Trava a linha na versão esperada: o delta sai do estado que o CAS garante,
+                # e quem perde a corrida não toca nos contadores
+                origem = ContadoresSetorService.ORIGEM
+                atual = linha.select_for_update().values('colaborador_id', *origem).first()
+                if atual is None:
+                    raise ConflitoVersao(ConflitoVersao.MENSAGEM)
+                alterados = linha.update(versao=models.F('versao') + 1, **valores)
+                if alterados:
+                    novo = {campo: valores.get(campo, atual[campo]) for campo in origem}
+                    setor_id = Colaborador.objects.filter(pk=atual['colaborador_id']).values_list('setor_id', flat=True).first()
+                    deltas = ContadoresSetorService.somar({}, setor_id, ContadoresSetorService.estado_de(atual), -1)
+                    ContadoresSetorService.aplicar(ContadoresSetorService.somar(deltas, setor_id, ContadoresSetorService.estado_de(novo)))
+        else:
+            alterados = linha.update(versao=models.F('versao') + 1, **valores)
+        if not alterados:
+            raise ConflitoVersao(ConflitoVersao.MENSAGEM)
+        apontamento.versao = versao + 1
+
+        # update() não dispara sinais
+        if 'hora_termino' in campos:
+            TimersAtivosService.invalidar()
+        return apontamento
+
+    @staticmethod
+    def transicionar(pk, alterar):
+        """
+        Lê, aplica `alterar(apontamento)` -> lista de campos (ou None para desistir) e grava via CAS.
+        Em conflito relê e tenta de novo, para transições que não dependem do que o usuário viu.
+        """
+        for _ in range(VersaoApontamentoService.TENTATIVAS):
+            apontamento = Apontamento.objects.get(pk=pk)
+            campos = alterar(apontamento)
+            if not campos:
+                return None
+            try:
+                return VersaoApontamentoService.gravar(apontamento, campos)
+            except ConflitoVersao:
+                continue
+        raise ConflitoVersao(ConflitoVersao.MENSAGEM)
+
+
+# ==============================================================================
+# SERVIÇO DE CONTADORES POR SETOR (PENDÊNCIAS DESNORMALIZADAS)
+# ==============================================================================
+
+class ContadoresSetorService:
+    """
+    Mantém a tabela ContadorSetor: cada transição vira um UPDATE contador = contador + delta
+    por setor, na mesma transação da gravação do apontamento. Sinais cobrem save/delete;
+    UPDATEs e bulk_create (que não disparam sinais) usam `acompanhar` ou `aplicar` direto.
+    Deltas: {setor_id: [pendentes, ajustes_pendentes, alertas_clt]}.
+    """
+    CAMPOS = ('pendentes', 'ajustes_pendentes', 'alertas_clt')
+    # Campos do apontamento que alteram algum contador
+    ORIGEM = ('status_aprovacao', 'status_ajuste', 'flag_atencao')
+
+    @staticmethod
+    def estado(apontamento):
+        """(pendente, ajuste pendente, alerta CLT) de uma instância, como 0/1."""
+        return (
+            int(apontamento.status_aprovacao == 'EM_ANALISE'),
+            int(apontamento.status_ajuste == 'PENDENTE'),
+            int(bool(apontamento.flag_atencao)),
+        )
+
+    @staticmethod
+    def estado_de(valores):
+        """Mesmo que `estado`, a partir de um dict com os campos de ORIGEM (values())."""
+        return (
+            int(valores['status_aprovacao'] == 'EM_ANALISE'),
+            int(valores['status_ajuste'] == 'PENDENTE'),
+            int(bool(valores['flag_atencao'])),
+        )
+
+    @staticmethod
+    def somar(deltas, setor_id, estado, sinal=1):
+        atual = deltas.setdefault(setor_id, [0, 0, 0])
+        for i, valor in enumerate(estado):
+            atual[i] += sinal * valor
+        return deltas
+
+    @staticmethod
+    def por_setor(consulta):
+        """Totais de um conjunto de apontamentos agrupados por setor (uma agregação)."""
+        linhas = consulta.order_by().values('colaborador__setor_id').annotate(
+            pendentes=models.Count('id', filter=Q(status_aprovacao='EM_ANALISE')),
+            ajustes=models.Count('id', filter=Q(status_ajuste='PENDENTE')),
+            alertas=models.Count('id', filter=Q(flag_atencao=True)),
+        )
+        return {l['colaborador__setor_id']: [l['pendentes'], l['ajustes'], l['alertas']] for l in linhas}
+
+    @staticmethod
+    def aplicar(deltas):
+        """Incremento atômico no banco; a linha do setor é criada na primeira pendência."""
+        for setor_id, valores in deltas.items():
+            incrementos = {
+                campo: models.F(campo) + valor
+                for campo, valor in zip(ContadoresSetorService.CAMPOS, valores) if valor
+            }
+            if not incrementos:
+                continue
+            if not ContadorSetor.objects.filter(setor_id=setor_id).update(**incrementos):
+                ContadorSetor.objects.get_or_create(setor_id=setor_id)
+                ContadorSetor.objects.filter(setor_id=setor_id).update(**incrementos)
+
+    @staticmethod
+    @contextmanager
+    def acompanhar(consulta):
+        """
+        Para UPDATEs em lote: totais antes e depois do bloco, aplica a diferença.
+        `consulta` deve selecionar por id (não pelo status que o bloco vai alterar).
+        """
+        antes = ContadoresSetorService.por_setor(consulta)
+        yield
+        depois = ContadoresSetorService.por_setor(consulta)
+        deltas = {}
+        for setor_id in antes.keys() | depois.keys():
+            a, d = antes.get(setor_id, (0, 0, 0)), depois.get(setor_id, (0, 0, 0))
+            deltas[setor_id] = [y - x for x, y in zip(a, d)]
+        ContadoresSetorService.aplicar(deltas)
+
+    @staticmethod
+    def mover_colaborador(colaborador_id, setor_antigo, setor_novo):
+        """Colaborador trocou de setor: as pendências dele mudam de linha."""
+        totais = ContadoresSetorService.por_setor(Apontamento.objects.filter(colaborador_id=colaborador_id))
+        for valores in totais.values():
+            deltas = ContadoresSetorService.somar({}, setor_antigo, valores, -1)
+            ContadoresSetorService.aplicar(ContadoresSetorService.somar(deltas, setor_novo, valores))
+
+    @staticmethod
+    def resumo(identidade):
+        """Soma dos setores visíveis: Owner vê todos, gestor os que gerencia. Uma consulta na tabela pequena."""
+        linhas = ContadorSetor.objects.all()
+        if not identidade.is_owner:
+            linhas = linhas.filter(setor_id__in=identidade.setores_gerenciados_ids)
+        totais = linhas.aggregate(**{campo: models.Sum(campo) for campo in ContadoresSetorService.CAMPOS})
+        return {campo: totais[campo] or 0 for campo in ContadoresSetorService.CAMPOS}
+
+    @staticmethod
+    def reconciliar(corrigir=True):
+        """
+        Recalcula os contadores a partir dos apontamentos. Retorna {setor_id: (gravado, real)}
+        apenas dos setores divergentes; com `corrigir`, sobrescreve-os. Deve rodar em transaction.atomic().
+        """
+        reais = ContadoresSetorService.por_setor(Apontamento.objects.all())
+        gravados = {
+            c.setor_id: [getattr(c, campo) for campo in ContadoresSetorService.CAMPOS]
+            for c in ContadorSetor.objects.select_for_update()
+        }
+        divergentes = {}
+        for setor_id in reais.keys() | gravados.keys():
+            real = reais.get(setor_id, [0, 0, 0])
+            if gravados.get(setor_id, [0, 0, 0]) != real:
+                divergentes[setor_id] = (gravados.get(setor_id), real)
+
+        if corrigir:
+            for setor_id, (_, real) in divergentes.items():
+                ContadorSetor.objects.update_or_create(
+                    setor_id=setor_id, defaults=dict(zip(ContadoresSetorService.CAMPOS, real))
+                )
+        return divergentes
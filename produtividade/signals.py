@@ -1,10 +1,13 @@
 import logging
 from django.contrib.auth.signals import user_logged_in, user_logged_out, user_login_failed
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_init, pre_save, post_save, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.core.cache import cache
-from .models import LogAuditoria, Colaborador, Projeto, CentroCusto, Feriado
-from .utils import get_client_ip
+from django.contrib.auth.models import User, Group
+from .models import Colaborador, Projeto, CentroCusto, CodigoCliente, Veiculo, Feriado, Notificacao, Setor, Apontamento, ContadorSetor
+from .identidade import invalidar_identidades
+from .utils import get_client_ip, enfileirar_log
+from .services import FeriadoService, TrilhaAuditoriaService, NotificacaoService, CatalogoService, TimersAtivosService, ContadoresSetorService
 
 # Logger para erros internos do sistema de auditoria
 logger = logging.getLogger('auditoria')
@@ -12,6 +15,7 @@ logger = logging.getLogger('auditoria')
 # ==============================================================================
 # SINAIS DE AUDITORIA (LOGIN / LOGOUT)
 # ==============================================================================
+# Os logs entram no buffer da requisição e são gravados pelo AuditoriaMiddleware.
 
 @receiver(user_logged_in)
 def log_login(sender, request, user, **kwargs):
@@ -20,7 +24,7 @@ def log_login(sender, request, user, **kwargs):
         ip = get_client_ip(request)
         user_agent = request.META.get('HTTP_USER_AGENT', 'Desconhecido')
         
-        LogAuditoria.objects.create(
+        enfileirar_log(
             usuario=user, 
             acao='LOGIN', 
             modelo_afetado='Sistema', 
@@ -35,7 +39,7 @@ def log_logout(sender, request, user, **kwargs):
     """Registra logouts."""
     try:
         if user:
-            LogAuditoria.objects.create(
+            enfileirar_log(
                 usuario=user, 
                 acao='LOGOUT', 
                 modelo_afetado='Sistema', 
@@ -55,7 +59,7 @@ def log_login_failed(sender, credentials, request, **kwargs):
 
         username_tentado = credentials.get('username', 'Desconhecido')
         
-        LogAuditoria.objects.create(
+        enfileirar_log(
             usuario=None,
             acao='LOGIN_FALHA',
             modelo_afetado='Sistema',
@@ -78,27 +82,156 @@ def limpar_cache_colaboradores(sender, instance, **kwargs):
     limpamos o cache da lista de auxiliares.
     """
     cache.delete('api_lista_auxiliares')
+    cache.delete(f'colaborador_info_{instance.pk}')
+    invalidar_identidades()
+    CatalogoService.invalidar('colaboradores')
+    TimersAtivosService.invalidar()
+
+@receiver([post_save, post_delete], sender=Setor)
+@receiver([post_save, post_delete], sender=Group)
+def limpar_cache_identidade_estrutura(sender, instance, **kwargs):
+    """Setor ou grupo alterado: permissões em cache (request.identidade) deixam de valer."""
+    invalidar_identidades()
+
+@receiver(m2m_changed, sender=Colaborador.setores_gerenciados.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def limpar_cache_identidade_vinculos(sender, action, **kwargs):
+    """Mudança nos setores gerenciados de um colaborador ou nos grupos de um usuário."""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidar_identidades()
 
 @receiver([post_save, post_delete], sender=Projeto)
 def limpar_cache_projetos(sender, instance, **kwargs):
-    """Limpa o cache do nome do projeto específico."""
+    """Limpa o cache do nome do projeto específico e as buscas de obras."""
     cache.delete(f'projeto_info_{instance.pk}')
+    CatalogoService.invalidar('projetos')
+    TimersAtivosService.invalidar()
 
 @receiver([post_save, post_delete], sender=CentroCusto)
 def limpar_cache_centro_custo(sender, instance, **kwargs):
-    """Limpa o cache das regras do centro de custo específico."""
+    """Limpa o cache das regras do centro de custo específico e as buscas de centros de custo."""
     cache.delete(f'cc_info_{instance.pk}')
+    CatalogoService.invalidar('centros-custo')
+    TimersAtivosService.invalidar()
+
+@receiver([post_save, post_delete], sender=CodigoCliente)
+def limpar_cache_clientes(sender, instance, **kwargs):
+    """Novo cliente, renomeado ou desativado: descarta as buscas de clientes."""
+    CatalogoService.invalidar('clientes')
+    TimersAtivosService.invalidar()
+
+@receiver([post_save, post_delete], sender=Veiculo)
+def limpar_cache_veiculos(sender, instance, **kwargs):
+    """Alteração na frota: descarta as buscas de veículos."""
+    CatalogoService.invalidar('veiculos')
+    TimersAtivosService.invalidar()
+
+_NAO_CARREGADO = object()
+
+@receiver(post_init, sender=Apontamento)
+def guardar_hora_termino_original(sender, instance, **kwargs):
+    """Término como veio do banco/construtor (sem disparar consulta se o campo estiver adiado)."""
+    instance._hora_termino_original = instance.__dict__.get('hora_termino', _NAO_CARREGADO)
+
+@receiver(post_save, sender=Apontamento)
+def atualizar_timers_ativos_save(sender, instance, created, **kwargs):
+    """
+    Timer iniciado, parado ou editado: nova versão do registro de timers abertos.
+    Só quando o apontamento é/era um timer aberto ou o término mudou: aprovações e edições
+    de registros encerrados (e lançamentos manuais) não forçam a reconstrução do registro.
+    """
+    termino = instance.__dict__.get('hora_termino', _NAO_CARREGADO)
+    antes = getattr(instance, '_hora_termino_original', _NAO_CARREGADO)
+    if _NAO_CARREGADO in (termino, antes) or termino is None or antes is None or termino != antes:
+        TimersAtivosService.invalidar()
+    instance._hora_termino_original = termino
+
+@receiver(post_delete, sender=Apontamento)
+def atualizar_timers_ativos_delete(sender, instance, **kwargs):
+    """Timer aberto excluído: sai do registro."""
+    if instance.hora_termino is None:
+        TimersAtivosService.invalidar()
+
+# ==============================================================================
+# CONTADORES POR SETOR (PENDÊNCIAS, AJUSTES E ALERTAS CLT)
+# ==============================================================================
+# UPDATEs e bulk_create não passam por aqui: quem os executa aplica o delta (ContadoresSetorService).
+
+@receiver(pre_save, sender=Apontamento)
+def capturar_estado_contadores(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Estado gravado antes da alteração, para calcular o delta no post_save."""
+    instance._contadores_antes = {}
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and not {'colaborador', *ContadoresSetorService.ORIGEM} & set(update_fields):
+        return
+    instance._contadores_antes = ContadoresSetorService.por_setor(Apontamento.objects.filter(pk=instance.pk))
+
+@receiver(post_save, sender=Apontamento)
+def atualizar_contadores_save(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if not created and update_fields is not None and not {'colaborador', *ContadoresSetorService.ORIGEM} & set(update_fields):
+        return
+    deltas = {}
+    for setor_id, valores in getattr(instance, '_contadores_antes', {}).items():
+        ContadoresSetorService.somar(deltas, setor_id, valores, -1)
+    ContadoresSetorService.somar(deltas, instance.colaborador.setor_id, ContadoresSetorService.estado(instance))
+    ContadoresSetorService.aplicar(deltas)
+
+@receiver(pre_delete, sender=Apontamento)
+def atualizar_contadores_delete(sender, instance, **kwargs):
+    """Antes do DELETE: na exclusão em cascata do colaborador, ele ainda existe para informar o setor."""
+    setor_id = Colaborador.objects.filter(pk=instance.colaborador_id).values_list('setor_id', flat=True).first()
+    ContadoresSetorService.aplicar(ContadoresSetorService.somar({}, setor_id, ContadoresSetorService.estado(instance), -1))
+
+@receiver(pre_save, sender=Colaborador)
+def capturar_setor_anterior(sender, instance, raw=False, **kwargs):
+    instance._setor_anterior = None
+    if not raw and not instance._state.adding:
+        instance._setor_anterior = Colaborador.objects.filter(pk=instance.pk).values_list('setor_id', flat=True).first()
+
+@receiver(post_save, sender=Colaborador)
+def mover_contadores_colaborador(sender, instance, created, raw=False, **kwargs):
+    """Colaborador trocou de setor: as pendências dele acompanham."""
+    if not created and not raw and instance._setor_anterior != instance.setor_id:
+        ContadoresSetorService.mover_colaborador(instance.pk, instance._setor_anterior, instance.setor_id)
+
+@receiver(post_save, sender=Setor)
+def criar_contador_setor(sender, instance, created, raw=False, **kwargs):
+    """Linha do contador criada junto com o setor: os incrementos viram só UPDATE."""
+    if created and not raw:
+        ContadorSetor.objects.get_or_create(setor=instance)
+
+@receiver(pre_delete, sender=Setor)
+def mover_contadores_setor_excluido(sender, instance, **kwargs):
+    """Setor excluído: os colaboradores ficam sem setor (SET_NULL), e as pendências também."""
+    contador = ContadorSetor.objects.filter(setor=instance).first()
+    if contador:
+        valores = [getattr(contador, campo) for campo in ContadoresSetorService.CAMPOS]
+        ContadoresSetorService.aplicar({None: valores})
 
 @receiver([post_save, post_delete], sender=Feriado)
 def limpar_cache_feriados(sender, instance, **kwargs):
     """
     Se um feriado for cadastrado, alterado ou excluído, limpamos o cache 
-    exato daquela data e cidade para não impactar o cálculo da jornada.
+    do ano daquela cidade para não impactar o cálculo da jornada.
     """
     if instance.data and instance.cidade and instance.uf:
-        data_str = instance.data.strftime('%Y-%m-%d')
-        cidade_str = instance.cidade.strip().upper()
-        uf_str = instance.uf.strip().upper()
-        
-        cache_key = f"feriado_{data_str}_{cidade_str}_{uf_str}"
-        cache.delete(cache_key)
\ No newline at end of file
+        cache.delete(FeriadoService.chave_cache_municipal(instance.data.year, instance.cidade, instance.uf))
+
+@receiver([post_save, post_delete], sender=Notificacao)
+def limpar_cache_notificacoes(sender, instance, **kwargs):
+    """Nova notificação, resposta ou exclusão: atualiza o sino do colaborador e o do Owner."""
+    NotificacaoService.invalidar_cache([instance.colaborador_id])
+
+@receiver([post_save, post_delete], sender=User)
+def limpar_cache_busca_usuarios(sender, instance, **kwargs):
+    """
+    Invalida o autocomplete de usuários da auditoria.
+    Ignora o save de last_login disparado a cada login.
+    """
+    update_fields = kwargs.get('update_fields')
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    TrilhaAuditoriaService.invalidar_usuarios()
@@ -0,0 +1,73 @@
+from datetime import timedelta, time
+from django.utils import timezone
+import logging
+
+logger = logging.getLogger('services')
+
+# ==============================================================================
+# AGENDA DECLARATIVA DE ROTINAS (Executada pelo comando `agendador`)
+# ==============================================================================
+# Cada rotina define:
+#   - 'nome': identificador único (chave em TarefaAgendada)
+#   - 'comando' (management command) OU 'funcao' (callable sem argumentos)
+#   - 'intervalo' (timedelta) para rotinas recorrentes, OU
+#   - 'horario' (time) para rotinas diárias, opcionalmente restritas a 'dias_semana' (0=Seg ... 6=Dom)
+
+def notificar_pendencias_dia_anterior():
+    """Dispara as notificações de pendência referentes ao dia útil anterior."""
+    from .services import NotificacaoService
+
+    data_ref = timezone.localdate() - timedelta(days=1)
+    criadas, wpp = NotificacaoService.notificar_pendencias(data_ref)
+    return f"{criadas} notificações criadas ({wpp} WhatsApp) para {data_ref.strftime('%d/%m/%Y')}."
+
+
+TAREFAS_AGENDADAS = [
+    {
+        'nome': 'aprovacao_automatica',
+        'comando': 'aprovar_registros_automatico',
+        'intervalo': timedelta(minutes=30),
+    },
+    {
+        'nome': 'importacao_feriados',
+        'comando': 'importar_feriados',
+        'horario': time(3, 0),
+    },
+    {
+        'nome': 'retencao_auditoria',
+        'comando': 'arquivar_auditoria',
+        'horario': time(2, 0),
+    },
+    {
+        'nome': 'reconciliacao_contadores',
+        'comando': 'reconciliar_contadores',
+        'horario': time(4, 0),
+    },
+    {
+        'nome': 'notificacao_pendencias',
+        'funcao': notificar_pendencias_dia_anterior,
+        'horario': time(9, 0),
+        'dias_semana': [1, 2, 3, 4, 5],
+    },
+]
+
+
+def tarefa_esta_pendente(tarefa, ultima_execucao, agora):
+    """
+    Decide se a rotina deve rodar agora, com base na última execução registrada.
+    `agora` deve estar no fuso local.
+    """
+    intervalo = tarefa.get('intervalo')
+    if intervalo:
+        return ultima_execucao is None or (agora - ultima_execucao) >= intervalo
+
+    horario = tarefa.get('horario')
+    if horario:
+        dias_semana = tarefa.get('dias_semana')
+        if dias_semana is not None and agora.weekday() not in dias_semana:
+            return False
+        if agora.time() < horario:
+            return False
+        return ultima_execucao is None or timezone.localtime(ultima_execucao).date() < agora.date()
+
+    return False
@@ -1,5 +1,6 @@
-from django.test import TestCase, Client, override_settings
+from django.test import TestCase, TransactionTestCase, Client, override_settings
 from django.contrib.auth.models import User
+from django.urls import reverse
 from django.utils import timezone
 from datetime import time, date, datetime, timedelta
 from .models import Colaborador, Projeto, Apontamento, CentroCusto
@@ -157,4 +158,1407 @@ class FluxoPrincipalTest(TestCase):
         # Verifica se salvou no banco
         self.assertEqual(Apontamento.objects.count(), 1)
         apt = Apontamento.objects.first()
-        self.assertEqual(apt.colaborador, self.colab)
\ No newline at end of file
+        self.assertEqual(apt.colaborador, self.colab)
+
+class AprovacaoAutomaticaTest(TestCase):
+    """
+    Garante que o robô aprova em lote apenas o que já passou do gatilho.
+    """
+
+    def setUp(self):
+        self.colab = Colaborador.objects.create(nome_completo='Robô Teste', id_colaborador='R01')
+        self.projeto = Projeto.objects.create(nome='Obra Robô', codigo='RB01')
+
+    def _criar(self, data_registro, **extra):
+        apt = Apontamento.objects.create(
+            colaborador=self.colab, projeto=self.projeto, data_apontamento=date.today(),
+            hora_inicio=time(8, 0), hora_termino=time(9, 0), **extra
+        )
+        Apontamento.objects.filter(pk=apt.pk).update(data_registro=data_registro)
+        return apt
+
+    def test_aprova_somente_vencidos_e_gera_auditoria(self):
+        from django.core.management import call_command
+        from io import StringIO
+        from .models import LogAuditoria
+
+        antigo = self._criar(timezone.now() - timedelta(days=3))
+        recente = self._criar(timezone.now())
+        editado = self._criar(timezone.now() - timedelta(days=3), contagem_edicao=1)
+
+        saida = StringIO()
+        call_command('aprovar_registros_automatico', '--dry-run', stdout=saida)
+        self.assertIn('1 registros seriam aprovados', saida.getvalue())
+        self.assertEqual(Apontamento.objects.filter(status_aprovacao='APROVADO').count(), 0)
+
+        call_command('aprovar_registros_automatico', stdout=StringIO())
+
+        antigo.refresh_from_db(); recente.refresh_from_db(); editado.refresh_from_db()
+        self.assertEqual(antigo.status_aprovacao, 'APROVADO')
+        self.assertEqual(recente.status_aprovacao, 'EM_ANALISE')
+        self.assertEqual(editado.status_aprovacao, 'EM_ANALISE')
+        self.assertEqual(LogAuditoria.objects.filter(acao='APROVACAO', objeto_id=str(antigo.id)).count(), 1)
+
+
+class AgendadorTest(TestCase):
+    """
+    Regras de agenda e trava única do comando `agendador`.
+    """
+
+    def test_regras_de_agenda(self):
+        from .tarefas import tarefa_esta_pendente
+
+        agora = timezone.localtime(timezone.now()).replace(hour=10, minute=0)
+        recorrente = {'nome': 'x', 'intervalo': timedelta(minutes=30)}
+        self.assertTrue(tarefa_esta_pendente(recorrente, None, agora))
+        self.assertFalse(tarefa_esta_pendente(recorrente, agora - timedelta(minutes=10), agora))
+        self.assertTrue(tarefa_esta_pendente(recorrente, agora - timedelta(minutes=31), agora))
+
+        diaria = {'nome': 'y', 'horario': time(9, 0)}
+        self.assertTrue(tarefa_esta_pendente(diaria, agora - timedelta(days=1), agora))
+        self.assertFalse(tarefa_esta_pendente(diaria, agora - timedelta(minutes=5), agora))
+        self.assertFalse(tarefa_esta_pendente(diaria, None, agora.replace(hour=8)))
+
+    def test_trava_unica_entre_processos(self):
+        from .management.commands.agendador import Command
+
+        primeiro, segundo = Command(), Command()
+        for cmd, dono in ((primeiro, 'host-a:1'), (segundo, 'host-b:2')):
+            cmd.dono = dono
+            cmd.ttl_trava = timedelta(seconds=60)
+
+        self.assertTrue(primeiro._adquirir_trava())
+        self.assertFalse(segundo._adquirir_trava())
+        self.assertTrue(primeiro._adquirir_trava())
+
+        primeiro._liberar_trava()
+        self.assertTrue(segundo._adquirir_trava())
+
+
+class ServidorFixtureFeriados:
+    """
+    Servidor HTTP local que imita a API de feriados e a API de localidades do IBGE,
+    permitindo testar o importador sem acesso à internet.
+    """
+
+    MUNICIPIOS = {
+        'SP': [{'id': 3550308, 'nome': 'São Paulo'}, {'id': 3520509, 'nome': 'Indaiatuba'}],
+    }
+
+    def __init__(self, descricao='Aniversário da Cidade'):
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import urlparse, parse_qs
+        import json
+
+        fixture = self
+        self.descricao = descricao
+        self.requisicoes = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                partes = url.path.strip('/').split('/')
+                fixture.requisicoes.append(url.path)
+
+                if partes[:2] == ['localidades', 'estados']:
+                    corpo = fixture.MUNICIPIOS.get(partes[2], [])
+                elif partes[:2] == ['feriados', 'cidade']:
+                    ano = parse_qs(url.query)['ano'][0]
+                    corpo = {'feriados': [
+                        {'data': f'{ano}-01-25', 'nome': fixture.descricao},
+                        {'data': f'20/11/{ano}', 'nome': 'Consciência Negra'},
+                    ]}
+                else:
+                    self.send_response(404); self.end_headers(); return
+
+                dados = json.dumps(corpo).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(dados)))
+                self.end_headers()
+                self.wfile.write(dados)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class ImportacaoFeriadosTest(TestCase):
+    """
+    Importação concorrente de feriados contra o servidor de fixtures local.
+    """
+
+    def setUp(self):
+        Colaborador.objects.create(nome_completo='A', id_colaborador='F1', cidade='São Paulo', uf='sp')
+        Colaborador.objects.create(nome_completo='B', id_colaborador='F2', cidade='SAO PAULO', uf='SP')
+        Colaborador.objects.create(nome_completo='C', id_colaborador='F3', cidade='Indaiatuba', uf='SP')
+        Colaborador.objects.create(nome_completo='D', id_colaborador='F4', cidade='Cidade Inexistente', uf='SP')
+
+    def _importar(self, servidor):
+        from django.core.management import call_command
+        from io import StringIO
+
+        saida = StringIO()
+        call_command(
+            'importar_feriados', '--anos', '2030',
+            '--api-url', servidor.url, '--ibge-url', servidor.url, stdout=saida
+        )
+        return saida.getvalue()
+
+    def test_importa_cidades_dos_colaboradores_com_upsert(self):
+        from .models import Feriado, Municipio
+
+        with ServidorFixtureFeriados() as servidor:
+            saida = self._importar(servidor)
+
+        self.assertIn('CIDADE INEXISTENTE/SP', saida)
+        self.assertTrue(Municipio.objects.filter(nome='INDAIATUBA', uf='SP', codigo_ibge='3520509').exists())
+        self.assertEqual(Feriado.objects.count(), 4)
+        self.assertEqual(sum(1 for r in servidor.requisicoes if r.startswith('/feriados')), 2)
+
+        Colaborador.objects.filter(id_colaborador='F4').delete()
+        with ServidorFixtureFeriados(descricao='Fundação da Cidade') as servidor:
+            self._importar(servidor)
+            self.assertFalse(any(r.startswith('/localidades') for r in servidor.requisicoes))
+
+        self.assertEqual(Feriado.objects.count(), 4)
+        self.assertEqual(Feriado.objects.get(data=date(2030, 1, 25), cidade='SAO PAULO').descricao, 'Fundação da Cidade')
+
+    def test_resposta_invalida_falha_so_a_cidade(self):
+        from unittest import mock
+        from produtividade.management.commands.importar_feriados import Command
+
+        comando = Command()
+        comando.timeout = 5
+        cidade = {'nome': 'SAO PAULO', 'uf': 'SP', 'ibge': '3550308'}
+        for corpo in (ValueError("Expecting value"), ['2030-01-25']):
+            resposta = mock.Mock(status_code=200)
+            if isinstance(corpo, Exception):
+                resposta.json.side_effect = corpo
+            else:
+                resposta.json.return_value = corpo
+            session = mock.Mock(get=mock.Mock(return_value=resposta))
+
+            erro, feriados = comando._buscar_feriados(session, 'http://api', cidade, 2030)
+            self.assertTrue(erro.startswith("Resposta inválida"))
+            self.assertEqual(feriados, [])
+
+
+class FeriadoServiceTest(TestCase):
+    """
+    Feriados nacionais/estaduais calculados offline e mesclados com os municipais do banco.
+    """
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_nacionais_e_estaduais_sem_acesso_ao_banco(self):
+        from .services import FeriadoService
+
+        with self.assertNumQueries(0):
+            self.assertTrue(FeriadoService.eh_feriado(date(2026, 4, 21)))
+            self.assertFalse(FeriadoService.eh_feriado(date(2026, 7, 9)))
+            self.assertTrue(FeriadoService.eh_feriado(date(2026, 7, 9), uf='sp'))
+            self.assertFalse(FeriadoService.eh_feriado(date(2026, 4, 22), uf='XX'))
+
+    def test_municipais_mesclados_com_cache_e_invalidacao(self):
+        from .models import Feriado
+        from .services import FeriadoService
+
+        Feriado.objects.create(data=date(2026, 1, 25), descricao='Aniversário de SP', cidade='SAO PAULO', uf='SP')
+
+        with self.assertNumQueries(1):
+            self.assertTrue(FeriadoService.eh_feriado(date(2026, 1, 25), 'São Paulo', 'SP'))
+            self.assertTrue(FeriadoService.eh_feriado(date(2026, 4, 21), 'São Paulo', 'SP'))
+            self.assertFalse(FeriadoService.eh_feriado(date(2026, 1, 26), 'São Paulo', 'SP'))
+
+        Feriado.objects.create(data=date(2026, 1, 26), descricao='Ponte', cidade='SAO PAULO', uf='SP')
+        self.assertEqual(FeriadoService.nome_feriado(date(2026, 1, 26), 'sao paulo', 'sp'), 'Ponte')
+
+    def test_dashboard_conformidade_usa_feriados_municipais_em_cache(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .models import Feriado
+
+        Feriado.objects.create(data=date(2026, 1, 26), descricao='Ponte', cidade='SAO PAULO', uf='SP')
+        Colaborador.objects.create(
+            nome_completo='Paulistano', id_colaborador='FS1', cidade='São Paulo', uf='SP',
+            user_account=User.objects.create_user(username='paulistano', password='123'),
+        )
+        self.client.force_login(User.objects.create_superuser(username='dono_feriado', password='123'))
+        url = reverse('produtividade:dashboard_conformidade') + '?data=2026-01-26'
+
+        self.assertEqual(self.client.get(url).context['nome_feriado'], 'Ponte')
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get(url).context['nome_feriado'], 'Ponte')
+        self.assertFalse(any('produtividade_feriado' in q['sql'] for q in ctx.captured_queries))
+
+
+class AuditoriaBufferTest(TransactionTestCase):
+    """
+    Logs de auditoria acumulados por requisição e gravados com um único INSERT.
+    (TransactionTestCase: o buffer depende de on_commit reais.)
+    """
+
+    def test_logs_da_requisicao_em_um_unico_insert(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .models import LogAuditoria
+
+        User.objects.create_user(username='auditado', password='123')
+        client = Client()
+
+        with CaptureQueriesContext(connection) as ctx:
+            client.post('/accounts/login/', {'username': 'auditado', 'password': 'errada'})
+            client.post('/accounts/login/', {'username': 'auditado', 'password': '123'})
+
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT') and 'logauditoria' in q['sql']]
+        self.assertEqual(len(inserts), 2)
+        self.assertEqual(
+            sorted(LogAuditoria.objects.values_list('acao', flat=True)), ['LOGIN', 'LOGIN_FALHA']
+        )
+
+    def test_buffer_agrupa_e_rollback_descarta(self):
+        from django.db import transaction
+        from .models import LogAuditoria
+        from .utils import buffer_auditoria, registrar_log
+
+        with buffer_auditoria():
+            with self.assertNumQueries(0):
+                for i in range(5):
+                    registrar_log(None, 'CRIACAO', 'Apontamento', i, f"Registro {i}")
+
+            try:
+                with transaction.atomic():
+                    registrar_log(None, 'CRIACAO', 'Apontamento', 99, "Revertido")
+                    raise ValueError("falha no rateio")
+            except ValueError:
+                pass
+
+        self.assertEqual(LogAuditoria.objects.count(), 5)
+        self.assertFalse(LogAuditoria.objects.filter(objeto_id='99').exists())
+
+        # Ação crítica: gravação imediata mesmo dentro do buffer
+        with buffer_auditoria():
+            registrar_log(None, 'EXCLUSAO', 'Apontamento', 7, "Exclusão", sincrono=True)
+            self.assertTrue(LogAuditoria.objects.filter(acao='EXCLUSAO').exists())
+
+
+class RetencaoAuditoriaTest(TestCase):
+    """
+    Logs antigos vão para arquivos mensais gzip JSONL e continuam consultáveis no dashboard.
+    """
+
+    def setUp(self):
+        import tempfile
+        self.diretorio = tempfile.mkdtemp()
+        self.override = override_settings(AUDITORIA_ARQUIVO_DIR=self.diretorio)
+        self.override.enable()
+
+    def tearDown(self):
+        import shutil
+        self.override.disable()
+        shutil.rmtree(self.diretorio, ignore_errors=True)
+
+    def _criar_log(self, usuario, acao, quando):
+        from .models import LogAuditoria
+        log = LogAuditoria.objects.create(usuario=usuario, acao=acao, modelo_afetado='Sistema', detalhes=f"{acao} {quando}")
+        LogAuditoria.objects.filter(pk=log.pk).update(data_hora=quando)
+
+    def test_arquiva_meses_antigos_e_dashboard_le_o_arquivo(self):
+        import io
+        from django.core.management import call_command
+        from .models import LogAuditoria
+        from .services import ArquivoAuditoriaService
+
+        owner = User.objects.create_superuser(username='dono', password='123')
+        antigo = timezone.make_aware(datetime(2024, 3, 10, 14, 0))
+        for minuto in range(3):
+            self._criar_log(owner, 'LOGIN', antigo + timedelta(minutes=minuto))
+        self._criar_log(owner, 'EDICAO', antigo + timedelta(days=1))
+        self._criar_log(owner, 'LOGIN', timezone.now())
+
+        call_command('arquivar_auditoria', meses=6, chunk=2, stdout=io.StringIO())
+
+        self.assertEqual(LogAuditoria.objects.count(), 1)
+        manifesto = ArquivoAuditoriaService.ler_manifesto()
+        self.assertEqual(manifesto['2024-03'][0]['registros'], 4)
+
+        # Reexecução não duplica nada
+        call_command('arquivar_auditoria', meses=6, stdout=io.StringIO())
+        self.assertEqual(len(ArquivoAuditoriaService.ler_manifesto()['2024-03']), 1)
+
+        self.client.force_login(owner)
+        response = self.client.get(reverse('produtividade:dashboard_auditoria'), {'data_ini': '2024-03-10', 'acao': 'LOGIN'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['consultou_arquivo'])
+        logs = response.context['logs']
+        self.assertEqual(len(logs), 3)
+        self.assertEqual(logs[0].usuario, owner)
+        self.assertGreater(logs[0].data_hora, logs[-1].data_hora)
+
+
+class TrilhaAuditoriaTest(TestCase):
+    """
+    Paginação por cursor, autocomplete de usuários e exportação CSV em streaming.
+    """
+
+    def setUp(self):
+        from django.core.cache import cache
+        from .models import LogAuditoria
+
+        cache.clear()
+        self.owner = User.objects.create_superuser(username='dono', password='123', first_name='Dona')
+        self.client.force_login(self.owner)
+
+        base = timezone.make_aware(datetime(2026, 5, 4, 8, 0))
+        for i in range(5):
+            log = LogAuditoria.objects.create(usuario=self.owner, acao='EDICAO', modelo_afetado='Apontamento', objeto_id=str(i), detalhes=f"Edição {i}")
+            # Dois logs no mesmo instante: o id desempata o cursor
+            LogAuditoria.objects.filter(pk=log.pk).update(data_hora=base + timedelta(minutes=i // 2))
+
+    def test_paginacao_por_cursor_sem_repetir_registros(self):
+        from .services import TrilhaAuditoriaService
+
+        vistos = []
+        cursor = None
+        while True:
+            logs, cursor = TrilhaAuditoriaService.pagina(acao='EDICAO', cursor=cursor, limite=2)
+            vistos += [log.objeto_id for log in logs]
+            if not cursor:
+                break
+
+        self.assertEqual(vistos, ['4', '3', '2', '1', '0'])
+
+        response = self.client.get(reverse('produtividade:dashboard_auditoria'), {'data_ini': '2026-05-04'})
+        self.assertEqual(len(response.context['logs']), 5)
+        self.assertIsNone(response.context['proximo_cursor'])
+
+    def test_autocomplete_de_usuarios_em_cache(self):
+        User.objects.create_user(username='ana', password='123', first_name='Ana')
+        url = reverse('produtividade:buscar_usuarios')
+
+        self.assertEqual([u['login'] for u in self.client.get(url, {'q': 'an'}).json()['usuarios']], ['ana'])
+        with self.assertNumQueries(2):  # sessão + usuário autenticado; a busca vem do cache
+            self.client.get(url, {'q': 'an'})
+
+        # Novo usuário invalida o cache
+        User.objects.create_user(username='anderson', password='123')
+        self.assertEqual(len(self.client.get(url, {'q': 'an'}).json()['usuarios']), 2)
+
+    def test_exportacao_csv_em_streaming(self):
+        response = self.client.get(reverse('produtividade:exportar_auditoria_csv'), {
+            'data_ini': '2026-05-01', 'data_fim': '2026-05-31', 'acao': 'EDICAO'
+        })
+        self.assertTrue(response.streaming)
+        linhas = b''.join(response.streaming_content).decode('utf-8-sig').strip().splitlines()
+        self.assertEqual(len(linhas), 6)
+        self.assertIn('04/05/2026 08:00:00;dono;EDICAO', linhas[1])
+
+
+class SinoNotificacoesTest(TestCase):
+    """
+    Context processor do sino: valores preguiçosos, em cache e invalidados nas escritas.
+    """
+
+    def setUp(self):
+        from django.core.cache import cache
+        from django.test import RequestFactory
+
+        cache.clear()
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user(username='sino', password='123')
+        self.colab = Colaborador.objects.create(nome_completo="Colab Sino", user_account=self.user)
+
+    def _contexto(self, user):
+        from .context_processors import notificacoes_globais
+        request = self.factory.get('/')
+        request.user = user
+        return notificacoes_globais(request)
+
+    def test_lazy_cache_e_invalidacao(self):
+        from .models import Notificacao
+
+        Notificacao.objects.create(colaborador=self.colab, titulo="A", mensagem="a")
+        Notificacao.objects.create(colaborador=self.colab, titulo="B", mensagem="b")
+
+        # Template que não usa o sino: nenhuma consulta
+        with self.assertNumQueries(0):
+            self._contexto(self.user)
+
+        with self.assertNumQueries(5):  # identidade (3) + últimas + contagem
+            ctx = self._contexto(self.user)
+            self.assertEqual(ctx['notificacoes_nao_lidas_count'], 2)
+            self.assertEqual([n.titulo for n in ctx['notificacoes_usuario']], ['B', 'A'])
+
+        outra_requisicao = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):  # identidade e resumo vêm do cache
+            self.assertTrue(self._contexto(outra_requisicao)['notificacoes_nao_lidas_count'] > 0)
+
+        self.client.force_login(self.user)
+        self.client.post(reverse('produtividade:marcar_todas_lidas'))
+        self.assertEqual(self._contexto(self.user)['notificacoes_nao_lidas_count'], 0)
+
+        Notificacao.objects.create(colaborador=self.colab, titulo="C", mensagem="c")
+        self.assertEqual(self._contexto(self.user)['notificacoes_nao_lidas_count'], 1)
+
+    def test_respostas_do_owner_pelo_indice(self):
+        from .models import Notificacao
+
+        owner = User.objects.create_superuser(username='dono', password='123')
+        notif = Notificacao.objects.create(colaborador=self.colab, titulo="A", mensagem="a")
+        Notificacao.objects.create(colaborador=self.colab, titulo="Sem resposta", mensagem="b")
+
+        self.assertEqual(len(self._contexto(owner)['notificacoes_usuario']), 0)
+
+        notif.comentario_colaborador = "Esqueci de apontar"
+        notif.save(update_fields=['comentario_colaborador'])
+
+        respostas = self._contexto(owner)['notificacoes_usuario']
+        self.assertEqual([n.titulo for n in respostas], ['A'])
+        self.assertTrue(Notificacao.objects.get(pk=notif.pk).possui_resposta)
+
+
+class IdentidadeRequisicaoTest(TestCase):
+    """
+    request.identidade: permissões resolvidas uma vez, em cache e invalidadas por sinais.
+    """
+
+    def setUp(self):
+        from django.core.cache import cache
+        from django.contrib.auth.models import Group
+        from .models import Setor
+
+        cache.clear()
+        self.setor = Setor.objects.create(nome="Obras")
+        self.outro_setor = Setor.objects.create(nome="Manutenção")
+        self.user = User.objects.create_user(username='adm', password='123')
+        self.user.groups.add(Group.objects.create(name='ADMINISTRATIVO'))
+        self.adm = Colaborador.objects.create(nome_completo="Adm", id_colaborador='I1', user_account=self.user)
+        self.adm.setores_gerenciados.add(self.setor)
+        self.equipe = Colaborador.objects.create(nome_completo="Equipe", id_colaborador='I2', setor=self.setor)
+        self.fora = Colaborador.objects.create(nome_completo="Fora", id_colaborador='I3', setor=self.outro_setor)
+
+    def test_identidade_resolvida_uma_vez_e_invalidada(self):
+        from .identidade import obter_identidade
+        from .utils import is_gerente, is_administrativo, pode_fazer_rateio
+        from .forms import ApontamentoForm
+
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(4):
+            self.assertTrue(is_administrativo(user))
+            self.assertTrue(pode_fazer_rateio(user))
+            self.assertFalse(is_gerente(user))
+            self.assertEqual(obter_identidade(user).colaboradores_visiveis_ids, {self.adm.pk, self.equipe.pk})
+
+        form = ApontamentoForm(user=User.objects.get(pk=self.user.pk))
+        self.assertEqual(set(form.fields['colaborador'].queryset.values_list('pk', flat=True)), {self.adm.pk, self.equipe.pk})
+
+        # Novo setor sob gestão: cache descartado pelo m2m_changed
+        self.adm.setores_gerenciados.add(self.outro_setor)
+        identidade = obter_identidade(User.objects.get(pk=self.user.pk))
+        self.assertIn(self.fora.pk, identidade.colaboradores_visiveis_ids)
+
+    def test_middleware_expoe_identidade(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('produtividade:novo_apontamento'))
+        self.assertEqual(response.wsgi_request.identidade.colaborador_id, self.adm.pk)
+
+
+class CatalogoBuscaTest(TestCase):
+    """
+    Autocomplete dos selects: busca por prefixo paginada, cache por versão e
+    formulário que só renderiza/valida a opção enviada.
+    """
+
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.owner = User.objects.create_superuser(username='dono', password='123')
+        self.user = User.objects.create_user(username='operador', password='123')
+        self.colab = Colaborador.objects.create(nome_completo="Operador", id_colaborador='C1', user_account=self.user)
+        Colaborador.objects.create(nome_completo="Outro", id_colaborador='C2')
+        for i in range(25):
+            Projeto.objects.create(nome=f"Obra {i:02d}", codigo=f"R{i:04d}")
+        Projeto.objects.create(nome="Vintage", codigo="X0001")
+        Projeto.objects.create(nome="Inativa", codigo="X0002", ativo=False)
+
+    def _buscar(self, catalogo, **params):
+        return self.client.get(reverse('produtividade:buscar_catalogo', args=[catalogo]), params).json()
+
+    def test_busca_por_prefixo_paginada_e_em_cache(self):
+        self.client.force_login(self.owner)
+
+        pagina1 = self._buscar('projetos', q='r')
+        self.assertEqual(len(pagina1['results']), 20)
+        self.assertTrue(pagina1['pagination']['more'])
+        pagina2 = self._buscar('projetos', q='r', page=2)
+        self.assertEqual(len(pagina2['results']), 5)
+        self.assertFalse(pagina2['pagination']['more'])
+
+        self.assertEqual(self._buscar('projetos', q='vint')['results'][0]['text'], "X0001 - Vintage")
+        self.assertEqual(self._buscar('projetos', q='X0')['results'], [{'id': Projeto.objects.get(codigo='X0001').pk, 'text': "X0001 - Vintage"}])
+
+        # Segunda chamada vem do cache; um save no catálogo invalida
+        from .services import CatalogoService
+        with self.assertNumQueries(0):
+            CatalogoService.buscar('projetos', 'vint')
+        Projeto.objects.create(nome="Vintage II", codigo="X0003")
+        self.assertEqual(len(self._buscar('projetos', q='vint')['results']), 2)
+
+    def test_colaboradores_restritos_ao_perfil(self):
+        self.client.force_login(self.user)
+        self.assertEqual([r['id'] for r in self._buscar('colaboradores')['results']], [self.colab.pk])
+        self.assertEqual(self.client.get(reverse('produtividade:buscar_catalogo', args=['inexistente'])).status_code, 404)
+
+    def test_formulario_renderiza_apenas_opcao_selecionada(self):
+        from .forms import ApontamentoForm
+        from .models import Veiculo
+
+        veiculo = Veiculo.objects.create(placa="ABC1234", descricao="Strada")
+        Veiculo.objects.create(placa="XYZ9876", descricao="Saveiro")
+        projeto = Projeto.objects.get(codigo='X0001')
+
+        form = ApontamentoForm(initial={'projeto': projeto.pk, 'veiculo_selecao': veiculo.pk}, user=self.owner)
+        html_projeto = str(form['projeto'])
+        self.assertIn("X0001 - Vintage", html_projeto)
+        self.assertNotIn("R0000", html_projeto)
+        self.assertIn('data-url-busca', html_projeto)
+        self.assertEqual([c[0] for c in form.fields['veiculo_selecao'].choices], ['', veiculo.pk, 'OUTRO'])
+
+        # Id enviado é validado contra o banco (inexistente/inativo é rejeitado)
+        inativa = Projeto.objects.get(codigo='X0002')
+        form = ApontamentoForm({'projeto': inativa.pk, 'veiculo_selecao': '999'}, user=self.owner)
+        form.is_valid()
+        self.assertIn('projeto', form.errors)
+        self.assertIn('veiculo_selecao', form.errors)
+
+    def test_snapshot_do_catalogo_com_etag(self):
+        self.client.force_login(self.user)
+        url = reverse('produtividade:api_catalogo')
+        cc = CentroCusto.objects.create(nome="Viagem", permite_alocacao=True)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        dados = response.json()
+        self.assertEqual(len(dados['projetos']), 26)
+        self.assertIn([cc.pk, "Viagem", True], dados['centros_custo'])
+
+        etag = response['ETag']
+        with self.assertNumQueries(2):  # sessão + usuário; nenhuma consulta de catálogo
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Sinal do cadastro troca a versão: o navegador recebe o snapshot novo
+        cc.permite_alocacao = False
+        cc.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn([cc.pk, "Viagem", False], response.json()['centros_custo'])
+
+
+class ConflitoHorarioTest(TestCase):
+    """
+    Sobreposição de intervalos: uma consulta, todos os conflitos, turnos noturnos e lotes.
+    """
+
+    def setUp(self):
+        self.colab = Colaborador.objects.create(nome_completo="Plantonista", id_colaborador='H1')
+        self.dia = date(2024, 3, 12)
+
+    def _apt(self, data_ref, inicio, termino):
+        return Apontamento.objects.create(colaborador=self.colab, data_apontamento=data_ref, hora_inicio=inicio, hora_termino=termino)
+
+    def test_conflitos_do_dia_anterior_mesmo_dia_e_seguinte(self):
+        from .services import ConflitoHorarioService
+
+        noturno = self._apt(self.dia - timedelta(days=1), time(22, 0), time(2, 0))
+        manha = self._apt(self.dia, time(8, 0), time(12, 0))
+        madrugada_seguinte = self._apt(self.dia + timedelta(days=1), time(0, 30), time(3, 0))
+        self._apt(self.dia, time(13, 0), time(17, 0))
+
+        # 01:00-09:00 pega o noturno de ontem e a manhã; 23:00-01:00 invade o dia seguinte
+        with self.assertNumQueries(1):
+            conflitos = ConflitoHorarioService.conflitos(self.colab, [
+                (self.dia, time(1, 0), time(9, 0)),
+                (self.dia, time(23, 0), time(1, 0)),
+            ])
+
+        self.assertEqual(
+            [(c['candidato'], c['tipo'], c['apontamento'].pk) for c in conflitos],
+            [(0, 'MESMO_DIA', manha.pk), (0, 'DIA_ANTERIOR', noturno.pk), (1, 'DIA_SEGUINTE', madrugada_seguinte.pk)],
+        )
+
+        # Encostar no fim (intervalo semiaberto) não é conflito; candidatos também se comparam entre si
+        self.assertEqual(ConflitoHorarioService.conflitos(self.colab, [(self.dia, time(12, 0), time(13, 0))]), [])
+        lote = ConflitoHorarioService.conflitos(self.colab, [
+            (self.dia, time(18, 0), time(20, 0)),
+            (self.dia, time(19, 0), time(21, 0)),
+        ])
+        self.assertEqual([(c['tipo'], c['outro']) for c in lote], [('ENTRE_CANDIDATOS', 1)])
+
+    def test_formulario_usa_o_servico(self):
+        from .forms import ApontamentoForm
+
+        manha = self._apt(self.dia, time(8, 0), time(12, 0))
+        owner = User.objects.create_superuser(username='dono', password='123')
+        dados = {
+            'colaborador': self.colab.pk, 'data_apontamento': self.dia.strftime('%d/%m/%Y'),
+            'local_execucao': 'EXT', 'hora_inicio': '11:00', 'hora_termino': '14:00',
+        }
+        form = ApontamentoForm(dados, user=owner)
+        self.assertFalse(form.is_valid())
+        self.assertIn("Conflito de horário (Mesmo dia)", str(form.non_field_errors()))
+
+        # Na edição o próprio registro é ignorado
+        form = ApontamentoForm({**dados, 'hora_inicio': '08:00', 'hora_termino': '12:00'}, instance=manha, user=owner)
+        form.is_valid()
+        self.assertNotIn("Conflito", str(form.non_field_errors()))
+
+    def test_participacao_de_auxiliares_e_varredura(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .forms import ApontamentoForm
+        from .services import ConflitoHorarioService
+
+        aux = Colaborador.objects.create(nome_completo="Auxiliar", id_colaborador='H2', cargo='AUXILIAR TECNICO')
+        extra = Colaborador.objects.create(nome_completo="Extra", id_colaborador='H3')
+        outro = Colaborador.objects.create(nome_completo="Outro Titular", id_colaborador='H4')
+
+        equipe_a = self._apt(self.dia, time(8, 0), time(12, 0))
+        equipe_a.auxiliar = aux
+        equipe_a.save()
+        equipe_a.auxiliares_extras.set([extra])
+        # Auxiliar de A é titular de B no mesmo horário; extra de A é auxiliar de C
+        Apontamento.objects.create(colaborador=aux, data_apontamento=self.dia, hora_inicio=time(11, 0), hora_termino=time(13, 0))
+        Apontamento.objects.create(colaborador=outro, auxiliar=extra, data_apontamento=self.dia, hora_inicio=time(9, 0), hora_termino=time(10, 0))
+
+        with self.assertNumQueries(2):
+            indice = ConflitoHorarioService.participacoes(self.dia, self.dia)
+        pares = sorted((s['pessoa_id'], s['minutos']) for s in ConflitoHorarioService.varrer_sobreposicoes(indice))
+        self.assertEqual(pares, sorted([(aux.pk, 60), (extra.pk, 60)]))
+
+        saida = StringIO()
+        call_command('relatorio_sobreposicoes', inicio=str(self.dia), fim=str(self.dia), stdout=saida)
+        self.assertIn("2 sobreposições (120 min", saida.getvalue())
+
+        # Formulário: outro titular levando o auxiliar de A no mesmo horário é barrado
+        owner = User.objects.create_superuser(username='dono', password='123')
+        form = ApontamentoForm({
+            'colaborador': outro.pk, 'data_apontamento': self.dia.strftime('%d/%m/%Y'),
+            'local_execucao': 'EXT', 'hora_inicio': '14:00', 'hora_termino': '15:00',
+            'registrar_auxiliar': 'on', 'auxiliar_selecao': aux.pk,
+        }, user=owner)
+        form.is_valid()
+        self.assertNotIn("AUXILIAR já está", str(form.non_field_errors()))
+
+        form = ApontamentoForm({
+            'colaborador': outro.pk, 'data_apontamento': self.dia.strftime('%d/%m/%Y'),
+            'local_execucao': 'EXT', 'hora_inicio': '10:00', 'hora_termino': '10:30',
+            'registrar_auxiliar': 'on', 'auxiliar_selecao': aux.pk,
+        }, user=owner)
+        self.assertFalse(form.is_valid())
+        self.assertIn(f"AUXILIAR já está no apontamento #{equipe_a.pk} como auxiliar", str(form.non_field_errors()))
+
+
+class AuditoriaConsistenciaTest(TestCase):
+    """
+    Comando auditar_consistencia: varredura única por colaborador gravando os achados.
+    """
+
+    def setUp(self):
+        self.colab = Colaborador.objects.create(nome_completo="Varredura", id_colaborador='V1')
+        self.dia = date(2024, 5, 6)
+
+    def _apt(self, data_ref, inicio, termino, **extra):
+        return Apontamento.objects.create(colaborador=self.colab, data_apontamento=data_ref, hora_inicio=inicio, hora_termino=termino, **extra)
+
+    def test_varredura_registra_e_corrige(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import InconsistenciaApontamento
+
+        manha = self._apt(self.dia, time(8, 0), time(12, 0))
+        sobreposto = self._apt(self.dia, time(11, 30), time(13, 0))
+        self._apt(self.dia, time(17, 0), time(18, 0))                                   # lacuna de 4h
+        self._apt(self.dia, time(19, 0), time(20, 0), id_agrupamento='g1')
+        self._apt(self.dia, time(20, 30), time(21, 0), id_agrupamento='g1')              # rateio com buraco
+        esquecido = self._apt(self.dia + timedelta(days=1), time(7, 0), None)
+
+        saida = StringIO()
+        call_command('auditar_consistencia', inicio=str(self.dia), fim=str(self.dia + timedelta(days=1)), corrigir=True, stdout=saida)
+
+        achados = {(a.tipo, a.apontamento_id): a for a in InconsistenciaApontamento.objects.all()}
+        self.assertEqual(achados[('SOBREPOSICAO', sobreposto.pk)].apontamento_relacionado_id, manha.pk)
+        self.assertEqual(achados[('SOBREPOSICAO', sobreposto.pk)].minutos, 30)
+        self.assertEqual(achados[('LACUNA', Apontamento.objects.get(hora_inicio=time(17, 0)).pk)].minutos, 240)
+        self.assertEqual([a.minutos for (tipo, _), a in achados.items() if tipo == 'RATEIO'], [30])
+        self.assertTrue(achados[('TIMER_ABERTO', esquecido.pk)].corrigido)
+
+        esquecido.refresh_from_db()
+        self.assertEqual(esquecido.hora_termino, time(7, 0))
+        self.assertTrue(esquecido.flag_atencao)
+        self.assertTrue(Apontamento.objects.get(pk=sobreposto.pk).flag_atencao)
+
+        # Reexecução substitui os achados em aberto em vez de duplicá-los
+        call_command('auditar_consistencia', inicio=str(self.dia), fim=str(self.dia + timedelta(days=1)), stdout=StringIO())
+        self.assertEqual(InconsistenciaApontamento.objects.filter(tipo='SOBREPOSICAO').count(), 1)
+        self.assertEqual(InconsistenciaApontamento.objects.filter(tipo='TIMER_ABERTO').count(), 1)
+
+
+class RateioLoteTest(TestCase):
+    """
+    RateioService: fatias gravadas em lote, custo de consultas independente da quantidade de obras.
+    """
+
+    def setUp(self):
+        from .models import CodigoCliente
+
+        self.user = User.objects.create_user(username='coord', password='123')
+        self.colab = Colaborador.objects.create(nome_completo="Rateador", id_colaborador='R1', user_account=self.user)
+        self.aux = Colaborador.objects.create(nome_completo="Aux", id_colaborador='R2')
+        self.projetos = [Projeto.objects.create(nome=f"Obra {i}", codigo=f"RT{i:02d}") for i in range(10)]
+        self.cliente = CodigoCliente.objects.create(codigo='1894', nome="Vintage")
+
+    def _base(self, data_ref):
+        return Apontamento(
+            colaborador=self.colab, data_apontamento=data_ref, local_execucao='INT',
+            hora_inicio=time(8, 0), hora_termino=time(18, 0), registrado_por=self.user,
+        )
+
+    def _consultas_para(self, itens, data_ref):
+        from django.db import connection, transaction
+        from django.test.utils import CaptureQueriesContext
+        from .services import RateioService
+
+        with CaptureQueriesContext(connection) as ctx:
+            with transaction.atomic():
+                criados = RateioService.criar(self._base(data_ref), itens, [self.aux.pk, 9999])
+        return criados, len(ctx.captured_queries)
+
+    def test_custo_constante_e_fatias_continuas(self):
+        dois, consultas_dois = self._consultas_para([f"P_{self.projetos[0].pk}", f"C_{self.cliente.pk}"], date(2024, 6, 3))
+        itens = [f"P_{p.pk}" for p in self.projetos[:9]] + [f"C_{self.cliente.pk}", "P_999999"]  # id inexistente é ignorado
+        dez, consultas_dez = self._consultas_para(itens, date(2024, 6, 4))
+
+        self.assertEqual(len(dois), 2)
+        self.assertEqual(len(dez), 10)
+        self.assertEqual(consultas_dois, consultas_dez)
+
+        # Fatias cobrem 08:00-18:00 sem buracos, todas no mesmo agrupamento e com o auxiliar válido
+        fatias = list(Apontamento.objects.filter(data_apontamento=date(2024, 6, 4)).order_by('hora_inicio'))
+        self.assertEqual((fatias[0].hora_inicio, fatias[-1].hora_termino), (time(8, 0), time(18, 0)))
+        self.assertTrue(all(a.hora_termino == b.hora_inicio for a, b in zip(fatias, fatias[1:])))
+        self.assertEqual(len({f.id_agrupamento for f in fatias}), 1)
+        self.assertEqual(list(fatias[3].auxiliares_extras.values_list('pk', flat=True)), [self.aux.pk])
+
+
+class DiffSnapshotTest(TestCase):
+    """
+    Diff de snapshots: rótulos de FK resolvidos em lote e coluna "o que mudou" na fila de aprovação.
+    """
+
+    def setUp(self):
+        from .models import Veiculo
+
+        self.owner = User.objects.create_superuser(username='dono', password='123')
+        self.colab = Colaborador.objects.create(nome_completo="Editor", id_colaborador='D1')
+        self.obra_antiga = Projeto.objects.create(nome="Antiga", codigo="DF01")
+        self.obra_nova = Projeto.objects.create(nome="Nova", codigo="DF02")
+        self.veiculo = Veiculo.objects.create(placa="AAA1111", descricao="Strada")
+
+    def _editado(self, dia):
+        from django.forms.models import model_to_dict
+        from .models import ApontamentoHistorico
+
+        apt = Apontamento.objects.create(
+            colaborador=self.colab, projeto=self.obra_antiga, data_apontamento=date(2024, 7, dia),
+            hora_inicio=time(8, 0), hora_termino=time(12, 0), contagem_edicao=1,
+        )
+        snapshot = model_to_dict(apt, exclude=['auxiliares_extras'])
+        snapshot.update({'hora_inicio': '08:00:00', 'hora_termino': '12:00:00', 'data_apontamento': apt.data_apontamento.isoformat()})
+        ApontamentoHistorico.objects.create(apontamento_original=apt, dados_snapshot=snapshot, numero_edicao=1, editado_por=self.owner)
+
+        apt.projeto = self.obra_nova
+        apt.veiculo = self.veiculo
+        apt.hora_termino = time(13, 0)
+        apt.save()
+        return apt
+
+    def test_diff_resolve_rotulos_em_lote(self):
+        from .services import DiffSnapshotService
+
+        apts = [self._editado(d) for d in (1, 2, 3)]
+        historicos = DiffSnapshotService.ultimos_historicos([a.pk for a in apts])
+
+        with self.assertNumQueries(2):  # Projeto + Veiculo, independente do tamanho do lote
+            diffs = DiffSnapshotService.comparar_lote([(historicos[a.pk].dados_snapshot, a) for a in apts])
+
+        self.assertEqual(len(diffs), 3)
+        self.assertEqual(
+            [(d['campo'], d['antes'], d['depois']) for d in diffs[0]],
+            [('Hora Término', '12:00', '13:00'), ('Projeto/Obra', 'DF01 - Antiga', 'DF02 - Nova'), ('Veículo (Frota)', '-', 'Strada - AAA1111')],
+        )
+
+    def test_fila_de_aprovacao_mostra_o_que_mudou(self):
+        self._editado(1)
+        self.client.force_login(self.owner)
+
+        response = self.client.get(reverse('produtividade:aprovacao_dashboard'))
+        self.assertContains(response, "O que mudou")
+        self.assertContains(response, "DF02 - Nova")
+
+        # Mais registros editados não aumentam o número de consultas
+        def consultas():
+            from django.db import connection
+            from django.test.utils import CaptureQueriesContext
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get(reverse('produtividade:aprovacao_dashboard'))
+            return len(ctx.captured_queries)
+
+        antes = consultas()
+        self._editado(2)
+        self._editado(3)
+        self.assertEqual(consultas(), antes)
+
+        analise = self.client.get(reverse('produtividade:analise_apontamento', args=[Apontamento.objects.first().pk]))
+        self.assertTrue(analise.context['tem_alteracao'])
+
+    def test_historico_delta_guarda_rotulos_da_gravacao(self):
+        from .services import DiffSnapshotService, HistoricoVersaoService
+
+        apt = Apontamento.objects.create(
+            colaborador=self.colab, projeto=self.obra_antiga, data_apontamento=date(2024, 7, 1),
+            hora_inicio=time(8, 0), hora_termino=time(12, 0),
+        )
+        anterior = HistoricoVersaoService.capturar(apt)
+        apt.projeto = self.obra_nova
+        apt.contagem_edicao = 1
+        apt.save()
+        historico = HistoricoVersaoService.registrar_edicao(apt, anterior, self.owner)
+
+        self.assertEqual(set(historico.dados_snapshot), {'projeto', 'contagem_edicao'})
+        Projeto.objects.filter(pk=self.obra_antiga.pk).update(nome="Renomeada")
+
+        with self.assertNumQueries(0):
+            diffs = DiffSnapshotService.comparar_historicos([(historico, apt)])[0]
+        self.assertEqual([(d['campo'], d['antes'], d['depois']) for d in diffs], [('Projeto/Obra', 'DF01 - Antiga', 'DF02 - Nova')])
+
+    def test_compactacao_converte_legado_e_reconstroi_versoes(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import ApontamentoHistorico
+        from .services import HistoricoVersaoService
+
+        apt = self._editado(1)
+        call_command('compactar_historico', stdout=StringIO())
+
+        historico = ApontamentoHistorico.objects.get(apontamento_original=apt)
+        self.assertEqual(historico.formato, 'DELTA')
+        self.assertEqual(set(historico.dados_snapshot), {'projeto', 'veiculo', 'hora_termino'})
+        self.assertEqual(historico.dados_snapshot['projeto']['rotulo_antes'], 'DF01 - Antiga')
+
+        original = HistoricoVersaoService.reconstruir(apt, 0)
+        self.assertEqual((original['projeto'], original['veiculo'], original['hora_termino']), (self.obra_antiga.pk, None, '12:00:00'))
+        self.assertEqual(HistoricoVersaoService.reconstruir(apt, 1), HistoricoVersaoService.capturar(apt))
+
+
+
+class FilaAprovacaoLoteTest(TestCase):
+    """
+    FilaAprovacaoService: aprovação em lote condicionada a EM_ANALISE, contagem em cache e paginação por cursor.
+    """
+
+    def setUp(self):
+        from django.contrib.auth.models import Group
+        from .models import Setor
+
+        self.setor = Setor.objects.create(nome="Campo")
+        self.user = User.objects.create_user(username='gestor_fila', password='123')
+        self.user.groups.add(Group.objects.create(name='GESTOR'))
+        self.gestor = Colaborador.objects.create(nome_completo="Gestor", id_colaborador='FA0', user_account=self.user, setor=self.setor)
+        self.gestor.setores_gerenciados.add(self.setor)
+        self.equipe = Colaborador.objects.create(nome_completo="Equipe", id_colaborador='FA1', setor=self.setor)
+        self.fora = Colaborador.objects.create(nome_completo="Fora", id_colaborador='FA2')
+        self.obra = Projeto.objects.create(nome="Obra Fila", codigo="FA01")
+
+    def _pendente(self, colab, dia):
+        return Apontamento.objects.create(
+            colaborador=colab, projeto=self.obra, data_apontamento=date(2024, 9, dia),
+            hora_inicio=time(8, 0), hora_termino=time(12, 0), status_aprovacao='EM_ANALISE',
+        )
+
+    def test_aprovacao_em_lote_respeita_escopo_e_decisoes_concorrentes(self):
+        from .models import LogAuditoria
+
+        meus = [self._pendente(self.equipe, d) for d in (1, 2, 3)]
+        alheio = self._pendente(self.fora, 1)
+        proprio = self._pendente(self.gestor, 1)
+        self.client.force_login(self.user)
+
+        painel = self.client.get(reverse('produtividade:aprovacao_dashboard'))
+        self.assertEqual(painel.context['total_pendentes'], 3)
+
+        # Outro gestor decidiu um dos itens enquanto a página estava aberta
+        meus[0].status_aprovacao, meus[0].motivo_rejeicao = 'REJEITADO', "Outro gestor"
+        meus[0].save()
+
+        logs_antes = LogAuditoria.objects.count()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('produtividade:processar_aprovacao_lote'), {
+                'acao': 'APROVAR', 'motivo_rejeicao': "Conferido",
+                'ids': [a.pk for a in meus] + [alheio.pk, proprio.pk],
+            })
+
+        status = dict(Apontamento.objects.values_list('pk', 'status_aprovacao'))
+        self.assertEqual(status[meus[0].pk], 'REJEITADO')
+        self.assertEqual((status[meus[1].pk], status[meus[2].pk]), ('APROVADO', 'APROVADO'))
+        self.assertEqual((status[alheio.pk], status[proprio.pk]), ('EM_ANALISE', 'EM_ANALISE'))
+        self.assertEqual(LogAuditoria.objects.count(), logs_antes + 2)
+        self.assertEqual(self.client.get(reverse('produtividade:aprovacao_dashboard')).context['total_pendentes'], 0)
+
+    def test_paginacao_por_cursor_percorre_a_fila_sem_repetir(self):
+        from .identidade import obter_identidade
+        from .services import FilaAprovacaoService
+
+        criados = {self._pendente(self.equipe, d).pk for d in (1, 1, 2, 3, 3)}
+        consulta = FilaAprovacaoService.escopo(obter_identidade(self.user))
+
+        vistos, cursor = [], None
+        while True:
+            itens, cursor = FilaAprovacaoService.pagina(consulta, cursor, limite=2)
+            vistos += [i.pk for i in itens]
+            if not cursor:
+                break
+        self.assertEqual(len(vistos), 5)
+        self.assertEqual(set(vistos), criados)
+        self.assertEqual(FilaAprovacaoService.pagina(consulta, 'lixo', limite=10)[0][0].pk, vistos[0])
+
+
+class VersaoApontamentoTest(TestCase):
+    """
+    Concorrência otimista: transições gravam só os campos alterados e recusam versão desatualizada.
+    """
+
+    def setUp(self):
+        self.owner = User.objects.create_superuser(username='dono_versao', password='123')
+        self.colab = Colaborador.objects.create(nome_completo="Versionado", id_colaborador='V1')
+        self.apt = Apontamento.objects.create(
+            colaborador=self.colab, projeto=Projeto.objects.create(nome="Obra V", codigo="VS01"),
+            data_apontamento=date(2024, 9, 2), hora_inicio=time(8, 0), hora_termino=time(12, 0),
+        )
+
+    def test_aprovacao_com_versao_antiga_e_recusada(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        self.client.force_login(self.owner)
+        url = reverse('produtividade:processar_aprovacao', args=[self.apt.pk])
+        versao_vista = self.apt.versao
+
+        # Robô (ou outra edição) grava entre a abertura da tela e a decisão do gestor
+        self.apt.motivo_ajuste = "Alterado no meio"
+        self.apt.save()
+        self.assertEqual(self.apt.versao, versao_vista + 1)
+
+        self.client.post(url, {'acao': 'REJEITAR', 'motivo_rejeicao': "Horas erradas", 'versao': versao_vista})
+        self.apt.refresh_from_db()
+        self.assertEqual(self.apt.status_aprovacao, 'EM_ANALISE')
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(url, {'acao': 'APROVAR', 'motivo_rejeicao': "Ok", 'versao': self.apt.versao})
+        self.apt.refresh_from_db()
+        self.assertEqual((self.apt.status_aprovacao, self.apt.versao), ('APROVADO', versao_vista + 2))
+
+        update = next(q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE "produtividade_apontamento"'))
+        self.assertNotIn('hora_inicio', update)  # só status, motivo e versão
+
+    def test_transicao_relida_e_robo_incrementam_versao(self):
+        from io import StringIO
+        from unittest import mock
+        from django.core.management import call_command
+        from .services import VersaoApontamentoService, ConflitoVersao
+
+        # Transição independente do que foi visto: relê e aplica mesmo após outra gravação
+        versao = self.apt.versao
+        Apontamento.objects.get(pk=self.apt.pk).save()
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(days=2)):
+            call_command('aprovar_registros_automatico', stdout=StringIO())
+        self.assertEqual(Apontamento.objects.get(pk=self.apt.pk).versao, versao + 2)
+
+        def ajustar(apt):
+            apt.status_ajuste = 'PENDENTE'
+            return ['status_ajuste']
+
+        atualizado = VersaoApontamentoService.transicionar(self.apt.pk, ajustar)
+        self.assertEqual((atualizado.status_ajuste, atualizado.status_aprovacao), ('PENDENTE', 'APROVADO'))
+
+        # Quem ainda segura a versão original perde a corrida
+        self.apt.status_aprovacao = 'REJEITADO'
+        with self.assertRaises(ConflitoVersao):
+            VersaoApontamentoService.gravar(self.apt, ['status_aprovacao'], versao)
+
+
+class ContadoresSetorTest(TestCase):
+    """
+    Contadores por setor mantidos a cada transição e conferidos pela reconciliação.
+    """
+
+    def setUp(self):
+        from .models import Setor
+
+        self.setor = Setor.objects.create(nome="Obras")
+        self.outro = Setor.objects.create(nome="Manutenção")
+        self.colab = Colaborador.objects.create(nome_completo="Contado", id_colaborador='CT1', setor=self.setor)
+        self.obra = Projeto.objects.create(nome="Obra C", codigo="CT01")
+
+    def _contador(self, setor):
+        from .models import ContadorSetor
+        c = ContadorSetor.objects.get(setor=setor)
+        return (c.pendentes, c.ajustes_pendentes, c.alertas_clt)
+
+    def test_transicoes_mantem_contadores_e_reconciliacao_confere(self):
+        from .services import ContadoresSetorService, VersaoApontamentoService
+        from .utils import calcular_regras_clt
+
+        apt = Apontamento.objects.create(
+            colaborador=self.colab, projeto=self.obra, data_apontamento=date(2024, 9, 3),
+            hora_inicio=time(6, 0), hora_termino=time(18, 0),
+        )
+        self.assertEqual(self._contador(self.setor), (1, 0, 0))
+
+        # Jornada de 12h: o recálculo CLT (bulk_update) marca o alerta
+        calcular_regras_clt(self.colab, date(2024, 9, 3))
+        self.assertEqual(self._contador(self.setor), (1, 0, 1))
+
+        def solicitar(a):
+            a.status_aprovacao, a.status_ajuste = 'SOLICITACAO_AJUSTE', 'PENDENTE'
+            return ['status_aprovacao', 'status_ajuste']
+        VersaoApontamentoService.transicionar(apt.pk, solicitar)
+        self.assertEqual(self._contador(self.setor), (0, 1, 1))
+
+        # Troca de setor leva as pendências junto
+        self.colab.setor = self.outro
+        self.colab.save()
+        self.assertEqual((self._contador(self.setor), self._contador(self.outro)), ((0, 0, 0), (0, 1, 1)))
+        self.assertEqual(ContadoresSetorService.reconciliar(corrigir=False), {})
+
+        Apontamento.objects.get(pk=apt.pk).delete()
+        self.assertEqual(self._contador(self.outro), (0, 0, 0))
+
+    def test_reconciliacao_corrige_divergencia_e_leitura_e_constante(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .identidade import obter_identidade
+        from .models import ContadorSetor
+        from .services import ContadoresSetorService
+
+        for dia in (2, 3, 4):
+            Apontamento.objects.create(
+                colaborador=self.colab, projeto=self.obra, data_apontamento=date(2024, 9, dia),
+                hora_inicio=time(8, 0), hora_termino=time(12, 0),
+            )
+        ContadorSetor.objects.filter(setor=self.setor).update(pendentes=99)
+
+        saida = StringIO()
+        call_command('reconciliar_contadores', '--dry-run', stdout=saida)
+        self.assertIn("Obras: pendentes: 99 -> 3", saida.getvalue())
+        self.assertEqual(self._contador(self.setor)[0], 99)
+
+        call_command('reconciliar_contadores', stdout=StringIO())
+        self.assertEqual(self._contador(self.setor), (3, 0, 0))
+
+        dono = obter_identidade(User.objects.create_superuser(username='dono_contador', password='123'))
+        with self.assertNumQueries(1):
+            self.assertEqual(ContadoresSetorService.resumo(dono)['pendentes'], 3)
+
+    def test_gravacao_com_versao_antiga_nao_altera_contadores(self):
+        from .services import ConflitoVersao, VersaoApontamentoService
+
+        apt = Apontamento.objects.create(
+            colaborador=self.colab, projeto=self.obra, data_apontamento=date(2024, 9, 5),
+            hora_inicio=time(8, 0), hora_termino=time(12, 0),
+        )
+        versao_vista = apt.versao
+
+        # Primeiro gestor decide; o segundo ainda tem a versão antiga na tela
+        primeiro = Apontamento.objects.get(pk=apt.pk)
+        primeiro.status_aprovacao = 'APROVADO'
+        VersaoApontamentoService.gravar(primeiro, ['status_aprovacao'], versao_vista)
+        self.assertEqual(self._contador(self.setor), (0, 0, 0))
+
+        apt.status_aprovacao = 'REJEITADO'
+        with self.assertRaises(ConflitoVersao):
+            VersaoApontamentoService.gravar(apt, ['status_aprovacao'], versao_vista)
+        self.assertEqual(self._contador(self.setor), (0, 0, 0))
+        self.assertEqual(Apontamento.objects.get(pk=apt.pk).status_aprovacao, 'APROVADO')
+
+
+class InstantesAbsolutosTest(TestCase):
+    """
+    inicio_em / fim_em / data_contabil persistidos: sincronizados em toda gravação de horário
+    e usados por conflitos e regras CLT como faixas indexadas.
+    """
+
+    def setUp(self):
+        self.colab = Colaborador.objects.create(nome_completo="Noturno", id_colaborador='N1')
+        self.projeto = Projeto.objects.create(nome="Obra N", codigo="NT01")
+
+    def _apontar(self, data_ref, inicio, termino):
+        return Apontamento.objects.create(
+            colaborador=self.colab, projeto=self.projeto,
+            data_apontamento=data_ref, hora_inicio=inicio, hora_termino=termino,
+        )
+
+    def test_instantes_sincronizados_no_save_no_cas_e_no_backfill(self):
+        import importlib
+        from django.apps import apps
+        from .services import VersaoApontamentoService
+
+        noturno = self._apontar(date(2024, 10, 1), time(22, 0), time(2, 0))
+        madrugada = self._apontar(date(2024, 10, 3), time(3, 0), time(5, 0))
+        self.assertEqual(timezone.localtime(noturno.fim_em), timezone.make_aware(datetime(2024, 10, 2, 2, 0)))
+        self.assertEqual((noturno.data_contabil, madrugada.data_contabil), (date(2024, 10, 1), date(2024, 10, 2)))
+
+        # Gravação parcial (update_fields / CAS) também leva os instantes junto
+        noturno.hora_termino = time(23, 0)
+        VersaoApontamentoService.gravar(noturno, ['hora_termino'])
+        madrugada.hora_inicio = time(7, 0)
+        madrugada.hora_termino = time(9, 0)
+        madrugada.save(update_fields=['hora_inicio', 'hora_termino'])
+        noturno.refresh_from_db()
+        madrugada.refresh_from_db()
+        self.assertEqual(timezone.localtime(noturno.fim_em), timezone.make_aware(datetime(2024, 10, 1, 23, 0)))
+        self.assertEqual(madrugada.data_contabil, date(2024, 10, 3))
+
+        # Backfill da migração recompõe as linhas antigas (sem instantes)
+        Apontamento.objects.update(inicio_em=None, fim_em=None, data_contabil=None)
+        importlib.import_module('produtividade.migrations.0040_backfill_instantes').preencher_instantes(apps, None)
+        madrugada.refresh_from_db()
+        self.assertEqual(
+            (timezone.localtime(madrugada.inicio_em), madrugada.data_contabil),
+            (timezone.make_aware(datetime(2024, 10, 3, 7, 0)), date(2024, 10, 3)),
+        )
+
+    def test_conflitos_e_interjornada_por_faixa_de_instantes(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .services import ConflitoHorarioService
+        from .utils import calcular_regras_clt
+
+        noturno = self._apontar(date(2024, 10, 1), time(20, 0), time(1, 0))
+        manha = self._apontar(date(2024, 10, 2), time(7, 0), time(9, 0))
+        calcular_regras_clt(self.colab, date(2024, 10, 2))
+        manha.refresh_from_db()
+        self.assertTrue(manha.flag_atencao)
+        self.assertIn("Interjornada de 06:00h", manha.motivo_alerta)
+
+        # Candidato na madrugada do dia seguinte colide com o turno que atravessou a meia-noite
+        with CaptureQueriesContext(connection) as ctx:
+            conflitos = ConflitoHorarioService.conflitos(self.colab, [(date(2024, 10, 2), time(0, 30), time(2, 0))])
+        self.assertEqual([(c['tipo'], c['apontamento'].pk) for c in conflitos], [('DIA_ANTERIOR', noturno.pk)])
+        self.assertIn('"inicio_em" >=', ctx.captured_queries[0]['sql'])
+
+
+class CheckinCronometroTest(TestCase):
+    """
+    START do cronômetro: timer aberto único garantido pelo banco, sem checagem prévia.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='tecnico', password='123')
+        self.colab = Colaborador.objects.create(nome_completo="Técnico", id_colaborador='K1', user_account=self.user)
+        self.obra = Projeto.objects.create(nome="Obra Timer", codigo="TM01")
+        self.client.force_login(self.user)
+
+    def _iniciar(self):
+        return self.client.post(reverse('produtividade:api_iniciar_cronometro'), {
+            'data_apontamento': timezone.localdate().strftime('%d/%m/%Y'),
+            'local_execucao': 'INT', 'projeto': self.obra.pk,
+        }).json()
+
+    def test_indice_unico_impede_segundo_timer_aberto(self):
+        from django.db import IntegrityError, transaction
+
+        Apontamento.objects.create(colaborador=self.colab, data_apontamento=date(2024, 8, 1), hora_inicio=time(8, 0))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Apontamento.objects.create(colaborador=self.colab, data_apontamento=date(2024, 8, 1), hora_inicio=time(9, 0))
+
+        # Encerrado não conta: novo timer liberado
+        Apontamento.objects.filter(colaborador=self.colab).update(hora_termino=time(9, 0))
+        Apontamento.objects.create(colaborador=self.colab, data_apontamento=date(2024, 8, 1), hora_inicio=time(10, 0))
+
+    def test_segundo_start_mapeado_para_mensagem(self):
+        primeiro = self._iniciar()
+        self.assertTrue(primeiro['success'])
+        apt = Apontamento.objects.get(pk=primeiro['id'])
+        self.assertEqual((apt.colaborador_id, apt.projeto_id, apt.hora_termino, apt.registrado_por_id), (self.colab.pk, self.obra.pk, None, self.user.pk))
+
+        segundo = self._iniciar()
+        self.assertEqual(segundo, {'success': False, 'error': 'Você já possui uma atividade em andamento.'})
+        self.assertEqual(Apontamento.objects.filter(colaborador=self.colab, hora_termino__isnull=True).count(), 1)
+
+    def test_start_nao_aceita_colaborador_fora_do_escopo(self):
+        outro = Colaborador.objects.create(nome_completo="Outro", id_colaborador='K2')
+        resposta = self.client.post(reverse('produtividade:api_iniciar_cronometro'), {
+            'colaborador': outro.pk, 'data_apontamento': timezone.localdate().strftime('%d/%m/%Y'), 'local_execucao': 'INT',
+        }).json()
+        self.assertFalse(resposta['success'])
+        self.assertFalse(Apontamento.objects.filter(colaborador=outro).exists())
+
+    def test_registro_de_timers_ativos(self):
+        from unittest import mock
+        from django.core.cache import cache
+        from .services import TimersAtivosService, ConflitoVersao
+
+        cache.clear()
+        self.assertFalse(self.client.get(reverse('produtividade:api_status_cronometro')).json()['ativo'])
+
+        inicio = self._iniciar()
+        TimersAtivosService.todos()
+        with self.assertNumQueries(0):
+            timer = TimersAtivosService.do_colaborador(self.colab.pk)
+        self.assertEqual((timer['id'], timer['projeto_nome']), (inicio['id'], "TM01 - Obra Timer"))
+
+        status = self.client.get(reverse('produtividade:api_status_cronometro')).json()
+        self.assertTrue(status['ativo'])
+        self.assertEqual(status['colaborador_id'], self.colab.pk)
+
+        # Quem está em campo: o Owner vê todos, o técnico só a si mesmo
+        outro = Colaborador.objects.create(nome_completo="Em Campo", id_colaborador='K3')
+        Apontamento.objects.create(colaborador=outro, data_apontamento=date(2024, 8, 1), hora_inicio=time(7, 0))
+        self.assertEqual(self.client.get(reverse('produtividade:api_timers_ativos')).json()['total'], 1)
+        self.client.force_login(User.objects.create_superuser(username='dono_timer', password='123'))
+        self.assertEqual(self.client.get(reverse('produtividade:api_timers_ativos')).json()['total'], 2)
+
+        # Parada sai do registro (disputa esgotada vira erro JSON, não 500)
+        self.client.force_login(self.user)
+        with mock.patch('produtividade.apis.VersaoApontamentoService.transicionar', side_effect=ConflitoVersao()):
+            resposta = self.client.post(reverse('produtividade:api_parar_cronometro')).json()
+        self.assertEqual(resposta, {'success': False, 'error': ConflitoVersao.MENSAGEM})
+        self.assertTrue(self.client.post(reverse('produtividade:api_parar_cronometro')).json()['success'])
+        self.assertFalse(self.client.get(reverse('produtividade:api_status_cronometro')).json()['ativo'])
+
+    def test_lancamento_manual_checa_banco_e_registro_so_muda_com_timer(self):
+        from django.core.cache import cache
+        from .services import TimersAtivosService
+
+        cache.clear()
+        TimersAtivosService.todos()
+        versao = cache.get(TimersAtivosService.CHAVE_VERSAO)
+
+        # Aprovação/edição de registro encerrado não descarta o registro da empresa
+        encerrado = Apontamento.objects.create(
+            colaborador=self.colab, projeto=self.obra, data_apontamento=date(2024, 8, 1),
+            hora_inicio=time(7, 0), hora_termino=time(8, 0),
+        )
+        encerrado.status_aprovacao = 'APROVADO'
+        encerrado.save()
+        self.assertEqual(cache.get(TimersAtivosService.CHAVE_VERSAO), versao)
+
+        # Timer aberto fora dos sinais (registro desatualizado): o POST manual ainda é barrado pelo banco
+        Apontamento.objects.bulk_create([Apontamento(colaborador=self.colab, data_apontamento=date(2024, 8, 2), hora_inicio=time(7, 0))])
+        self.assertIsNone(TimersAtivosService.do_colaborador(self.colab.pk))
+        resposta = self.client.post(reverse('produtividade:novo_apontamento'), {})
+        self.assertRedirects(resposta, reverse('produtividade:novo_apontamento'), fetch_redirect_response=False)
+
+        encerrado.hora_termino = time(9, 0)
+        encerrado.save()
+        self.assertNotEqual(cache.get(TimersAtivosService.CHAVE_VERSAO), versao)
+
+    async def test_canal_sse_empurra_timer_e_painel(self):
+        import json
+        from unittest import mock
+        from asgiref.sync import sync_to_async
+        from .services import TimersAtivosService
+
+        await sync_to_async(Apontamento.objects.create)(
+            colaborador=self.colab, projeto=self.obra, data_apontamento=date(2024, 8, 1), hora_inicio=time(7, 0),
+        )
+        dono = await sync_to_async(User.objects.create_superuser)(username='dono_sse', password='123')
+
+        async def eventos(user, url):
+            await self.async_client.aforce_login(user)
+            with mock.patch('produtividade.eventos.DURACAO_CONEXAO', 0):
+                response = await self.async_client.get(url)
+                self.assertEqual(response['Content-Type'], 'text/event-stream')
+                corpo = b''.join([parte async for parte in response.streaming_content]).decode()
+            return {
+                linhas[0][len('event: '):]: json.loads(linhas[1][len('data: '):])
+                for linhas in (bloco.split('\n') for bloco in corpo.split('\n\n')) if linhas[0].startswith('event: ')
+            }
+
+        recebidos = await eventos(self.user, reverse('produtividade:api_eventos_cronometro') + '?painel=1')
+        self.assertTrue(recebidos['timer']['ativo'])
+        self.assertNotIn('painel', recebidos)  # técnico sem setor não recebe o painel
+
+        recebidos = await eventos(dono, reverse('produtividade:api_eventos_cronometro') + '?painel=1')
+        self.assertEqual(recebidos['timer'], {'ativo': False})  # Owner sem colaborador vinculado: só o estado inicial
+        self.assertEqual(recebidos['painel'], {'ativos': 1, 'por_projeto': [{'projeto_id': self.obra.pk, 'projeto_nome': 'TM01 - Obra Timer', 'pessoas': 1}]})
+        self.assertEqual(TimersAtivosService.painel({}), {'ativos': 0, 'por_projeto': []})
+
+    def test_encerramento_em_lote_zera_timer_esquecido(self):
+        from unittest import mock
+        from django.db import transaction
+        from .services import EncerramentoTimersService
+
+        outro = Colaborador.objects.create(nome_completo="Recente", id_colaborador='KL8')
+        esquecido = Apontamento.objects.create(colaborador=self.colab, projeto=self.obra, data_apontamento=date(2024, 8, 1), hora_inicio=time(7, 0))
+        recente = Apontamento.objects.create(colaborador=outro, projeto=self.obra, data_apontamento=date(2024, 8, 3), hora_inicio=time(8, 0))
+        agora = timezone.make_aware(datetime(2024, 8, 3, 10, 0))
+
+        with mock.patch('produtividade.services.calcular_regras_clt') as clt, self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                abertos = EncerramentoTimersService.selecionar(agora=agora)
+                self.assertEqual(EncerramentoTimersService.encerrar(abertos, agora=agora), (2, 1))
+        clt.assert_called_once_with(outro.pk, date(2024, 8, 3))
+
+        # Aberto há 51h: duração zero e alerta, não 07:00 -> 10:00
+        esquecido.refresh_from_db()
+        self.assertEqual((esquecido.hora_termino, esquecido.fim_em), (time(7, 0), esquecido.inicio_em))
+        self.assertTrue(esquecido.flag_atencao)
+        self.assertEqual(esquecido.motivo_alerta, EncerramentoTimersService.MOTIVO_ESQUECIDO)
+
+        recente.refresh_from_db()
+        self.assertEqual((recente.hora_termino, recente.flag_atencao), (time(10, 0), False))
+
+    def test_encerramento_em_lote_por_setor(self):
+        from unittest import mock
+        from .models import Setor, LogAuditoria
+
+        setor = Setor.objects.create(nome="Equipe A")
+        equipe = [Colaborador.objects.create(nome_completo=f"Equipe {i}", id_colaborador=f'KL{i}', setor=setor) for i in range(3)]
+        fora = Colaborador.objects.create(nome_completo="Outro Setor", id_colaborador='KL9')
+        inicio = timezone.localtime() - timedelta(hours=1)
+        for colab in equipe + [fora]:
+            Apontamento.objects.create(colaborador=colab, projeto=self.obra, data_apontamento=inicio.date(), hora_inicio=inicio.time().replace(microsecond=0))
+
+        self.client.force_login(User.objects.create_superuser(username='dono_lote', password='123'))
+        url = reverse('produtividade:api_encerrar_timers_lote')
+        self.assertFalse(self.client.post(url).json()['success'])  # sem filtro e sem todos=1
+        for horas in ('inf', 'nan', '-5', '0'):
+            self.assertEqual(self.client.post(url, {'horas': horas}).json()['error'], 'Filtros inválidos.')
+
+        logs_antes = LogAuditoria.objects.count()
+        with mock.patch('produtividade.services.calcular_regras_clt') as clt, self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.post(url, {'setor_id': setor.pk}).json()
+
+        self.assertEqual((resposta['encerrados'], resposta['recalculos_clt']), (3, 3))
+        self.assertEqual(clt.call_count, 3)
+        self.assertEqual(Apontamento.objects.filter(hora_termino__isnull=True).get().colaborador, fora)
+        self.assertEqual(LogAuditoria.objects.count(), logs_antes + 1)
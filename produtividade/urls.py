@@ -55,6 +55,7 @@ urlpatterns = [
 
     # Painel de Auditoria
     path('painel-administrativo/auditoria/', views.dashboard_auditoria_view, name='dashboard_auditoria'),
+    path('painel-administrativo/auditoria/exportar-csv/', relatorios.exportar_auditoria_csv, name='exportar_auditoria_csv'),
 
     # ==========================================================================
     # FLUXO DE APROVAÇÃO (GERENTE)
@@ -62,6 +63,7 @@ urlpatterns = [
     path('aprovacoes/', views.aprovacao_dashboard_view, name='aprovacao_dashboard'),
     path('aprovacoes/<int:pk>/analise/', views.analise_apontamento_view, name='analise_apontamento'),
     path('aprovacoes/<int:pk>/processar/', views.processar_aprovacao_view, name='processar_aprovacao'),
+    path('aprovacoes/processar-lote/', views.processar_aprovacao_lote_view, name='processar_aprovacao_lote'),
 
     # ==========================================================================
     # APIs AJAX
@@ -71,9 +73,15 @@ urlpatterns = [
     path('api/get-auxiliares/', apis.get_auxiliares_ajax, name='get_auxiliares'), 
     path('api/get-centro-custo-info/<int:cc_id>/', apis.get_centro_custo_info_ajax, name='get_centro_custo_info_ajax'),
     path('api/get-calendar-status/', apis.get_calendar_status_ajax, name='get_calendar_status_ajax'),
+    path('api/buscar-usuarios/', apis.buscar_usuarios_ajax, name='buscar_usuarios'),
+    path('api/busca/<str:catalogo>/', apis.buscar_catalogo_ajax, name='buscar_catalogo'),
+    path('api/catalogo/', apis.api_catalogo, name='api_catalogo'),
     path('api/timer/start/', apis.api_iniciar_cronometro, name='api_iniciar_cronometro'),
     path('api/timer/stop/', apis.api_parar_cronometro, name='api_parar_cronometro'),
+    path('api/timer/stop/lote/', apis.api_encerrar_timers_lote, name='api_encerrar_timers_lote'),
     path('api/timer/status/', apis.api_status_cronometro, name='api_status_cronometro'),
+    path('api/timer/ativos/', apis.api_timers_ativos, name='api_timers_ativos'),
+    path('api/timer/eventos/', apis.api_eventos_cronometro, name='api_eventos_cronometro'),
 
     # ==========================================================================
     # INTEGRAÇÃO EXTERNA (Dashboard PHP)
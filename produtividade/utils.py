@@ -1,18 +1,26 @@
+from collections import defaultdict
 from datetime import datetime, time, date, timedelta
 from django.utils import timezone
+from django.db import transaction
 from django.db.models import Sum, Q
+from asgiref.local import Local
+from contextlib import contextmanager
 from .models import LogAuditoria
+from .identidade import obter_identidade
 import logging
+import unicodedata
 
 # ==============================================================================
 # LÓGICA DE CONTROLE DE ACESSO (RBAC)
 # ==============================================================================
 
+# Grupos e colaborador vêm da Identidade (resolvida uma vez por requisição, ver identidade.py)
+
 def is_owner(user):
     return user.is_superuser
 
 def check_group(user, group_name):
-    return user.groups.filter(name=group_name).exists()
+    return obter_identidade(user).tem_grupo(group_name)
 
 def is_coordenador(user):
     return check_group(user, 'COORDENADOR') or is_owner(user)
@@ -24,7 +32,24 @@ def is_gerente(user):
     return check_group(user, 'GESTOR') or is_owner(user)
 
 def pode_fazer_rateio(user):
-    return is_coordenador(user) or is_administrativo(user) or is_owner(user)
+    return obter_identidade(user).pode_ratear
+
+# ==============================================================================
+# HELPERS DE TEXTO
+# ==============================================================================
+
+def normalizar_texto(texto):
+    """
+    Remove acentos e coloca em caixa alta.
+    Ex: 'São Paulo' -> 'SAO PAULO'
+    """
+    if not texto: return ""
+    try:
+        texto_normalizado = unicodedata.normalize('NFD', texto.strip())
+        texto_sem_acento = ''.join(c for c in texto_normalizado if unicodedata.category(c) != 'Mn')
+        return texto_sem_acento.upper()
+    except Exception:
+        return texto.strip().upper()
 
 # ==============================================================================
 # HELPERS DE CÁLCULO
@@ -81,103 +106,103 @@ def calcular_regras_clt(colaborador, data_contabil_ref):
         data_contabil_ref + timedelta(days=1)
     ]
 
-    for data_contabil in datas_para_processar:
-        inicio_janela = timezone.make_aware(datetime.combine(data_contabil, time(6, 0)))
-        fim_janela = timezone.make_aware(datetime.combine(data_contabil + timedelta(days=1), time(5, 59, 59)))
-
-        apontamentos = list(Apontamento.objects.filter(
+    # Linhas travadas até o fim: dois recálculos simultâneos do mesmo colaborador não
+    # leem o mesmo flag_atencao antigo e não aplicam duas vezes a variação no contador de alertas
+    with transaction.atomic():
+        # Uma consulta pelo índice (colaborador, data_contabil) cobre os três dias e os dois anteriores (interjornada)
+        por_dia = defaultdict(list)
+        for apt in Apontamento.objects.filter(
             colaborador=colaborador,
-            data_apontamento__range=(data_contabil, data_contabil + timedelta(days=1))
-        ).order_by('data_apontamento', 'hora_inicio'))
+            data_contabil__range=(data_contabil_ref - timedelta(days=3), data_contabil_ref + timedelta(days=1))
+        ).select_for_update().order_by('inicio_em', 'id'):
+            por_dia[apt.data_contabil].append(apt)
 
-        apontamentos_validos = []
-        for apt in apontamentos:
-            dt_ini = timezone.make_aware(datetime.combine(apt.data_apontamento, apt.hora_inicio))
-            if inicio_janela <= dt_ini <= fim_janela:
-                apontamentos_validos.append(apt)
+        for data_contabil in datas_para_processar:
+            apontamentos_validos = por_dia[data_contabil]
 
-        alerts_map = {apt.id: [] for apt in apontamentos_validos}
+            alerts_map = {apt.id: [] for apt in apontamentos_validos}
         
-        # --- Regra Limite Diário (10:48h) ---
-        total_segundos = 0
-        for apt in apontamentos_validos:
-            total_segundos += _calcular_segundos(apt)
+            # --- Regra Limite Diário (10:48h) ---
+            total_segundos = 0
+            for apt in apontamentos_validos:
+                total_segundos += _calcular_segundos(apt)
         
-        limite_diario_segundos = (10 * 3600) + (48 * 60)
+            limite_diario_segundos = (10 * 3600) + (48 * 60)
         
-        if total_segundos > limite_diario_segundos:
-            msg = f"Jornada total ({_fmt_duracao(total_segundos)}) excedeu as 02:00h adicionais diária"
-            for apt in apontamentos_validos:
-                alerts_map[apt.id].append(msg)
-
-        # --- Regra Intervalo Intrajornada (Max 6h contínuas) ---
-        tempo_continuo = 0
-        last_end = None
+            if total_segundos > limite_diario_segundos:
+                msg = f"Jornada total ({_fmt_duracao(total_segundos)}) excedeu as 02:00h adicionais diária"
+                for apt in apontamentos_validos:
+                    alerts_map[apt.id].append(msg)
+
+            # --- Regra Intervalo Intrajornada (Max 6h contínuas) ---
+            tempo_continuo = 0
+            last_end = None
         
-        for i, apt in enumerate(apontamentos_validos):
-            duracao = _calcular_segundos(apt)
-            dt_ini = _to_dt(apt.data_apontamento, apt.hora_inicio)
+            for i, apt in enumerate(apontamentos_validos):
+                duracao = _calcular_segundos(apt)
             
-            if last_end and dt_ini == last_end:
-                tempo_continuo += duracao
-            else:
-                tempo_continuo = duracao
+                if last_end and apt.inicio_em == last_end:
+                    tempo_continuo += duracao
+                else:
+                    tempo_continuo = duracao
             
-            last_end = _to_dt(apt.data_apontamento, apt.hora_termino)
-            if last_end < dt_ini: last_end += timedelta(days=1)
-
-            if tempo_continuo > (6 * 3600):
-                alerts_map[apt.id].append("Trabalho contínuo superior a 06:00h sem intervalo.")
-
-        # --- Regra Descanso Interjornada (11h) ---
-        dia_anterior_contabil = data_contabil - timedelta(days=1)
-        ini_prev = timezone.make_aware(datetime.combine(dia_anterior_contabil, time(6, 0)))
-        fim_prev = timezone.make_aware(datetime.combine(data_contabil, time(5, 59, 59)))
-        
-        last_apt_prev = Apontamento.objects.filter(
-            colaborador=colaborador,
-            data_apontamento__range=(dia_anterior_contabil, data_contabil)
-        ).order_by('-data_apontamento', '-hora_termino')
-        
-        ultimo_dia_anterior = None
-        for cand in last_apt_prev:
-            dt_end_cand = _to_dt_full(cand)
-            if ini_prev <= dt_end_cand <= fim_prev:
-                ultimo_dia_anterior = cand
-                break
+                # Timer em andamento não tem fim: nada pode ser contínuo a ele
+                last_end = apt.fim_em
+
+                if tempo_continuo > (6 * 3600):
+                    alerts_map[apt.id].append("Trabalho contínuo superior a 06:00h sem intervalo.")
+
+            # --- Regra Descanso Interjornada (11h) ---
+            # Último término dentro do dia contábil anterior (timer aberto conta pelo início)
+            ini_prev = timezone.make_aware(datetime.combine(data_contabil - timedelta(days=1), time(6, 0)))
+            fim_prev = timezone.make_aware(datetime.combine(data_contabil, time(5, 59, 59)))
+
+            ultimo_dia_anterior = None
+            for cand in por_dia[data_contabil - timedelta(days=2)] + por_dia[data_contabil - timedelta(days=1)]:
+                dt_end_cand = cand.fim_em or cand.inicio_em
+                if ini_prev <= dt_end_cand <= fim_prev and (
+                    ultimo_dia_anterior is None or dt_end_cand > (ultimo_dia_anterior.fim_em or ultimo_dia_anterior.inicio_em)
+                ):
+                    ultimo_dia_anterior = cand
         
-        if ultimo_dia_anterior and apontamentos_validos:
-            primeiro_dia_atual = apontamentos_validos[0]
+            if ultimo_dia_anterior and apontamentos_validos:
+                primeiro_dia_atual = apontamentos_validos[0]
             
-            if ultimo_dia_anterior.hora_termino:
-                dt_fim_ant = _to_dt_full(ultimo_dia_anterior)
-                
-                d_atual = primeiro_dia_atual.data_apontamento
-                h_atual = primeiro_dia_atual.hora_inicio
-                dt_ini_atual_naive = datetime.combine(d_atual, h_atual)
-                dt_ini_atual = timezone.make_aware(dt_ini_atual_naive) if timezone.is_naive(dt_ini_atual_naive) else dt_ini_atual_naive
+                if ultimo_dia_anterior.fim_em:
+                    diff = primeiro_dia_atual.inicio_em - ultimo_dia_anterior.fim_em
                 
-                diff = dt_ini_atual - dt_fim_ant
-                
-                if diff.total_seconds() > 0 and diff.total_seconds() < (11 * 3600):
-                    msg = f"Descanso Interjornada de {_fmt_duracao(diff.total_seconds())} (Mínimo 11h)."
-                    alerts_map[primeiro_dia_atual.id].append(msg)
-
-        updates = []
-        for apt in apontamentos_validos:
-            msgs = alerts_map[apt.id]
-            novo_flag = len(msgs) > 0
-            novo_motivo = " | ".join(msgs) if msgs else None
+                    if diff.total_seconds() > 0 and diff.total_seconds() < (11 * 3600):
+                        msg = f"Descanso Interjornada de {_fmt_duracao(diff.total_seconds())} (Mínimo 11h)."
+                        alerts_map[primeiro_dia_atual.id].append(msg)
+
+            updates = []
+            variacao_alertas = 0
+            for apt in apontamentos_validos:
+                msgs = alerts_map[apt.id]
+                novo_flag = len(msgs) > 0
+                novo_motivo = " | ".join(msgs) if msgs else None
             
-            if apt.flag_atencao != novo_flag or apt.motivo_alerta != novo_motivo:
-                apt.flag_atencao = novo_flag
-                apt.motivo_alerta = novo_motivo
-                updates.append(apt)
+                if apt.flag_atencao != novo_flag or apt.motivo_alerta != novo_motivo:
+                    variacao_alertas += int(novo_flag) - int(apt.flag_atencao)
+                    apt.flag_atencao = novo_flag
+                    apt.motivo_alerta = novo_motivo
+                    updates.append(apt)
         
-        if updates:
-            Apontamento.objects.bulk_update(updates, ['flag_atencao', 'motivo_alerta'])
+            if updates:
+                Apontamento.objects.bulk_update(updates, ['flag_atencao', 'motivo_alerta'])
+            if variacao_alertas:
+                _ajustar_contador_alertas(colaborador, variacao_alertas)
 
 # --- Helpers Privados para Engine ---
+def _ajustar_contador_alertas(colaborador, variacao):
+    """bulk_update não dispara sinais: leva a variação de alertas CLT ao contador do setor."""
+    from .models import Colaborador
+    from .services import ContadoresSetorService
+
+    colaborador_id = getattr(colaborador, 'pk', colaborador)
+    setor_id = Colaborador.objects.filter(pk=colaborador_id).values_list('setor_id', flat=True).first()
+    ContadoresSetorService.aplicar({setor_id: [0, 0, variacao]})
+
 def _calcular_segundos(apt):
     if not apt.hora_inicio or not apt.hora_termino:
         return 0
@@ -187,24 +212,6 @@ def _calcular_segundos(apt):
     if fim < ini: fim += timedelta(days=1)
     return (fim - ini).total_seconds()
 
-def _to_dt(data, hora):
-    return datetime.combine(data, hora)
-
-def _to_dt_full(apt):
-    d = apt.data_apontamento
-    h = apt.hora_termino
-    
-    if not h:
-        h = apt.hora_inicio 
-
-    dt = datetime.combine(d, h)
-    
-    if apt.hora_inicio and h < apt.hora_inicio:
-        dt += timedelta(days=1)
-    if timezone.is_naive(dt):
-        return timezone.make_aware(dt)
-    return dt
-
 def _fmt_duracao(segundos):
     h = int(segundos // 3600)
     m = int((segundos % 3600) // 60)
@@ -232,24 +239,78 @@ def get_client_ip(request):
         ip = request.META.get('REMOTE_ADDR')
     return ip
 
-def registrar_log(request, acao, modelo, obj_id, detalhes):
+# --- Buffer de Auditoria (1 INSERT por requisição) ---
+# Os logs gerados durante uma requisição (ou bloco `buffer_auditoria`) são acumulados
+# e gravados juntos com bulk_create ao final. Fora de um buffer, a gravação é imediata.
+_contexto_auditoria = Local()
+
+@contextmanager
+def buffer_auditoria():
     """
-    Função helper para salvar logs de qualquer lugar do sistema.
+    Acumula os logs de auditoria gerados no bloco e grava todos com um único bulk_create ao sair.
+    Blocos aninhados reaproveitam o buffer mais externo.
     """
+    if getattr(_contexto_auditoria, 'buffer', None) is not None:
+        yield _contexto_auditoria.buffer
+        return
+
+    _contexto_auditoria.buffer = []
     try:
-        ip = get_client_ip(request)
-        
-        user = None
-        if request and hasattr(request, 'user') and request.user.is_authenticated:
-            user = request.user
-        
-        LogAuditoria.objects.create(
-            usuario=user,
-            acao=acao,
-            modelo_afetado=modelo,
-            objeto_id=str(obj_id) if obj_id else None,
-            detalhes=detalhes,
-            ip_address=ip
-        )
+        yield _contexto_auditoria.buffer
+    finally:
+        pendentes = _contexto_auditoria.buffer
+        _contexto_auditoria.buffer = None
+        gravar_logs(pendentes)
+
+def gravar_logs(logs):
+    """Persiste uma lista de LogAuditoria (não salvos) em um único INSERT."""
+    if not logs:
+        return
+    try:
+        LogAuditoria.objects.bulk_create(logs)
     except Exception as e:
-        logger.error(f"FALHA CRÍTICA DE AUDITORIA: Não foi possível salvar o log. Detalhes: {e}", exc_info=True)
\ No newline at end of file
+        logger.error(f"FALHA CRÍTICA DE AUDITORIA: Não foi possível salvar {len(logs)} logs. Detalhes: {e}", exc_info=True)
+
+def _adicionar_ao_buffer(log):
+    buffer = getattr(_contexto_auditoria, 'buffer', None)
+    if buffer is not None:
+        buffer.append(log)
+    else:
+        gravar_logs([log])
+
+def enfileirar_log(sincrono=False, **campos):
+    """
+    Registra um LogAuditoria com os campos informados.
+    - sincrono=True: grava imediatamente (ações críticas que precisam de escrita durável).
+    - Dentro de transação: só entra no buffer se a transação for confirmada (rollback descarta o log).
+    """
+    try:
+        log = LogAuditoria(**campos)
+
+        if sincrono:
+            log.save()
+        elif transaction.get_connection().in_atomic_block:
+            transaction.on_commit(lambda: _adicionar_ao_buffer(log))
+        else:
+            _adicionar_ao_buffer(log)
+    except Exception as e:
+        logger.error(f"FALHA CRÍTICA DE AUDITORIA: Não foi possível salvar o log. Detalhes: {e}", exc_info=True)
+
+def registrar_log(request, acao, modelo, obj_id, detalhes, sincrono=False):
+    """
+    Função helper para salvar logs de qualquer lugar do sistema.
+    Por padrão o log é gravado em lote ao final da requisição; use `sincrono=True` para gravação imediata.
+    """
+    user = None
+    if request and hasattr(request, 'user') and request.user.is_authenticated:
+        user = request.user
+
+    enfileirar_log(
+        sincrono=sincrono,
+        usuario=user,
+        acao=acao,
+        modelo_afetado=modelo,
+        objeto_id=str(obj_id) if obj_id else None,
+        detalhes=detalhes,
+        ip_address=get_client_ip(request)
+    )
@@ -6,13 +6,12 @@ from django.db.models import Q, F, Sum
 from django.db import transaction
 from django.utils import timezone
 from django.forms.models import model_to_dict
-from datetime import timedelta, datetime, date, time
+from datetime import timedelta, datetime, date
 from collections import defaultdict
-import uuid
 from .forms import ApontamentoForm
-from .models import Apontamento, LogAuditoria, Projeto, Colaborador, Veiculo, CodigoCliente, ApontamentoHistorico, CentroCusto, Notificacao, Feriado
-from .utils import (is_owner, is_gerente, pode_fazer_rateio, distribuir_horarios_com_gap, calcular_regras_clt, get_data_contabil, registrar_log)
-from .services import ControlePontoService, FeriadoService, WhatsAppService
+from .models import Apontamento, Colaborador, Veiculo, Notificacao, TarefaAgendada
+from .utils import (is_owner, is_gerente, pode_fazer_rateio, calcular_regras_clt, registrar_log)
+from .services import ControlePontoService, FeriadoService, WhatsAppService, NotificacaoService, ArquivoAuditoriaService, TrilhaAuditoriaService, RateioService, DiffSnapshotService, HistoricoVersaoService, TimersAtivosService, FilaAprovacaoService, VersaoApontamentoService, ConflitoVersao, ContadoresSetorService
 
 # ==============================================================================
 # 1. VIEWS DE NAVEGAÇÃO E OPERAÇÕES
@@ -29,7 +28,9 @@ def home_view(request):
 
     context = {
         'is_gestor': is_gestor,
-        'is_owner': is_owner_user
+        'is_owner': is_owner_user,
+        # Badges do menu: leitura direta dos contadores por setor
+        'contadores': ContadoresSetorService.resumo(request.identidade) if is_gestor else None,
     }
     return render(request, 'produtividade/home.html', context)
 
@@ -47,15 +48,17 @@ def apontamento_atividade_view(request):
     colaborador_atual = None
     if request.user.is_authenticated:
         try:
-            colaborador_atual = getattr(request.user, 'colaborador', None) or Colaborador.objects.get(user_account=request.user)
-        except (Colaborador.DoesNotExist, AttributeError):
+            colaborador_atual = request.identidade.obter_colaborador()
+        except Colaborador.DoesNotExist:
             pass
 
     if request.method == 'POST':
 
+        # Lançamento manual tem término: o índice de timer único não o barra, então a checagem vai ao banco
         if colaborador_atual and Apontamento.objects.filter(colaborador=colaborador_atual, hora_termino__isnull=True).exists():
             messages.error(request, "Você possui uma atividade em andamento (Check-in). Finalize-a antes de iniciar outra.")
             return redirect('produtividade:novo_apontamento')
+        timer_ativo = None
 
         form = ApontamentoForm(request.POST, **user_kwargs)
         if form.is_valid():
@@ -91,8 +94,6 @@ def apontamento_atividade_view(request):
             is_rateio = user_can_rateio and (form.cleaned_data.get('registrar_multiplas_obras') or extras_obras_str)
 
             if is_rateio:
-                agrupamento_uid = str(uuid.uuid4()) 
-
                 principal_str = ""
                 if apontamento.projeto: principal_str = f"P_{apontamento.projeto.id}"
                 elif apontamento.codigo_cliente: principal_str = f"C_{apontamento.codigo_cliente.id}"
@@ -106,65 +107,15 @@ def apontamento_atividade_view(request):
                     messages.success(request, "Registro salvo (único).")
                     return redirect('produtividade:novo_apontamento')
 
-                horarios = distribuir_horarios_com_gap(apontamento.hora_inicio, apontamento.hora_termino, len(todas_obras_raw))
                 aux_extras_str = form.cleaned_data.get('auxiliares_extras_list')
                 ids_aux_list = [int(x) for x in aux_extras_str.split(',') if x.strip().isdigit()] if aux_extras_str else []
-                contagem_sucesso = 0
+                if not form.cleaned_data.get('registrar_auxiliar'):
+                    ids_aux_list = []
 
                 try:
                     with transaction.atomic():
-                        for idx, item_hibrido in enumerate(todas_obras_raw):
-                            if '_' not in item_hibrido: continue
-                            prefixo, obj_id_str = item_hibrido.split('_')
-                            obj_id = int(obj_id_str)
-
-                            novo_registro = Apontamento()
-                            novo_registro.colaborador = apontamento.colaborador
-                            novo_registro.data_apontamento = apontamento.data_apontamento
-                            novo_registro.local_execucao = apontamento.local_execucao
-                            novo_registro.veiculo = apontamento.veiculo
-                            novo_registro.veiculo_manual_modelo = apontamento.veiculo_manual_modelo
-                            novo_registro.veiculo_manual_placa = apontamento.veiculo_manual_placa
-                            novo_registro.auxiliar = apontamento.auxiliar
-                            novo_registro.ocorrencias = apontamento.ocorrencias
-                            novo_registro.em_plantao = apontamento.em_plantao
-                            novo_registro.data_plantao = apontamento.data_plantao
-                            novo_registro.dorme_fora = apontamento.dorme_fora
-                            novo_registro.data_dorme_fora = apontamento.data_dorme_fora
-                            novo_registro.latitude = apontamento.latitude
-                            novo_registro.longitude = apontamento.longitude
-                            novo_registro.registrado_por = request.user
-                            novo_registro.status_aprovacao = 'EM_ANALISE'
-                            novo_registro.contagem_edicao = 0
-                            novo_registro.id_agrupamento = agrupamento_uid 
-
-                            if idx < len(horarios):
-                                novo_registro.hora_inicio = horarios[idx][0]
-                                novo_registro.hora_termino = horarios[idx][1]
-                            
-                            if prefixo == 'P':
-                                if not Projeto.objects.filter(pk=obj_id).exists(): continue
-                                novo_registro.projeto_id = obj_id; novo_registro.codigo_cliente = None
-                            elif prefixo == 'C':
-                                if not CodigoCliente.objects.filter(pk=obj_id).exists(): continue
-                                novo_registro.codigo_cliente_id = obj_id; novo_registro.projeto = None
-                            
-                            novo_registro.save()
-
-                            try:
-                                nome_obra = novo_registro.projeto.nome if novo_registro.projeto else (novo_registro.codigo_cliente.nome if novo_registro.codigo_cliente else "Obra Indefinida")
-                                detalhe_log = f"Rateio automático criado: {nome_obra} | Horário: {novo_registro.hora_inicio} - {novo_registro.hora_termino}"
-                                registrar_log(request, 'CRIACAO', 'Apontamento', novo_registro.id, detalhe_log)
-                            except Exception: pass
-
-                            dt_contabil = get_data_contabil(timezone.make_aware(datetime.combine(novo_registro.data_apontamento, novo_registro.hora_inicio)))
-                            calcular_regras_clt(novo_registro.colaborador, dt_contabil)
-
-                            contagem_sucesso += 1
-                            if form.cleaned_data.get('registrar_auxiliar') and ids_aux_list:
-                                novo_registro.auxiliares_extras.set(ids_aux_list)
-                
-                    messages.success(request, f"Rateio realizado com sucesso: {contagem_sucesso} registros criados.")
+                        criados = RateioService.criar(apontamento, todas_obras_raw, ids_aux_list, request=request)
+                    messages.success(request, f"Rateio realizado com sucesso: {len(criados)} registros criados.")
                 
                 except Exception as e:
                     messages.error(request, f"Erro ao salvar rateio (nenhum registro foi criado): {e}")
@@ -183,8 +134,7 @@ def apontamento_atividade_view(request):
                 except Exception as log_err:
                     print(f"Falha silenciosa ao gravar log: {log_err}")
                     
-                dt_contabil = get_data_contabil(timezone.make_aware(datetime.combine(apontamento.data_apontamento, apontamento.hora_inicio)))
-                calcular_regras_clt(apontamento.colaborador, dt_contabil)
+                calcular_regras_clt(apontamento.colaborador, apontamento.data_contabil)
                 if form.cleaned_data.get('registrar_auxiliar'):
                     ids_string = form.cleaned_data.get('auxiliares_extras_list')
                     if ids_string:
@@ -198,9 +148,11 @@ def apontamento_atividade_view(request):
                 messages.success(request, f"Registro de {apontamento.colaborador} salvo com sucesso!")
                 return redirect('produtividade:novo_apontamento')
     else:
+        # Renderização: o registro de timers abertos em cache basta
+        timer_ativo = TimersAtivosService.do_colaborador(colaborador_atual.pk) if colaborador_atual else None
         apontamento_ativo = None
-        if colaborador_atual:
-            apontamento_ativo = Apontamento.objects.filter(colaborador=colaborador_atual, hora_termino__isnull=True).order_by('-id').first()
+        if timer_ativo:
+            apontamento_ativo = Apontamento.objects.filter(pk=timer_ativo['id']).first()
 
         if apontamento_ativo:
             initial_data = model_to_dict(apontamento_ativo)
@@ -234,7 +186,7 @@ def apontamento_atividade_view(request):
         'titulo': 'Timesheet',
         'subtitulo': 'Preencha os dados de horário e local de trabalho.',
         'is_editing': False,
-        'atividade_em_andamento': True if (colaborador_atual and Apontamento.objects.filter(colaborador=colaborador_atual, hora_termino__isnull=True).exists()) else False
+        'atividade_em_andamento': bool(timer_ativo)
     }
     return render(request, 'produtividade/apontamento_form.html', context)
 
@@ -295,11 +247,10 @@ def historico_apontamentos_view(request):
     # --- Regra de Visualização ---
     if eh_gestor and not eh_owner:
         try:
-            gerente_profile = Colaborador.objects.get(user_account=user)
-            meus_setores = gerente_profile.setores_gerenciados.all()
+            gerente_profile = request.identidade.obter_colaborador()
             
             filtro_proprio = Q(colaborador=gerente_profile)
-            filtro_alertas_equipe = Q(colaborador__setor__in=meus_setores, flag_atencao=True)
+            filtro_alertas_equipe = Q(colaborador__setor_id__in=request.identidade.setores_gerenciados_ids, flag_atencao=True)
 
             queryset = queryset.filter(filtro_proprio | filtro_alertas_equipe)
             
@@ -315,9 +266,9 @@ def historico_apontamentos_view(request):
 
     if not pode_ver_alertas:
         try:
-            colab = Colaborador.objects.get(user_account=user)
+            colab = request.identidade.obter_colaborador()
             queryset = queryset.filter(Q(registrado_por=user) | Q(colaborador=colab))
-        except:
+        except Colaborador.DoesNotExist:
             queryset = queryset.filter(registrado_por=user)
         
         limit_date = timezone.now().date() - timedelta(days=30)
@@ -483,55 +434,52 @@ def editar_apontamento_view(request, pk):
         return redirect('produtividade:historico_apontamentos')
 
     user_kwargs = {'user': request.user, 'instance': apontamento}
+    versao = apontamento.versao
 
     if request.method == 'POST':
-        dados_originais = model_to_dict(apontamento, exclude=['auxiliares_extras', 'user_account'])
-        
-        for k, v in dados_originais.items():
-            if isinstance(v, (datetime, date, time)): 
-                dados_originais[k] = v.isoformat()
-            elif isinstance(v, timedelta): 
-                dados_originais[k] = str(v)
+        # Capturado antes do form: a validação já altera a instância em memória
+        dados_originais = HistoricoVersaoService.capturar(apontamento)
+        # Versão que o usuário tinha na tela ao abrir o formulário
+        versao = VersaoApontamentoService.versao_enviada(request.POST.get('versao'), apontamento)
 
         form = ApontamentoForm(request.POST, **user_kwargs)
         if form.is_valid():
-            with transaction.atomic():
-                ApontamentoHistorico.objects.create(
-                    apontamento_original=apontamento,
-                    dados_snapshot=dados_originais,
-                    editado_por=user,
-                    numero_edicao=apontamento.contagem_edicao + 1
-                )
-
-                obj = form.save(commit=False)
-                obj.contagem_edicao += 1
-                obj.status_aprovacao = 'EM_ANALISE'
-                obj.motivo_rejeicao = None
-                
-                if not form.cleaned_data.get('registrar_auxiliar'): obj.auxiliar = None
-                if not form.cleaned_data.get('registrar_veiculo'):
-                    obj.veiculo = None; obj.veiculo_manual_modelo = None; obj.veiculo_manual_placa = None
-                
-                obj.save()
-
-                registrar_log(
-                    request, 
-                    'EDICAO', 
-                    'Apontamento', 
-                    obj.id, 
-                    f"Edição realizada (Versão {obj.contagem_edicao})."
-                )
-
-                dt_contabil = get_data_contabil(timezone.make_aware(datetime.combine(obj.data_apontamento, obj.hora_inicio)))
-                calcular_regras_clt(obj.colaborador, dt_contabil)
-
-                if form.cleaned_data.get('registrar_auxiliar'):
-                    ids_string = form.cleaned_data.get('auxiliares_extras_list')
-                    if ids_string:
-                        ids_list = [int(x) for x in ids_string.split(',') if x.strip().isdigit()]
-                        obj.auxiliares_extras.set(ids_list)
+            try:
+                with transaction.atomic():
+                    obj = form.save(commit=False)
+                    obj.contagem_edicao += 1
+                    obj.status_aprovacao = 'EM_ANALISE'
+                    obj.motivo_rejeicao = None
+
+                    if not form.cleaned_data.get('registrar_auxiliar'): obj.auxiliar = None
+                    if not form.cleaned_data.get('registrar_veiculo'):
+                        obj.veiculo = None; obj.veiculo_manual_modelo = None; obj.veiculo_manual_placa = None
+
+                    # Só as colunas alteradas, condicionado à versão lida (aprovação/robô no meio = conflito)
+                    alterados = HistoricoVersaoService.delta(dados_originais, HistoricoVersaoService.capturar(obj))
+                    VersaoApontamentoService.gravar(obj, list(alterados), versao)
+                    HistoricoVersaoService.registrar_edicao(obj, dados_originais, user)
+
+                    registrar_log(
+                        request, 
+                        'EDICAO', 
+                        'Apontamento', 
+                        obj.id, 
+                        f"Edição realizada (Versão {obj.contagem_edicao})."
+                    )
+
+                    calcular_regras_clt(obj.colaborador, obj.data_contabil)
+
+                    if form.cleaned_data.get('registrar_auxiliar'):
+                        ids_string = form.cleaned_data.get('auxiliares_extras_list')
+                        if ids_string:
+                            ids_list = [int(x) for x in ids_string.split(',') if x.strip().isdigit()]
+                            obj.auxiliares_extras.set(ids_list)
+                        else: obj.auxiliares_extras.clear()
                     else: obj.auxiliares_extras.clear()
-                else: obj.auxiliares_extras.clear()
+            except ConflitoVersao as e:
+                messages.error(request, str(e))
+                return redirect('produtividade:editar_apontamento', pk=pk)
 
             messages.success(request, "Apontamento editado com sucesso! (Histórico salvo)")
             return redirect('produtividade:historico_apontamentos')
@@ -555,7 +503,8 @@ def editar_apontamento_view(request, pk):
         'titulo': 'Editar Apontamento',
         'subtitulo': f'Editando registro (Versão {apontamento.contagem_edicao + 1})',
         'is_editing': True,
-        'apontamento_id': pk
+        'apontamento_id': pk,
+        'versao': versao,
     }
     return render(request, 'produtividade/apontamento_form.html', context)
 
@@ -570,7 +519,7 @@ def solicitar_ajuste_view(request, pk):
     is_autor = apontamento.registrado_por == request.user
     is_colaborador = False
     try:
-        colab = Colaborador.objects.get(user_account=request.user)
+        colab = request.identidade.obter_colaborador()
         if apontamento.colaborador == colab:
             is_colaborador = True
     except Colaborador.DoesNotExist:
@@ -583,10 +532,17 @@ def solicitar_ajuste_view(request, pk):
     if request.method == 'POST':
         motivo = request.POST.get('motivo_texto')
         if motivo:
-            apontamento.motivo_ajuste = motivo
-            apontamento.status_aprovacao = 'SOLICITACAO_AJUSTE' 
-            apontamento.status_ajuste = 'PENDENTE' 
-            apontamento.save()
+            def solicitar(apt):
+                apt.motivo_ajuste = motivo
+                apt.status_aprovacao = 'SOLICITACAO_AJUSTE'
+                apt.status_ajuste = 'PENDENTE'
+                return ['motivo_ajuste', 'status_aprovacao', 'status_ajuste']
+
+            try:
+                VersaoApontamentoService.transicionar(pk, solicitar)
+            except ConflitoVersao as e:
+                messages.error(request, str(e))
+                return redirect('produtividade:historico_apontamentos')
 
             registrar_log(request, 'SOLICITACAO', 'Apontamento', pk, f"Solicitou ajuste. Motivo: {motivo}")
 
@@ -602,10 +558,11 @@ def excluir_apontamento_view(request, pk):
     """Exclusão de registro (Acesso Admin)."""
     apontamento = get_object_or_404(Apontamento, pk=pk)
     colaborador = apontamento.colaborador
-    dt_ref = get_data_contabil(timezone.make_aware(datetime.combine(apontamento.data_apontamento, apontamento.hora_inicio)))
+    dt_ref = apontamento.data_contabil
 
     detalhes = f"Exclusão realizada. Colab: {colaborador.nome_completo} | Data: {apontamento.data_apontamento} | ID Original: {pk}"
-    registrar_log(request, 'EXCLUSAO', 'Apontamento', pk, detalhes)
+    # Exclusão é irreversível: o log é gravado na hora, antes do delete
+    registrar_log(request, 'EXCLUSAO', 'Apontamento', pk, detalhes, sincrono=True)
 
     apontamento.delete()
     calcular_regras_clt(colaborador, dt_ref)
@@ -616,9 +573,17 @@ def excluir_apontamento_view(request, pk):
 @user_passes_test(is_owner)
 def aprovar_ajuste_view(request, pk):
     """Aprovação rápida de ajuste sem necessidade de edição."""
-    apontamento = get_object_or_404(Apontamento, pk=pk)
-    apontamento.status_ajuste = 'APROVADO'
-    apontamento.save()
+    get_object_or_404(Apontamento, pk=pk)
+
+    def aprovar(apt):
+        apt.status_ajuste = 'APROVADO'
+        return ['status_ajuste']
+
+    try:
+        VersaoApontamentoService.transicionar(pk, aprovar)
+    except ConflitoVersao as e:
+        messages.error(request, str(e))
+        return redirect('produtividade:historico_apontamentos')
 
     registrar_log(request, 'APROVACAO_AJUSTE', 'Apontamento', pk, "Owner aprovou a solicitação de ajuste pendente.")
 
@@ -643,28 +608,40 @@ def aprovacao_dashboard_view(request):
     """
 
     is_owner_user = is_owner(request.user)
-    if is_owner_user:
-        pendentes = Apontamento.objects.filter(
-            status_aprovacao='EM_ANALISE'
-        ).select_related('colaborador', 'projeto', 'centro_custo').order_by('-data_apontamento', 'colaborador', '-hora_termino')
-        
-    else:
-        try:
-            gerente = Colaborador.objects.get(user_account=request.user)
-            meus_setores = gerente.setores_gerenciados.all()
-            
-            pendentes = Apontamento.objects.filter(
-                status_aprovacao='EM_ANALISE',
-                colaborador__setor__in=meus_setores
-            ).exclude(colaborador=gerente).select_related('colaborador', 'projeto', 'centro_custo').order_by('-data_apontamento', 'colaborador', '-hora_termino')
-            
-        except Colaborador.DoesNotExist:
-            messages.error(request, "Seu usuário não está vinculado a um cadastro de Colaborador/Gestor.")
-            return redirect('produtividade:home_menu')
+    identidade = request.identidade
+    if not is_owner_user and identidade.colaborador is None:
+        messages.error(request, "Seu usuário não está vinculado a um cadastro de Colaborador/Gestor.")
+        return redirect('produtividade:home_menu')
+
+    filtros = {
+        'colaborador_id': request.GET.get('colaborador', ''),
+        'data_ini': request.GET.get('data_ini', ''),
+        'data_fim': request.GET.get('data_fim', ''),
+    }
+    cursor = request.GET.get('cursor')
+
+    # Paginação por cursor (data, id): cada página custa o mesmo, não importa a profundidade
+    consulta = FilaAprovacaoService.filtrar(FilaAprovacaoService.escopo(identidade), **filtros)
+    pendentes, proximo_cursor = FilaAprovacaoService.pagina(
+        consulta.select_related('colaborador', 'projeto', 'codigo_cliente', 'centro_custo'), cursor
+    )
+
+    # Coluna "o que mudou": diffs da página de uma vez (histórico + rótulos em lote)
+    editados = [item for item in pendentes if item.contagem_edicao > 0]
+    historicos = DiffSnapshotService.ultimos_historicos([item.pk for item in editados])
+    com_historico = [item for item in editados if item.pk in historicos]
+    diffs = DiffSnapshotService.comparar_historicos([(historicos[item.pk], item) for item in com_historico])
+    for item, alteracoes in zip(com_historico, diffs):
+        item.alteracoes = alteracoes
 
     context = {
         'is_owner': is_owner_user,
         'pendentes': pendentes,
+        'total_pendentes': FilaAprovacaoService.contagem_pendentes(identidade),
+        'contadores': ContadoresSetorService.resumo(identidade),
+        'cursor_atual': cursor,
+        'proximo_cursor': proximo_cursor,
+        'filtros': filtros,
         'titulo': 'Central de Aprovações'
     }
     return render(request, 'produtividade/aprovacao_dashboard.html', context)
@@ -672,140 +649,68 @@ def aprovacao_dashboard_view(request):
 
 @login_required
 @user_passes_test(is_gerente)
-def analise_apontamento_view(request, pk):
+def processar_aprovacao_lote_view(request):
     """
-    Tela detalhada para comparar a versão anterior com a atual (Diff Completo).
+    Aprova ou rejeita em lote: os itens marcados na página ou todas as pendências do filtro atual.
+    Só afeta registros ainda EM_ANALISE dentro do escopo do gestor.
     """
-    apontamento = get_object_or_404(Apontamento, pk=pk)
-    
-    def item_time_str(t): 
-        return t.strftime('%H:%M') if t else ""
-
-    historico = ApontamentoHistorico.objects.filter(apontamento_original=apontamento).order_by('-numero_edicao').first()
-    
-    diff_data = []
-    tem_alteracao = False
+    if request.method != 'POST':
+        return redirect('produtividade:aprovacao_dashboard')
 
-    if historico:
-        dados_antigos = historico.dados_snapshot
-        
-        def format_bool(val):
-            return "SIM" if val else "NÃO"
+    acao = request.POST.get('acao')
+    motivo = request.POST.get('motivo_rejeicao', '').strip()
+    identidade = request.identidade
 
-        def format_none(val):
-            return val if val else "-"
+    if acao not in FilaAprovacaoService.ACOES:
+        messages.error(request, "Ação inválida.")
+        return redirect('produtividade:aprovacao_dashboard')
+    if not motivo:
+        messages.error(request, "É obrigatório inserir um comentário/motivo para finalizar a análise.")
+        return redirect('produtividade:aprovacao_dashboard')
+    if not identidade.is_owner and identidade.colaborador is None:
+        messages.error(request, "Seu usuário não está vinculado a um cadastro de Colaborador/Gestor.")
+        return redirect('produtividade:home_menu')
+
+    consulta = FilaAprovacaoService.escopo(identidade)
+    if request.POST.get('aplicar_filtro') == '1':
+        consulta = FilaAprovacaoService.filtrar(
+            consulta,
+            colaborador_id=request.POST.get('colaborador', ''),
+            data_ini=request.POST.get('data_ini', ''),
+            data_fim=request.POST.get('data_fim', ''),
+        )
+    else:
+        ids = [int(x) for x in request.POST.getlist('ids') if x.isdigit()]
+        if not ids:
+            messages.error(request, "Selecione ao menos um registro.")
+            return redirect('produtividade:aprovacao_dashboard')
+        consulta = consulta.filter(pk__in=ids)
+
+    with transaction.atomic():
+        processados = FilaAprovacaoService.processar_lote(consulta, acao, motivo, request=request)
+
+    verbo = "APROVADOS" if acao == 'APROVAR' else "REJEITADOS"
+    if processados:
+        messages.success(request, f"{processados} registro(s) {verbo} com sucesso.")
+    else:
+        messages.warning(request, "Nenhum registro pendente foi alterado (já analisados por outro gestor?).")
+    return redirect('produtividade:aprovacao_dashboard')
 
-        def get_fk_name(ModelClass, pk):
-            if not pk: return "-"
-            try:
-                return str(ModelClass.objects.get(pk=pk))
-            except:
-                return f"(ID: {pk} removido)"
-
-        # --- 1. Comparação de Horários ---
-        h_ini_old = str(dados_antigos.get('hora_inicio', ''))[:5]
-        h_ini_new = item_time_str(apontamento.hora_inicio)
-        if h_ini_old != h_ini_new:
-            diff_data.append({'campo': 'Hora Início', 'antes': h_ini_old, 'depois': h_ini_new, 'icon': 'clock'})
-
-        h_fim_old = str(dados_antigos.get('hora_termino', ''))[:5]
-        h_fim_new = item_time_str(apontamento.hora_termino)
-        if h_fim_old != h_fim_new:
-            diff_data.append({'campo': 'Hora Término', 'antes': h_fim_old, 'depois': h_fim_new, 'icon': 'clock'})
-
-        # --- 2. Comparação de Local ---
-        local_old = dados_antigos.get('local_execucao')
-        local_new = apontamento.local_execucao
-        if local_old != local_new:
-            mapa = {'INT': 'DENTRO DA OBRA', 'EXT': 'FORA DA OBRA'}
-            diff_data.append({'campo': 'Local', 'antes': mapa.get(local_old, local_old), 'depois': mapa.get(local_new, local_new), 'icon': 'map'})
-
-        # --- 3. Comparação de Projeto ---
-        proj_old_id = dados_antigos.get('projeto')
-        proj_new_id = apontamento.projeto.id if apontamento.projeto else None
-        if proj_old_id != proj_new_id:
-            nome_old = get_fk_name(Projeto, proj_old_id)
-            nome_new = str(apontamento.projeto) if apontamento.projeto else "-"
-            diff_data.append({'campo': 'Projeto/Obra', 'antes': nome_old, 'depois': nome_new, 'icon': 'briefcase'})
-
-        # --- 4. Comparação de Cliente ---
-        cli_old_id = dados_antigos.get('codigo_cliente')
-        cli_new_id = apontamento.codigo_cliente.id if apontamento.codigo_cliente else None
-        if cli_old_id != cli_new_id:
-            nome_old = get_fk_name(CodigoCliente, cli_old_id)
-            nome_new = str(apontamento.codigo_cliente) if apontamento.codigo_cliente else "-"
-            diff_data.append({'campo': 'Cliente', 'antes': nome_old, 'depois': nome_new, 'icon': 'user'})
-
-        # --- 5. Comparação de Veículos ---
-        veic_old_id = dados_antigos.get('veiculo')
-        veic_new_id = apontamento.veiculo.id if apontamento.veiculo else None
-        
-        veic_man_placa_old = dados_antigos.get('veiculo_manual_placa')
-        veic_man_placa_new = apontamento.veiculo_manual_placa
 
-        if veic_old_id != veic_new_id:
-            nome_old = get_fk_name(Veiculo, veic_old_id)
-            nome_new = str(apontamento.veiculo) if apontamento.veiculo else "-"
-            diff_data.append({'campo': 'Veículo (Frota)', 'antes': nome_old, 'depois': nome_new, 'icon': 'truck'})
-        
-        if str(veic_man_placa_old) != str(veic_man_placa_new):
-             diff_data.append({'campo': 'Veículo (Externo/Placa)', 'antes': format_none(veic_man_placa_old), 'depois': format_none(veic_man_placa_new), 'icon': 'truck'})
-
-        # --- 6. Comparação de Plantão ---
-        if dados_antigos.get('em_plantao') != apontamento.em_plantao:
-            diff_data.append({
-                'campo': 'Em Plantão?', 
-                'antes': format_bool(dados_antigos.get('em_plantao')), 
-                'depois': format_bool(apontamento.em_plantao),
-                'icon': 'siren'
-            })
+@login_required
+@user_passes_test(is_gerente)
+def analise_apontamento_view(request, pk):
+    """
+    Tela detalhada para comparar a versão anterior com a atual (Diff Completo).
+    """
+    apontamento = get_object_or_404(Apontamento, pk=pk)
 
-        # --- 7. Comparação de Dorme-Fora ---
-        if dados_antigos.get('dorme_fora') != apontamento.dorme_fora:
-            diff_data.append({
-                'campo': 'Dorme Fora?', 
-                'antes': format_bool(dados_antigos.get('dorme_fora')), 
-                'depois': format_bool(apontamento.dorme_fora),
-                'icon': 'moon'
-            })
+    historico = DiffSnapshotService.ultimos_historicos([apontamento.pk]).get(apontamento.pk)
 
-        # --- 8. Comparação de Ocorreências
-        obs_old = str(dados_antigos.get('ocorrencias', '') or '').strip()
-        obs_new = str(apontamento.ocorrencias or '').strip()
-        if obs_old != obs_new:
-            diff_data.append({'campo': 'Observações', 'antes': obs_old, 'depois': obs_new, 'icon': 'pencil'})
-
-        # --- 9. Comparação de Centro de Custo ---
-        cc_old_id = dados_antigos.get('centro_custo')
-        cc_new_id = apontamento.centro_custo.id if apontamento.centro_custo else None
-        if cc_old_id != cc_new_id:
-            nome_old = get_fk_name(CentroCusto, cc_old_id)
-            nome_new = str(apontamento.centro_custo) if apontamento.centro_custo else "-"
-            diff_data.append({'campo': 'Centro de Custo', 'antes': nome_old, 'depois': nome_new, 'icon': 'map'})
-
-        # --- 10. Comparação de Modelo Veículo ---
-        mod_old = str(dados_antigos.get('veiculo_manual_modelo') or '')
-        mod_new = str(apontamento.veiculo_manual_modelo or '')
-        if mod_old != mod_new:
-            diff_data.append({'campo': 'Modelo Veículo (Manual)', 'antes': format_none(mod_old), 'depois': format_none(mod_new), 'icon': 'truck'})
-
-        # --- 11. Comparação de Auxiliar ---
-        aux_old_id = dados_antigos.get('auxiliar')
-        aux_new_id = apontamento.auxiliar.id if apontamento.auxiliar else None
-        if aux_old_id != aux_new_id:
-            nome_old = get_fk_name(Colaborador, aux_old_id)
-            nome_new = str(apontamento.auxiliar.nome_completo) if apontamento.auxiliar else "-"
-            diff_data.append({'campo': 'Auxiliar Principal', 'antes': nome_old, 'depois': nome_new, 'icon': 'user'})
-
-        # --- 12. Comparação de Data de Registro ---
-        data_old_str = str(dados_antigos.get('data_apontamento'))
-        data_new_str = apontamento.data_apontamento.strftime('%Y-%m-%d')
-        if data_old_str != data_new_str:
-             d_old_fmt = datetime.strptime(data_old_str, '%Y-%m-%d').strftime('%d/%m/%Y')
-             d_new_fmt = apontamento.data_apontamento.strftime('%d/%m/%Y')
-             diff_data.append({'campo': 'Data do Registro', 'antes': d_old_fmt, 'depois': d_new_fmt, 'icon': 'calendar'})
-
-        if diff_data: tem_alteracao = True   
+    diff_data = []
+    if historico:
+        diff_data = DiffSnapshotService.comparar_historicos([(historico, apontamento)])[0]
+    tem_alteracao = bool(diff_data)
 
     context = {
         'apontamento': apontamento,
@@ -832,20 +737,26 @@ def processar_aprovacao_view(request, pk):
         messages.error(request, "É obrigatório inserir um comentário/motivo para finalizar a análise.")
         return redirect('produtividade:analise_apontamento', pk=pk)
 
+    if acao not in FilaAprovacaoService.ACOES:
+        return redirect('produtividade:aprovacao_dashboard')
+
+    # A decisão vale para a versão que o gestor analisou: edição ou robô no meio do caminho = conflito
+    versao = VersaoApontamentoService.versao_enviada(request.POST.get('versao'), apontamento)
+    apontamento.status_aprovacao = FilaAprovacaoService.ACOES[acao][0]
+    apontamento.motivo_rejeicao = motivo
+    try:
+        VersaoApontamentoService.gravar(apontamento, ['status_aprovacao', 'motivo_rejeicao'], versao)
+    except ConflitoVersao as e:
+        messages.error(request, str(e))
+        return redirect('produtividade:analise_apontamento', pk=pk)
+
     if acao == 'APROVAR':
-        apontamento.status_aprovacao = 'APROVADO'
-        apontamento.motivo_rejeicao = motivo 
         messages.success(request, f"Registro APROVADO com sucesso.")
         registrar_log(request, 'APROVACAO', 'Apontamento', apontamento.id, "Apontamento aprovado pelo Gestor.")
-    
-    elif acao == 'REJEITAR':
-        apontamento.status_aprovacao = 'REJEITADO'
-        apontamento.motivo_rejeicao = motivo
+    else:
         messages.warning(request, f"Registro REJEITADO. O colaborador foi notificado.")
         registrar_log(request, 'REJEICAO', 'Apontamento', apontamento.id, f"Rejeitado. Motivo: {motivo}")
 
-    apontamento.save()
-    
     return redirect('produtividade:aprovacao_dashboard')
 
 
@@ -875,9 +786,14 @@ def dashboard_conformidade_view(request):
     lista_incompleto = []
     lista_ausente = []
 
-    feriado_obj = Feriado.objects.filter(data=data_ref).first()
-    nome_feriado_display = feriado_obj.descricao if feriado_obj else None
-    is_feriado = bool(feriado_obj)
+    nome_feriado_display = FeriadoService.nome_feriado(data_ref)
+    if not nome_feriado_display:
+        # Municipal de alguma cidade da equipe: mapas por ano/cidade já em cache, sem consulta por dia
+        for cidade, uf in sorted({(c.cidade, c.uf) for c in colaboradores if c.cidade and c.uf}):
+            nome_feriado_display = FeriadoService.feriados_municipais(ano, cidade, uf).get(data_ref)
+            if nome_feriado_display:
+                break
+    is_feriado = bool(nome_feriado_display)
     is_fim_de_semana = data_ref.weekday() >= 5
 
     for colab in colaboradores:
@@ -987,72 +903,9 @@ def notificar_pendencias_view(request):
         messages.error(request, "Data inválida para notificação.")
         return redirect('produtividade:dashboard_conformidade')
     
-    colaboradores = Colaborador.objects.filter(user_account__is_active=True)
-    
-    notificacoes_criar = []
-    count_criadas = 0
-
-    for colab in colaboradores:
-        if not colab.user_account:
-            continue
-
-        dados_ponto = ControlePontoService.obter_meta_do_dia(colab, data_ref)
-
-        if not dados_ponto['deve_notificar']:
-            continue
-
-        meta_segundos = dados_ponto['meta_segundos']
-        tolerancia = dados_ponto['tolerancia_segundos']
-
-        apontamentos = Apontamento.objects.filter(colaborador=colab, data_apontamento=data_ref)
-        total_segundos = 0
-        
-        for apt in apontamentos:
-            if apt.hora_inicio and apt.hora_termino:
-                dummy = date(2000, 1, 1)
-                dt_ini = datetime.combine(dummy, apt.hora_inicio)
-                dt_fim = datetime.combine(dummy, apt.hora_termino)
-                if dt_fim < dt_ini: dt_fim += timedelta(days=1)
-                total_segundos += (dt_fim - dt_ini).total_seconds()
-
-        if total_segundos == 0:
-            notificacoes_criar.append(Notificacao(
-                colaborador=colab,
-                titulo="Ausência de Registro",
-                mensagem=f"Olá {colab.nome_completo.split()[0]}, não identificamos apontamentos seus no dia {data_ref.strftime('%d/%m')}. Por favor, verifique.",
-                tipo='ALERTA',
-                data_referencia=data_ref
-            ))
-            count_criadas += 1
-            
-        elif total_segundos < (meta_segundos - tolerancia):
-            notificacoes_criar.append(Notificacao(
-                colaborador=colab,
-                titulo="Horas Incompletas",
-                mensagem=f"Olá {colab.nome_completo.split()[0]}, identificamos divergência nos horários registrados entre seu Tangerino e seu apontamento no Timesheet do dia {data_ref.strftime('%d/%m')}. Por favor, verifique seus envios.",
-                tipo='ALERTA',
-                data_referencia=data_ref
-            ))
-            count_criadas += 1
-
-    if notificacoes_criar:
-        Notificacao.objects.bulk_create(notificacoes_criar)
-
-        wpp_enviados = 0
-        for notif in notificacoes_criar:
-            if notif.tipo == 'ALERTA':
-                
-                msg_wpp = (
-                    f"*⚠️ Atenção*\n\n"
-                    f"Olá {notif.colaborador.nome_completo.split()[0]},\n"
-                    f"Há notificações no seu Timesheet referentes ao dia {notif.data_referencia.strftime('%d/%m/%Y')}.\n"
-                    f"Por favor, acesse o sistema para verificar."
-                )
-                
-                sucesso = WhatsAppService.enviar_notificacao_pendencia(notif.colaborador, msg_wpp)
-                if sucesso:
-                    wpp_enviados += 1
+    count_criadas, wpp_enviados = NotificacaoService.notificar_pendencias(data_ref)
 
+    if count_criadas:
         messages.success(request, f"Sucesso! {count_criadas} notificações foram enviadas. WhatsApp enviado para {wpp_enviados} colaboradores.")
     else:
         messages.info(request, "Nenhuma pendência encontrada para notificar neste dia (Dia ok ou folga/feriado).")
@@ -1067,8 +920,9 @@ def marcar_todas_lidas_view(request):
     """
     if request.method == 'POST':
         try:
-            colab = Colaborador.objects.get(user_account=request.user)
+            colab = request.identidade.obter_colaborador()
             Notificacao.objects.filter(colaborador=colab, lida=False).update(lida=True)
+            NotificacaoService.invalidar_cache([colab.id])
             messages.success(request, "Notificações marcadas como lidas.")
         except Colaborador.DoesNotExist:
             pass
@@ -1085,7 +939,7 @@ def responder_notificacao_view(request, pk):
         notif = get_object_or_404(Notificacao, pk=pk)
         
         try:
-            colab = Colaborador.objects.get(user_account=request.user)
+            colab = request.identidade.obter_colaborador()
             if notif.colaborador != colab:
                 messages.error(request, "Acesso negado.")
                 return redirect('produtividade:home_menu')
@@ -1176,7 +1030,9 @@ def painel_owner_view(request):
     Hub central de administração (Owner).
     """
     context = {
-        'titulo': 'Painel Administrativo'
+        'titulo': 'Painel Administrativo',
+        'tarefas_agendadas': TarefaAgendada.objects.all(),
+        'contadores': ContadoresSetorService.resumo(request.identidade),
     }
     return render(request, 'produtividade/owner_dashboard.html', context)
 
@@ -1184,32 +1040,38 @@ def painel_owner_view(request):
 @login_required
 @user_passes_test(is_owner)
 def dashboard_auditoria_view(request):
-    logs = LogAuditoria.objects.select_related('usuario').all().order_by('-data_hora')
-
     # --- Filtros ---
     user_id = request.GET.get('user')
     acao = request.GET.get('acao')
     data_ini = request.GET.get('data_ini')
-    
-    if user_id:
-        logs = logs.filter(usuario_id=user_id)
-    
-    if acao:
-        logs = logs.filter(acao=acao)
-        
-    if data_ini:
-        logs = logs.filter(data_hora__date=data_ini)
+    cursor = request.GET.get('cursor')
 
-    logs = logs[:200]
+    if user_id and not user_id.isdigit():
+        user_id = None
+
+    # Intervalo semiaberto [dia 00:00, dia+1 00:00): mantém o índice de data_hora utilizável
+    inicio, fim = TrilhaAuditoriaService.intervalo_por_datas(data_ini) if data_ini else (None, None)
+    if not inicio:
+        data_ini = None
+
+    # Paginação por cursor (data_hora, id); meses arquivados são mesclados pelo serviço
+    logs, proximo_cursor = TrilhaAuditoriaService.pagina(
+        usuario_id=user_id, acao=acao, inicio=inicio, fim=fim, cursor=cursor
+    )
+    consultou_arquivo = bool(inicio) and ArquivoAuditoriaService.intervalo_tem_arquivo(inicio, fim)
+
+    # Usuário do filtro: busca pontual (a lista completa vem do autocomplete)
+    usuario_filtro = User.objects.filter(pk=user_id).only('id', 'username', 'first_name').first() if user_id else None
 
-    usuarios = User.objects.all().order_by('username')
-    
     context = {
         'titulo': 'Trilha de Auditoria',
         'logs': logs,
-        'usuarios': usuarios,
+        'usuario_filtro': usuario_filtro,
         'filtro_user': int(user_id) if user_id else '',
         'filtro_acao': acao,
-        'filtro_data': data_ini
+        'filtro_data': data_ini,
+        'consultou_arquivo': consultou_arquivo,
+        'cursor_atual': cursor,
+        'proximo_cursor': proximo_cursor,
     }
     return render(request, 'produtividade/auditoria_dashboard.html', context)
\ No newline at end of file